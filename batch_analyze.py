@@ -0,0 +1,142 @@
+'''
+Batch analysis of many uploaded traces.
+
+Decoding, matching and placing the matches in time run in a process pool with one worker per core. Workers only import
+the parser and the profile store, match each trace with the same indexed store query (optionally
+behind the Bloom prefilter) as check_profiles_in_noisy_trace, and send back the matched
+[IP, frequency] lists with their reports (the same activity_reports as a single trace). The
+parent process writes a single report for the whole batch.
+
+Example usage:
+    python3 batch_analyze.py "incident_42/*.pcap"
+'''
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+
+from profile_store import open_profile_store
+
+TRACE_EXTENSIONS = tuple(ext + suffix for suffix in ("", ".gz", ".zst") for ext in (".pcap", ".pcapng", ".cap"))
+
+
+'''
+Function: find_traces
+Expands a directory or glob pattern into a sorted list of trace files.
+
+Parameters:
+    pattern - str, a directory (every trace in it is used) or a glob such as "uploads/*.pcap" ("**" recurses)
+Returns:
+    list of paths
+'''
+def find_traces(pattern):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*")
+    return sorted(path for path in glob(pattern, recursive=True)
+                  if path.endswith(TRACE_EXTENSIONS) and os.path.isfile(path))
+
+
+'''
+Function: match_trace
+Worker function: decodes (or loads the cached time index of) one trace, matches the chosen time
+window against the profiles and reports when each matched profile was active.
+
+Parameters:
+    job - tuple (path, names, backend, profile folder, use the trace cache, use the Bloom prefilter,
+          start, end, window), see batch_analyze
+Returns:
+    (path, {name: (matches, report)}, error message or None)
+'''
+def match_trace(job):
+    from get_traces import activity_reports, trace_time_index
+    path, names, backend, folder, cache, prefilter, start, end, window = job
+    try:
+        index = trace_time_index(path, backend, cache)
+        with open_profile_store(folder) as store:
+            matches = store.match(index.window_ips(start, end), names, prefilter)
+        return path, activity_reports(index, matches, names, window, start, end), None
+    except Exception as e:
+        return path, {}, f"{type(e).__name__}: {e}"
+
+
+'''
+Function: batch_analyze
+Matches every trace of a directory or glob against the built profiles in parallel and writes one report.
+
+Parameters:
+    pattern - str, directory or glob of traces
+    names - list of profile names to compare against, default every website profile
+    workers - int, number of worker processes, default the number of cores
+    backend - str, "native" (default) or "tshark"
+    report_path - str, where the combined report is written, default batch_report.txt
+    cache - bool, reuse the addresses of traces analyzed before from trace_cache/, default True
+    prefilter - bool, drop addresses that are in no profile with the store's Bloom filter first, default False
+                (only faster for large traces of mostly unprofiled addresses)
+    start, end - float, seconds since the epoch, only compare the packets of this part of every trace, default all
+    window - float, seconds per window when reporting when each profile was active, default 10
+Returns:
+    dictionary of {trace path: {name: (matches, report)}}, traces that failed are left out
+Example usage:
+    results = batch_analyze("uploads/", workers = 8)
+'''
+def batch_analyze(pattern, names = None, workers = None, backend = "native", report_path = "batch_report.txt",
+                  cache = True, prefilter = False, start = None, end = None, window = 10):
+    from get_traces import list_website_profiles
+
+    traces = find_traces(pattern)
+    if not traces:
+        print(f"Error in function batch_analyze: no traces found for {pattern}")
+        return {}
+
+    # a copy, profiles that can't be matched are dropped from it
+    names = list_website_profiles() if names is None else list(names)
+    # imports changed csvs and builds the prefilter once, before the workers open the store
+    with open_profile_store() as store:
+        for name in list(names):
+            if not store.has_profile(name):
+                print(f"Error in function batch_analyze, file ip_profiles/{name} does not exist")
+                names.remove(name)
+            elif not store.is_scored(name):
+                print(f"Error in function batch_analyze, profile {name} has no frequencies")
+                names.remove(name)
+        if prefilter:
+            store.prefilter()
+    workers = workers or os.cpu_count() or 1
+
+    started = time.time()
+    results = {}
+    errors = {}
+    jobs = [(path, names, backend, "ip_profiles", cache, prefilter, start, end, window) for path in traces]
+    with ProcessPoolExecutor(max_workers = min(workers, len(traces))) as executor:
+        for path, per_profile, error in executor.map(match_trace, jobs, chunksize = max(1, len(jobs) // (workers * 4))):
+            if error is not None:
+                errors[path] = error
+                continue
+            results[path] = per_profile
+    elapsed = time.time() - started
+
+    with open(report_path, "w") as f:
+        f.write(f"Batch report for {pattern}: {len(results)} trace(s) analyzed against {len(names)} profile(s) "
+                f"in {elapsed:.1f}s with {workers} worker(s)\n\n")
+        f.write("Summary (traces with at least one match per profile):\n")
+        for name in names:
+            hits = sum(1 for per_profile in results.values() if per_profile[name][0])
+            f.write(f"    {name}: {hits}/{len(results)}\n")
+        for path, error in errors.items():
+            f.write(f"    failed to read {path}: {error}\n")
+        for path, per_profile in results.items():
+            f.write(f"\n\n===== {path} =====\n")
+            for name, (matches, report) in per_profile.items():
+                if matches:
+                    f.write(f"{report}\n here are the matched ip addresses from our messy trace in profile and their respective frequency. Format: [IP, frequency]:::: {matches}\n\n")
+    print(f"Analyzed {len(results)} trace(s) in {elapsed:.1f}s, report written to {report_path}")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python3 batch_analyze.py <directory or glob> [workers]")
+        sys.exit(1)
+    batch_analyze(sys.argv[1], workers = int(sys.argv[2]) if len(sys.argv) > 2 else None)
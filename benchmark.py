@@ -0,0 +1,376 @@
+'''
+Benchmarks for parsing, profile building, filtering and matching.
+
+A synthetic workspace (traces, csv_files and ip_profiles folders, laid out like the real ones)
+is generated in a temporary directory at a chosen scale and the get_traces functions are timed
+inside it. The bundled traces (traces/test1.pcap, traces/google/google_trace1.pcap) are parsed
+and matched against the synthetic profiles as well.
+
+Every benchmark reports the best wall time of a few runs and the peak memory allocated by python
+(tracemalloc, numpy arrays included) of one extra run. Results are appended to a JSON history
+so a run can be compared to the previous one at the same scale.
+
+Example usage:
+    python3 -m comps bench --scale medium
+    python3 benchmark.py small
+'''
+
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from flow_table import FlowTable
+from pcap_parser import extract_trace_ips
+from time_index import TimeIndex
+
+# packets in the noisy trace, unique ips, website profiles, traces per profile
+SCALES = {
+    "small": {"packets": 10000, "unique_ips": 1000, "profiles": 5, "traces": 5},
+    "medium": {"packets": 100000, "unique_ips": 10000, "profiles": 20, "traces": 10},
+    "large": {"packets": 1000000, "unique_ips": 100000, "profiles": 50, "traces": 20},
+}
+BUNDLED_TRACES = ["traces/test1.pcap", "traces/google/google_trace1.pcap"]
+HISTORY_FILE = "bench_history.json"
+# a benchmark this much slower than the previous run at the same scale is reported
+REGRESSION_RATIO = 1.25
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+'''
+Function: random_ip_pool
+Draws unique random public addresses, about one in ten is IPv6.
+
+Parameters:
+    count - int, number of addresses
+    rng - random.Random
+Returns:
+    list of packed addresses (4 or 16 bytes)
+'''
+def random_ip_pool(count, rng):
+    pool = set()
+    while len(pool) < count:
+        if rng.random() < 0.1:
+            pool.add(b"\x20\x01\x0d\xb8" + rng.getrandbits(96).to_bytes(12, "big"))
+        else:
+            pool.add(struct.pack(">BBH", rng.randint(1, 223), rng.randint(0, 255), rng.getrandbits(16)))
+    return sorted(pool)
+
+
+'''
+Function: write_synthetic_pcap
+Writes an ethernet pcap of TCP/UDP packets between addresses of a pool.
+
+Parameters:
+    path - str, pcap to write
+    packets - int, number of packets
+    ips - list of packed addresses, see random_ip_pool
+    rng - random.Random
+    noise - float, share of dns packets (left out by the parser like the tshark filter), default 0.05
+Returns:
+    function returns nothing
+'''
+def write_synthetic_pcap(path, packets, ips, rng, noise = 0.05):
+    v4 = [ip for ip in ips if len(ip) == 4] or [b"\x0a\x00\x00\x01"]
+    v6 = [ip for ip in ips if len(ip) == 16]
+    local4, local6 = socket.inet_aton("10.0.0.2"), socket.inet_pton(socket.AF_INET6, "fe80::2")
+    macs = b"\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xaa\xbb"
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        ts = 1700000000.0
+        for _ in range(packets):
+            ts += rng.expovariate(1000)
+            sport = rng.randint(1024, 65535)
+            if rng.random() < noise:
+                proto, dport = 17, 53
+            else:
+                proto, dport = rng.choice(((6, 443), (6, 80), (17, 443)))
+            l4 = struct.pack(">HHIIBBHHH", sport, dport, 0, 0, 0x50, 0x18, 0, 0, 0) if proto == 6 \
+                else struct.pack(">HHHH", sport, dport, 8, 0)
+            if v6 and rng.random() < 0.1:
+                remote = rng.choice(v6)
+                src, dst = (local6, remote) if rng.random() < 0.5 else (remote, local6)
+                frame = macs + b"\x86\xdd" + struct.pack(">IHBB", 0x60000000, len(l4), proto, 64) + src + dst + l4
+            else:
+                remote = rng.choice(v4)
+                src, dst = (local4, remote) if rng.random() < 0.5 else (remote, local4)
+                frame = macs + b"\x08\x00" + struct.pack(">BBHHHBBH", 0x45, 0, 20 + len(l4), 0, 0, 64, proto, 0) \
+                    + src + dst + l4
+            f.write(struct.pack("<IIII", int(ts), int(ts % 1 * 1e6), len(frame), len(frame)))
+            f.write(frame)
+
+
+'''
+Function: write_synthetic_trace_csv
+Writes a trace csv in the tshark format read by get_traces.get_trace_ips
+(frame.number, ip.src, ip.dst, ipv6.src, ipv6.dst, tab separated).
+'''
+def write_synthetic_trace_csv(path, rows, ips, rng):
+    with open(path, "w", newline='') as f:
+        writer = csv.writer(f, delimiter='\t', quotechar='|')
+        writer.writerow(["frame.number", "ip.src", "ip.dst", "ipv6.src", "ipv6.dst"])
+        for i in range(1, rows + 1):
+            remote = rng.choice(ips)
+            if len(remote) == 4:
+                writer.writerow([i, "10.0.0.2", socket.inet_ntoa(remote), "", ""])
+            else:
+                writer.writerow([i, "", "", "fe80::2", socket.inet_ntop(socket.AF_INET6, remote)])
+
+
+'''
+Function: write_synthetic_profile
+Writes an ip_profiles csv, with a frequency column unless frequency is False.
+'''
+def write_synthetic_profile(path, ips, rng, frequency = True):
+    with open(path, "w", newline='') as f:
+        writer = csv.writer(f)
+        for ip in ips:
+            address = socket.inet_ntoa(ip) if len(ip) == 4 else socket.inet_ntop(socket.AF_INET6, ip)
+            writer.writerow([address, f"{rng.randint(1, 100) / 100:.2f}"] if frequency else [address])
+
+
+'''
+Function: make_synthetic_workspace
+Generates a complete workspace to benchmark in.
+
+Parameters:
+    root - str, directory to fill (traces, csv_files and ip_profiles are created in it)
+    packets - int, packets in the noisy trace root/traces/noisy.pcap, csv traces get a tenth of that
+    unique_ips - int, number of distinct addresses across all profiles
+    profiles - int, number of website profiles site0, site1, ...
+    traces - int, csv trace files per website profile
+    seed - int, random seed, the same arguments always give the same workspace
+Returns:
+    list of website profile names
+Example usage:
+    make_synthetic_workspace("/tmp/bench", 10000, 1000, 5, 5)
+'''
+def make_synthetic_workspace(root, packets, unique_ips, profiles, traces, seed = 0):
+    rng = random.Random(seed)
+    for folder in ["traces", "csv_files", "ip_profiles"]:
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    pool = random_ip_pool(unique_ips, rng)
+
+    # every site gets its own slice of the pool plus some addresses of its neighbour (shared cdns)
+    share = max(1, unique_ips // profiles)
+    names = []
+    for i in range(profiles):
+        name = f"site{i}"
+        site_ips = pool[i * share:(i + 1) * share] + pool[(i + 1) * share:(i + 1) * share + share // 20]
+        os.makedirs(os.path.join(root, "csv_files", name), exist_ok=True)
+        for t in range(1, traces + 1):
+            write_synthetic_trace_csv(os.path.join(root, "csv_files", name, f"{name}_trace{t}.csv"),
+                                      max(100, packets // 10), site_ips, rng)
+        write_synthetic_profile(os.path.join(root, "ip_profiles", f"{name}.csv"), site_ips, rng)
+        names.append(name)
+    write_synthetic_profile(os.path.join(root, "ip_profiles", "background.csv"), rng.sample(pool, len(pool) // 10), rng,
+                            frequency = False)
+    write_synthetic_profile(os.path.join(root, "ip_profiles", "chrome.csv"), rng.sample(pool, len(pool) // 20), rng,
+                            frequency = False)
+    write_synthetic_pcap(os.path.join(root, "traces", "noisy.pcap"), packets, pool, rng)
+    return names
+
+
+'''
+Function: measure
+Times a function and measures its peak python memory.
+
+Parameters:
+    function - callable run with no arguments
+    repeat - int, number of timed runs, the best one is kept
+    setup - callable run (untimed) before every run, to restore files the function changes
+Returns:
+    dictionary with "seconds" (best run) and "peak_kb" (tracemalloc peak of one more run)
+'''
+def measure(function, repeat = 3, setup = None):
+    best = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {"seconds": round(best, 6), "peak_kb": round(peak / 1024, 1)}
+
+
+'''
+Function: run_benchmarks
+Runs every benchmark at one scale and returns the results.
+
+Parameters:
+    packets, unique_ips, profiles, traces - workspace size, see make_synthetic_workspace
+    repeat - int, timed runs per benchmark, default 3
+    extra_traces - list of pcap paths parsed and matched next to the synthetic trace,
+                   default the bundled traces
+Returns:
+    dictionary of {benchmark name: {"seconds", "peak_kb"}}
+'''
+def run_benchmarks(packets, unique_ips, profiles, traces, repeat = 3, extra_traces = None):
+    import get_traces
+    import profile_store
+    from profile_store import open_profile_store, STORE_FILE, PREFILTER_FILE
+    from trace_summary import write_trace_summary
+    from pcap_mmap import MappedPcap
+
+    if extra_traces is None:
+        extra_traces = [os.path.join(ROOT, path) for path in BUNDLED_TRACES if os.path.exists(os.path.join(ROOT, path))]
+    extra_traces = [os.path.abspath(path) for path in extra_traces]
+
+    results = {}
+    workspace = tempfile.mkdtemp(prefix="comps_bench_")
+    previous_cwd = os.getcwd()
+    try:
+        print(f"Generating workspace in {workspace}: {packets} packets, {unique_ips} ips, {profiles} profiles x {traces} traces")
+        names = make_synthetic_workspace(workspace, packets, unique_ips, profiles, traces)
+        os.chdir(workspace)
+        # import the generated profiles once like an existing install, site0 is benchmarked as the newest profile
+        with open_profile_store() as store:
+            for name in names[1:]:
+                store.register_profile(name)
+        shutil.copytree("ip_profiles", "ip_profiles_clean")
+        target = names[0]
+
+        def restore_profiles():
+            shutil.rmtree("ip_profiles")
+            shutil.copytree("ip_profiles_clean", "ip_profiles")
+
+        def run(name, function, setup = None):
+            results[name] = measure(function, repeat, setup)
+            print(f"    {name:<52}{results[name]['seconds'] * 1000:10.2f} ms {results[name]['peak_kb']:12.1f} KiB")
+
+        trace_csv = f"csv_files/{target}/{target}_trace1.csv"
+        write_trace_summary("traces/noisy.pcap", "traces/noisy.npz")
+        run("get_trace_ips[csv]", lambda: get_traces.get_trace_ips(trace_csv))
+        run("get_trace_ips[npz]", lambda: get_traces.get_trace_ips("traces/noisy.npz"))
+        for path in ["traces/noisy.pcap"] + extra_traces:
+            label = os.path.basename(path)
+            run(f"extract_trace_ips[{label}]", lambda: extract_trace_ips(path))
+            run(f"extract_trace_ips+flows[{label}]", lambda: extract_trace_ips(path, flows = FlowTable()))
+            run(f"extract_trace_ips+time_index[{label}]", lambda: extract_trace_ips(path, time_index = TimeIndex()))
+            run(f"mmap_count_ips[{label}]", lambda: MappedPcap(path).count_ips())
+        run("build_frequency_ip_profile", lambda: get_traces.build_frequency_ip_profile(target, rebuild = True),
+            setup = restore_profiles)
+        run("filter_ips[background]", lambda: get_traces.filter_ips(target, "background"), setup = restore_profiles)
+        run("check_duplicates", lambda: get_traces.check_duplicates(target), setup = restore_profiles)
+
+        def drop_prefilter():
+            restore_profiles()
+            profile_store._prefilters.clear()
+            if os.path.exists(f"ip_profiles/{PREFILTER_FILE}"):
+                os.remove(f"ip_profiles/{PREFILTER_FILE}")
+
+        def build_prefilter():
+            with open_profile_store() as store:
+                store.prefilter()
+
+        run("prefilter[cold]", build_prefilter, setup = drop_prefilter)
+
+        def drop_store():
+            restore_profiles()
+            os.remove(f"ip_profiles/{STORE_FILE}")
+
+        def open_store():
+            with open_profile_store():
+                pass
+
+        run("open_profile_store[import csv]", open_store, setup = drop_store)
+        restore_profiles()
+        for path in ["traces/noisy.pcap"] + extra_traces:
+            label = os.path.basename(path)
+            run(f"check_website_in_noisy_trace[{label}]", lambda: get_traces.check_website_in_noisy_trace(path, target))
+            run(f"check_profiles_in_noisy_trace[{label}]", lambda: get_traces.check_profiles_in_noisy_trace(path))
+            run(f"check_profiles_in_noisy_trace[{label},prefilter]",
+                lambda: get_traces.check_profiles_in_noisy_trace(path, prefilter = True))
+            run(f"check_profiles_in_noisy_trace[{label},no cache]",
+                lambda: get_traces.check_profiles_in_noisy_trace(path, cache = False))
+    finally:
+        os.chdir(previous_cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+    return results
+
+
+'''
+Function: git_revision
+Returns the short commit hash of the checkout, None outside a git repository
+'''
+def git_revision():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+'''
+Function: record_benchmarks
+Appends a benchmark run to the JSON history and reports regressions against the last run at the same scale.
+
+Parameters:
+    scale - str, name of the scale (a SCALES key or "custom")
+    settings - dictionary of workspace settings the run used
+    results - dictionary returned by run_benchmarks
+    history_path - str, JSON history file, default bench_history.json
+Returns:
+    list of (benchmark name, previous seconds, new seconds) for benchmarks that got slower than REGRESSION_RATIO
+'''
+def record_benchmarks(scale, settings, results, history_path = HISTORY_FILE):
+    history = []
+    if os.path.exists(history_path):
+        try:
+            with open(history_path) as f:
+                history = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error in function record_benchmarks: could not read {history_path}: {e}")
+
+    regressions = []
+    previous = next((run for run in reversed(history) if run.get("scale") == scale and run.get("settings") == settings), None)
+    if previous is not None:
+        for name, result in results.items():
+            before = previous["results"].get(name)
+            if before and before["seconds"] > 0 and result["seconds"] / before["seconds"] > REGRESSION_RATIO:
+                regressions.append((name, before["seconds"], result["seconds"]))
+
+    history.append({
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_revision(),
+        "python": platform.python_version(),
+        "scale": scale,
+        "settings": settings,
+        "results": results,
+    })
+    with open(f"{history_path}.tmp", "w") as f:
+        json.dump(history, f, indent=1)
+    os.replace(f"{history_path}.tmp", history_path)
+
+    for name, before, after in regressions:
+        print(f"Slower than the previous run ({previous['commit']}): {name} {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    scale = sys.argv[1] if len(sys.argv) > 1 else "small"
+    results = run_benchmarks(**SCALES[scale])
+    record_benchmarks(scale, SCALES[scale], results, os.path.join(ROOT, HISTORY_FILE))
@@ -0,0 +1,112 @@
+'''
+Bloom filter used as a prefilter in front of the profile store.
+
+Most addresses of a noisy trace are in no profile at all. The filter holds every address of every
+profile (websites, background and chrome), so an address it rejects can't match anything and never
+has to be looked up in the store. Addresses it accepts are looked up as before: a false positive
+only costs one lookup, a false negative can't happen.
+
+The bits are a bytearray and the k bit positions come from one 64 bit blake2b digest split in two
+(double hashing), so a filter saved to disk gives the same answers in every process.
+
+Example usage:
+    bloom = BloomFilter.from_items(profile_ips, error_rate = 0.01)
+    "142.250.72.14" in bloom
+    candidates = bloom.filter(trace_ips)
+'''
+
+import math
+import os
+import struct
+import threading
+from hashlib import blake2b
+
+BLOOM_MAGIC = b"COMPSBF1"
+HEADER = struct.Struct("<8s16sQI")      # magic, tag, number of bits, number of hashes
+
+
+class BloomFilter:
+    '''
+    bits - int, size of the bit array
+    hashes - int, number of bit positions set per address
+    tag - bytes, up to 16, padded with zeros and saved with the filter (the profile store keeps its id
+          and change counter here)
+    '''
+
+    def __init__(self, bits, hashes, tag = b"", data = None):
+        self.bits = max(8, bits)
+        self.hashes = max(1, hashes)
+        self.tag = bytes(tag[:16]).ljust(16, b"\0")
+        self.data = bytearray((self.bits + 7) // 8) if data is None else data
+
+    @classmethod
+    def from_items(cls, items, error_rate = 0.01, tag = b""):
+        '''
+        Builds a filter sized for items with the given false positive rate
+        '''
+        items = list(items)
+        n = max(1, len(items))
+        bits = math.ceil(-n * math.log(error_rate) / math.log(2) ** 2)
+        bloom = cls(bits, round(bits / n * math.log(2)), tag)
+        bloom.update(items)
+        return bloom
+
+    def _positions(self, item):
+        h = int.from_bytes(blake2b(item.encode(), digest_size=8).digest(), "little")
+        h1, h2, bits = h & 0xFFFFFFFF, (h >> 32) | 1, self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def add(self, item):
+        data = self.data
+        for position in self._positions(item):
+            data[position >> 3] |= 1 << (position & 7)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return bool(self.filter([item]))
+
+    def filter(self, items):
+        '''
+        Returns the items that may be in the filter, in their original order
+        '''
+        # same positions as _positions, inlined so most addresses are rejected after one or two bits
+        data, bits, hashes = self.data, self.bits, range(self.hashes)
+        kept = []
+        for item in items:
+            h = int.from_bytes(blake2b(item.encode(), digest_size=8).digest(), "little")
+            h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+            for i in hashes:
+                position = (h1 + i * h2) % bits
+                if not data[position >> 3] & (1 << (position & 7)):
+                    break
+            else:
+                kept.append(item)
+        return kept
+
+    def save(self, path):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(HEADER.pack(BLOOM_MAGIC, self.tag, self.bits, self.hashes))
+            f.write(self.data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Reads a filter written by save, returns None if the file is missing or not a filter
+        '''
+        try:
+            with open(path, "rb") as f:
+                header = f.read(HEADER.size)
+                data = bytearray(f.read())
+        except OSError:
+            return None
+        if len(header) != HEADER.size:
+            return None
+        magic, tag, bits, hashes = HEADER.unpack(header)
+        if magic != BLOOM_MAGIC or len(data) != (bits + 7) // 8:
+            return None
+        return cls(bits, hashes, tag, data)
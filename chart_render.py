@@ -0,0 +1,207 @@
+'''
+Chart rendering service for the profile and match bar charts.
+
+Building a plotly figure is cheap, writing it with fig.write_image starts the kaleido renderer,
+which takes seconds. Charts are therefore rendered in a process pool that stays up for the
+life of the program (every worker starts kaleido once), and all charts of a report are
+submitted together so they render in parallel.
+
+Every image is cached under chart_cache/ by a hash of what is drawn (chart kind, title and
+rows), so the chart of a profile or a match list that didn't change is copied from the cache
+instead of being rendered again. Like trace_cache/, the least recently used images are removed
+once the cache is larger than MAX_CHART_CACHE_BYTES.
+
+Example usage:
+    render_charts([match_chart(spotify_matches, "spotify")], log)
+'''
+
+import atexit
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from trace_cache import evict
+
+CHART_CACHE = "chart_cache"
+CHART_VERSION = 1               # bump when draw_chart changes so cached images are rendered again
+CHART_WORKERS = min(4, os.cpu_count() or 1)
+MAX_CHART_CACHE_BYTES = 64 * 1024 * 1024
+
+_pool = None
+
+
+'''
+Function: profile_chart
+Describes the bar chart of a website profile: the 30 addresses seen in the most traces.
+
+Parameters:
+    profile - str, name of the profile csv file (ex: "open.spotify.com.csv")
+Returns:
+    chart tuple (kind, graph name, rows, output path) for render_charts
+'''
+def profile_chart(profile):
+    graph_name = profile[:-4] if profile.endswith(".csv") else profile
+    rows = []
+    with open(f"ip_profiles/{profile}", newline='') as f:
+        for row in csv.reader(f):
+            if len(row) > 1 and row[1]:
+                rows.append([row[0], float(row[1])])
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return ("profile", graph_name, rows[:30], f"bar_charts/{profile}fig.jpeg")
+
+
+'''
+Function: match_chart
+Describes the bar chart of the profile addresses matched in a noisy trace: the 20 most frequent.
+
+Parameters:
+    matched_list - list of [IP, frequency] pairs
+    graph_name - str, name of the graph
+Returns:
+    chart tuple (kind, graph name, rows, output path) for render_charts
+'''
+def match_chart(matched_list, graph_name):
+    rows = sorted(([ip, float(frequency)] for ip, frequency in matched_list), key=lambda row: row[1], reverse=True)
+    return ("match", graph_name, rows[:20], f"match_graphs/{graph_name}fig.jpeg")
+
+
+def chart_key(kind, graph_name, rows):
+    data = json.dumps([CHART_VERSION, kind, graph_name, rows], separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+'''
+Function: draw_chart
+Builds the plotly figure of a chart.
+
+Parameters:
+    kind - str, "profile" or "match"
+    graph_name - str
+    rows - list of [IP, frequency] pairs, already sorted and cut
+Returns:
+    plotly figure
+'''
+def draw_chart(kind, graph_name, rows):
+    import pandas as pd
+    import plotly.express as px
+    if kind == "profile":
+        df = pd.DataFrame(rows, columns=["ip_address", "frequency_percentage"])
+        fig = px.bar(df, x="ip_address", y="frequency_percentage",
+                    title=f"IP Address Frequency for {graph_name}",
+                    labels={
+                    "ip_address" : "IP Address",
+                    "frequency_percentage" : "Frequency of Traces IP Address was Present"}
+                    )
+        fig.update_layout(xaxis = {'categoryorder' : 'total descending'})
+        fig.update_layout(
+            xaxis_tickangle=45,
+            title={
+                'text': f"IP Address Frequency for {graph_name}",
+                'y':0.9,
+                'x':0.5,
+                'xanchor': 'center',
+                'yanchor': 'top'
+            })
+        return fig
+    df = pd.DataFrame(rows, columns=['ip_address', 'match_frequency'])
+    fig = px.bar(df, x="ip_address", y="match_frequency",
+                 title = f"Frequency of IP Address Match for {graph_name}",
+                 color = "match_frequency",
+                 labels={
+                "ip_address" : "IP Address",
+                "match_frequency" : "Address Match Frequency" })
+    fig.update_layout(xaxis = {'categoryorder' : 'total descending'})
+    fig.update_layout(xaxis_tickangle=45)
+    fig.update_yaxes(rangemode="tozero")
+    return fig
+
+
+def _render_chart(job):
+    # runs in a pool worker, writes next to the cache entry first so readers never see half an image
+    kind, graph_name, rows, cache_path = job
+    temp_path = f"{cache_path[:-5]}.{os.getpid()}.tmp.jpeg"
+    try:
+        draw_chart(kind, graph_name, rows).write_image(temp_path)
+        os.replace(temp_path, cache_path)
+        return None
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return f"{type(e).__name__}: {e}"
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn, the report runs on a thread of the tkinter app and forking it is not safe
+        _pool = ProcessPoolExecutor(max_workers = CHART_WORKERS, mp_context = multiprocessing.get_context("spawn"))
+        atexit.register(shutdown_renderer)
+    return _pool
+
+
+'''
+Function: shutdown_renderer
+Stops the render workers, called automatically when the program exits
+'''
+def shutdown_renderer():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+'''
+Function: render_charts
+Writes the images of many charts, rendering the ones that are not cached in parallel.
+
+Parameters:
+    charts - list of chart tuples from profile_chart / match_chart
+    log - logger for failures, default print
+Returns:
+    dictionary of {output path: None if written else the error message}
+Example usage:
+    render_charts([match_chart(matches, name) for name, (matches, report) in results.items()], log)
+'''
+@metrics.timed
+def render_charts(charts, log = None):
+    os.makedirs(CHART_CACHE, exist_ok=True)
+    cache_paths, missing = {}, {}
+    for kind, graph_name, rows, out_path in charts:
+        cache_path = os.path.join(CHART_CACHE, f"{chart_key(kind, graph_name, rows)}.jpeg")
+        cache_paths[out_path] = cache_path
+        if cache_path in missing:
+            continue
+        try:
+            os.utime(cache_path)        # a hit, keep it out of the next eviction
+        except FileNotFoundError:
+            missing[cache_path] = (kind, graph_name, rows, cache_path)
+
+    errors = {}
+    if missing:
+        pool = _get_pool()
+        futures = {cache_path: pool.submit(_render_chart, job) for cache_path, job in missing.items()}
+        for cache_path, future in futures.items():
+            try:
+                errors[cache_path] = future.result()
+            except Exception as e:
+                errors[cache_path] = f"{type(e).__name__}: {e}"
+    metrics.count("charts_rendered", len(missing))
+    metrics.count("charts_cached", len(charts) - len(missing))
+
+    results = {}
+    for out_path, cache_path in cache_paths.items():
+        error = errors.get(cache_path)
+        if error is None:
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            shutil.copyfile(cache_path, out_path)
+        else:
+            (log.critical if log else print)(f"Failed to generate graph {out_path} with exception {error}")
+        results[out_path] = error
+    if missing:
+        evict(CHART_CACHE, MAX_CHART_CACHE_BYTES, ".jpeg")
+    return results
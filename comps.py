@@ -0,0 +1,249 @@
+'''
+Command line entry point for running the trace analyzer without the GUI.
+
+Each subcommand imports only the modules it needs, so nothing here loads tkinter or
+installs chromedriver unless a capture is requested.
+
+Usage (from the comps directory):
+    python3 -m comps analyze <trace, directory or glob> [--profiles spotify,youtube] [--report full_report.txt]
+                             [--start 2022-03-12T12:00:00] [--end 2022-03-12T12:10:00] [--window 10]
+    python3 -m comps background [--timeout 600] [--traces 10]
+    python3 -m comps profile <website url> [--name open.spotify.com] [--traces 10]
+    python3 -m comps filter <target profile> <filter profile> [--v4-prefix 24] [--v6-prefix 64]
+    python3 -m comps live [--iface en0] [--window 60] [--interval 10]
+    python3 -m comps compress [traces] [--format gzip|zstd]
+    python3 -m comps bench [--scale small|medium|large] [--trace noisy.pcap]
+    python3 -m comps imports [--budget 500]
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+from urllib.parse import urlparse
+
+# modules the parse and match path must not import
+HEAVY_MODULES = ["scapy", "selenium", "chromedriver_autoinstaller", "numpy", "pandas", "plotly", "chart_studio",
+                 "cufflinks", "tkinter"]
+# modules imported by the parse and match path (analyze, batch_analyze workers)
+MATCH_MODULES = ["pcap_parser", "profile_store", "get_traces", "batch_analyze"]
+
+
+def _profile_names(args):
+    return args.profiles.split(",") if args.profiles else None
+
+
+def _timestamp(value):
+    # seconds since the epoch or a local ISO time, ex: 2022-03-12T12:00:00
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    from datetime import datetime
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a time, use seconds since the epoch or 2022-03-12T12:00:00")
+
+
+def analyze(args):
+    import metrics
+    if not os.path.isfile(args.trace):
+        from batch_analyze import batch_analyze
+        with metrics.run("analyze", quiet = not args.metrics, trace = args.trace):
+            results = batch_analyze(args.trace, _profile_names(args), args.workers, args.backend,
+                                    args.report or "batch_report.txt", not args.no_cache, args.prefilter,
+                                    args.start, args.end, args.window)
+        return 0 if results else 1
+
+    from get_traces import check_profiles_in_noisy_trace
+    with metrics.run("analyze", quiet = not args.metrics, trace = args.trace):
+        results = check_profiles_in_noisy_trace(args.trace, _profile_names(args), args.backend, args.prefilter,
+                                                not args.no_cache, args.start, args.end, args.window)
+        if results == -1:
+            return 1
+        full_report = ""
+        for name, (matches, report) in results.items():
+            full_report = full_report + f"{report}\n here are the matched ip addresses from our messy trace in profile and their respective frequency. Format: [IP, frequency]:::: {matches}\n\n\n"
+        if args.report:
+            with open(args.report, "w") as f:
+                f.write(full_report)
+            print(f"Report generated in {args.report}")
+        else:
+            print(full_report)
+    return 0
+
+
+def background(args):
+    from get_traces import install_chromedriver, build_background_profile, build_chrome_profile
+    if install_chromedriver() != 0:
+        return 1
+    build_background_profile(args.timeout)
+    return 0 if build_chrome_profile(args.traces) != -1 else 1
+
+
+def profile(args):
+    from get_traces import install_chromedriver, build_profile_without_noise
+    name = args.name or urlparse(args.website).netloc
+    if not name:
+        print(f"Error: could not get a profile name from {args.website}, use --name. Example: https://open.spotify.com/")
+        return 1
+    if name in ["google.com", "www.google.com"]:
+        print("Google profiles cannot be built using this program")
+        return 1
+    if install_chromedriver() != 0:
+        return 1
+    return 0 if build_profile_without_noise(args.traces, args.website, name) != -1 else 1
+
+
+def filter_profile(args):
+    from get_traces import filter_ips
+    return 0 if filter_ips(args.target, args.filter, args.v4_prefix, args.v6_prefix) == 0 else 1
+
+
+def live(args):
+    from live_detect import run_live_detection
+    run_live_detection(args.iface, args.window, args.interval, args.duration, _profile_names(args))
+    return 0
+
+
+def compress(args):
+    from batch_analyze import find_traces
+    from pcap_parser import PcapFormatError, compress_trace
+    failed = 0
+    saved = 0
+    for path in find_traces(os.path.join(args.folder, "**", "*")):
+        if path.endswith((".gz", ".zst")):
+            continue
+        size = os.path.getsize(path)
+        try:
+            saved += size - os.path.getsize(compress_trace(path, args.format))
+        except (OSError, PcapFormatError) as e:
+            print(f"Error: could not compress {path}: {e}")
+            failed += 1
+    print(f"Compressed traces in {args.folder}, {saved / 1e6:.1f} MB saved")
+    return 1 if failed else 0
+
+
+def bench(args):
+    import benchmark
+    settings = dict(benchmark.SCALES[args.scale])
+    for key in settings:
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+    scale = args.scale if settings == benchmark.SCALES[args.scale] else "custom"
+    extra_traces = None if not args.trace else [os.path.join(benchmark.ROOT, path) for path in benchmark.BUNDLED_TRACES] + args.trace
+    results = benchmark.run_benchmarks(repeat = args.repeat, extra_traces = extra_traces, **settings)
+    regressions = benchmark.record_benchmarks(scale, settings, results, args.history)
+    print(f"Results appended to {args.history}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def imports(args):
+    '''
+    Imports the parse and match modules in a fresh interpreter with -X importtime and
+    fails if one of them pulls in a heavy dependency or the import takes longer than the budget
+    '''
+    code = f"import sys; import {', '.join(MATCH_MODULES)}; print(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        print(f"Error in function imports: importing {', '.join(MATCH_MODULES)} failed:\n{result.stderr}")
+        return 1
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if fields[1].strip().isdigit():
+            cumulative[fields[2].strip()] = int(fields[1])
+    total_ms = sum(cumulative.get(name, 0) for name in MATCH_MODULES) / 1000
+    for name in MATCH_MODULES:
+        print(f"    {name:<16}{cumulative.get(name, 0) / 1000:8.1f} ms")
+    print(f"    {'total':<16}{total_ms:8.1f} ms (budget {args.budget} ms)")
+
+    loaded = sorted({module.split(".")[0] for module in result.stdout.split()} & set(HEAVY_MODULES))
+    if loaded:
+        print(f"Error: the parse and match path imports {', '.join(loaded)}")
+        return 1
+    if total_ms > args.budget:
+        print(f"Error: importing the parse and match path took {total_ms:.1f} ms")
+        return 1
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="comps", description="Profile websites and find them in packet traces.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("analyze", help="compare a trace (or a directory/glob of traces) to the built profiles")
+    p.add_argument("trace")
+    p.add_argument("--profiles", help="comma separated profile names, default all website profiles")
+    p.add_argument("--report", help="write the report to this file instead of printing it")
+    p.add_argument("--backend", default="native", choices=["native", "tshark"])
+    p.add_argument("--workers", type=int, help="worker processes when analyzing many traces, default one per core")
+    p.add_argument("--no-cache", action="store_true", help="decode the trace even if a file with the same contents was analyzed before")
+    p.add_argument("--start", type=_timestamp, help="only compare packets from this time on (epoch seconds or local ISO time)")
+    p.add_argument("--end", type=_timestamp, help="only compare packets before this time (epoch seconds or local ISO time)")
+    p.add_argument("--window", type=float, default=10, help="seconds per window when reporting when each profile was active")
+    p.add_argument("--prefilter", action="store_true", help="drop addresses in no profile with a Bloom filter before the store lookup, faster for large traces of mostly unprofiled addresses")
+    p.add_argument("--metrics", action="store_true", help="print the time spent in every stage (always saved to metrics.jsonl)")
+    p.set_defaults(func=analyze)
+
+    p = subparsers.add_parser("background", help="build the background and chrome profiles")
+    p.add_argument("--timeout", type=int, default=600, help="seconds of background traffic to capture")
+    p.add_argument("--traces", type=int, default=10, help="number of chrome traces")
+    p.set_defaults(func=background)
+
+    p = subparsers.add_parser("profile", help="build a profile for a website")
+    p.add_argument("website", help="full web address, ex: https://open.spotify.com/")
+    p.add_argument("--name", help="profile name, default the domain of the website")
+    p.add_argument("--traces", type=int, default=10, help="number of traces to take")
+    p.set_defaults(func=profile)
+
+    p = subparsers.add_parser("filter", help="subtract the ips of one profile from another")
+    p.add_argument("target")
+    p.add_argument("filter")
+    p.add_argument("--v4-prefix", type=int, help="ipv4 prefix length to compare")
+    p.add_argument("--v6-prefix", type=int, help="ipv6 prefix length to compare")
+    p.set_defaults(func=filter_profile)
+
+    p = subparsers.add_parser("live", help="watch an interface and report profiled websites as they show up")
+    p.add_argument("--iface", help="interface to sniff, default scapy's default interface")
+    p.add_argument("--window", type=int, default=60, help="seconds of traffic each report covers")
+    p.add_argument("--interval", type=int, default=10, help="seconds between reports")
+    p.add_argument("--duration", type=int, help="stop after this many seconds")
+    p.add_argument("--profiles", help="comma separated profile names, default all website profiles")
+    p.set_defaults(func=live)
+
+    p = subparsers.add_parser("compress", help="compress the stored traces, every reader decompresses them as a stream")
+    p.add_argument("folder", nargs="?", default="traces")
+    p.add_argument("--format", default="gzip", choices=["gzip", "zstd"])
+    p.set_defaults(func=compress)
+
+    p = subparsers.add_parser("bench", help="benchmark parsing, profile building, filtering and matching")
+    p.add_argument("--scale", default="small", choices=["small", "medium", "large"])
+    p.add_argument("--packets", type=int, help="packets in the synthetic noisy trace, overrides the scale")
+    p.add_argument("--unique-ips", type=int, help="distinct addresses across the synthetic profiles, overrides the scale")
+    p.add_argument("--profiles", type=int, help="number of synthetic website profiles, overrides the scale")
+    p.add_argument("--traces", type=int, help="csv traces per synthetic profile, overrides the scale")
+    p.add_argument("--trace", action="append", help="extra pcap to parse and match, can be given more than once")
+    p.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark, the best is kept")
+    p.add_argument("--history", default="bench_history.json", help="JSON file the results are appended to")
+    p.add_argument("--fail-on-regression", action="store_true", help="exit with 1 if a benchmark got slower than the last run")
+    p.set_defaults(func=bench)
+
+    p = subparsers.add_parser("imports", help="check that parsing and matching don't import heavy dependencies")
+    p.add_argument("--budget", type=float, default=500, help="maximum import time in milliseconds")
+    p.set_defaults(func=imports)
+    return parser
+
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
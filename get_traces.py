@@ -17,31 +17,26 @@ Please contact Aiden Chang for questions
 
 '''
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from scapy.all import *
-from scapy.utils import RawPcapReader
 from glob import glob
-import chromedriver_autoinstaller
 import time
 import random
-import subprocess
 import os
 import csv
 import sys
 import datetime
+import re
+import traceback
 from shutil import rmtree
+from pcap_parser import extract_trace_ips, is_excluded, TRACE_SUFFIXES
+from trace_cache import cached_trace_ips, cached_time_index
+from time_index import TimeIndex, activity_intervals, format_intervals
+from profile_store import open_profile_store
+import metrics
 
-
-# imports for graphs below:
-import pandas as pd
-import numpy as np
-import chart_studio.plotly as py
-import cufflinks as cf
-import plotly.express as px
-import plotly.graph_objects as go
-import re
+# scapy, selenium, chromedriver_autoinstaller, numpy, pandas and plotly each take from a few
+# hundred milliseconds to seconds to import, so they are imported inside the functions that use them.
+# Parsing and matching (check_profiles_in_noisy_trace, batch_analyze workers) never load them,
+# `python3 -m comps imports` checks that this stays true.
 
 '''
 Installs chromedriver
@@ -50,6 +45,7 @@ Required for any Selenium Chrome activity
 def install_chromedriver():
     print("Installing chromedriver")
     try:
+        import chromedriver_autoinstaller
         chromedriver_autoinstaller.install()
         return 0
     except Exception as e:
@@ -60,9 +56,13 @@ def install_chromedriver():
 '''
 Reads a csv file and returns a dictionary with unique ip's 
 that appear in the trace and a count of each ip
+Binary trace summaries (.npz, see trace_summary.py) are read the same way
 '''
 def get_trace_ips(filename):
     try:
+        if filename.endswith(".npz"):
+            from trace_summary import load_trace_summary, summary_trace_ips
+            return summary_trace_ips(load_trace_summary(filename))
         with open(filename, newline='') as csvfile:
             spamreader = csv.reader(csvfile, delimiter='\t', quotechar='|')
             ips = {}
@@ -79,14 +79,23 @@ def get_trace_ips(filename):
 
 '''
 Reads a csv file and returns a list of unique ips
+Profiles in ip_profiles are read from the profile store (see profile_store.py) instead of the csv
 '''
 def get_profile_ips(filename, frequency = False):
+    folder, base = os.path.split(filename)
+    if os.path.basename(folder) == "ip_profiles" and base.endswith(".csv"):
+        with open_profile_store(folder) as store:
+            if store.has_profile(base[:-4]):
+                return store.profile_ips(base[:-4], frequency)
+
     return_list = []
     try:
         with open(filename, newline='') as csvfile:
             spamreader = csv.reader(csvfile)
+            seen = set()
             for row in spamreader:
-                if row[0] not in return_list:
+                if row[0] not in seen:
+                    seen.add(row[0])
                     if frequency:
                         return_list.append([row[0], row[1]])
                     else:
@@ -96,6 +105,88 @@ def get_profile_ips(filename, frequency = False):
         print(f"Error in function get_profile_ips: {e}")
 
 
+# kernel (BPF) capture filter with the same meaning as is_excluded / the tshark filter
+# "not (dns or mdns or arp or ssdp)", so the noise never reaches python
+CAPTURE_FILTER = "not (arp or port 53 or port 5353 or udp port 1900)"
+# bytes of each packet written to captured traces: ethernet + vlan tags, ipv6 with an extension
+# header and a tcp header with options, profiles never look past the transport header
+HEADER_SNAPLEN = 128
+# captured traces are written compressed: None, "gzip" or "zstd" (needs the zstandard package),
+# every reader decompresses them as a stream (pcap_parser.open_trace)
+TRACE_COMPRESSION = "gzip"
+
+'''
+Function: stream_capture
+Sniffs packets straight into a pcap file while counting the ip addresses seen.
+Packets are written as they arrive and are not kept in memory, so memory use stays
+the same no matter how long the capture runs.
+
+Parameters:
+    path - str, pcap file to write (overwritten)
+    count - int, number of packets to capture, 0 for no limit
+    timeout - int, number of seconds to capture, None for no limit
+    filtered - bool, default True: CAPTURE_FILTER is attached to the socket so dns, mdns, arp and
+               ssdp are dropped in the kernel, and packets are written cut to HEADER_SNAPLEN bytes
+               (the record keeps the original length). False captures and writes everything.
+    compression - str, compression of the written file, default TRACE_COMPRESSION
+Returns:
+    dictionary of {ip: count} for the captured packets, dns, mdns, arp and ssdp are not counted
+Example usage:
+    stream_capture("traces/background/background_trace1.pcap.gz", timeout = 600)
+Notes:
+    count counts the packets that pass the filter
+    scapy still reads every packet that passes the filter in full, only the written file is cut
+    addresses are read with pcap_parser.parse_packet, the same decoder used on saved traces
+'''
+def stream_capture(path, count = 0, timeout = None, filtered = True, compression = TRACE_COMPRESSION):
+    from scapy.all import sniff, conf
+    from pcap_parser import PcapFileWriter, parse_packet, ip_to_str, LINKTYPE_ETHERNET
+    snaplen = HEADER_SNAPLEN if filtered else 65535
+    writer = [None]             # opened at the first packet, which gives the link type
+    counts = {}
+    captured = [0, 0]           # packets, bytes on the wire
+
+    def handle_packet(pkt):
+        data = bytes(pkt)
+        if writer[0] is None:
+            linktype = conf.l2types.layer2num.get(type(pkt), LINKTYPE_ETHERNET)
+            writer[0] = PcapFileWriter(path, linktype, snaplen, compression)
+        writer[0].write(data, float(pkt.time))
+        captured[0] += 1
+        captured[1] += len(data)
+        decoded = parse_packet(writer[0].linktype, data)
+        if decoded is None:
+            return
+        src, dst, proto, sport, dport = decoded
+        if is_excluded(proto, sport, dport):
+            return
+        counts[src] = counts.get(src, 0) + 1
+        counts[dst] = counts.get(dst, 0) + 1
+
+    with metrics.span("capture", filtered = filtered) as fields:
+        started = time.time()
+        try:
+            try:
+                sniff(count = count, timeout = timeout, prn = handle_packet, store = False,
+                      filter = CAPTURE_FILTER if filtered else None)
+            except Exception as e:
+                # scapy compiles the filter with tcpdump, capture unfiltered (still cut) without it
+                if not filtered or captured[0]:
+                    raise
+                print(f"Could not attach capture filter ({e}), capturing without it")
+                sniff(count = count, timeout = timeout, prn = handle_packet, store = False)
+        finally:
+            if writer[0] is None:
+                writer[0] = PcapFileWriter(path, LINKTYPE_ETHERNET, snaplen, compression)
+            writer[0].close()
+        elapsed = time.time() - started
+        fields.update(packets = captured[0], packets_per_sec = round(captured[0] / elapsed, 1) if elapsed else 0,
+                      unique_ips = len(counts), bytes_seen = captured[1], bytes_written = os.path.getsize(path))
+    metrics.count("packets_captured", captured[0])
+    metrics.count("bytes_written", fields["bytes_written"])
+    return {ip_to_str(ip): n for ip, n in counts.items()}
+
+
 '''
 Function: sniff_website
 Sniffs count packets on a website and creates the csv file and the pcap file.
@@ -106,17 +197,20 @@ Parameters:
     name - str, the name we are using for the file (ex: "google")
     packet_count - int, number of packets sniffing, default to 1000
 Returns:
-    csv file under: csv_files/[name]/[name_trace][i].csv
-    pcap file under: traces/[name]/[name_trace][i].pcap
-    function returns nothing
+    trace summary under: csv_files/[name]/[name_trace][i].npz (see trace_summary.py)
+    pcap file under: traces/[name]/[name_trace][i].pcap, with .gz/.zst added when TRACE_COMPRESSION is set
+    list with the {ip: count} dictionary of every trace
 Example usage:
     sniff_website(20, "https://www.google.com", "google", 500)
 Notes:
-    for the subprocess.open tshark command to work, you might need to link tshark 
-    mine was done like this:
-        tshark ln -s /Applications/Wireshark.app/Contents/MacOS/tshark /usr/local/bin/tshark
+    new traces are numbered after the traces already in traces/[name], so earlier traces are kept
+    dns, mdns, arp and ssdp packets are filtered out in the kernel and the pcaps only keep packet
+    headers, see stream_capture
 '''
+@metrics.timed
 def sniff_website(trace_count, website, name, packet_count = 1500):
+    from selenium import webdriver
+    from trace_summary import write_trace_summary
     MYDIR = (f"traces/{name}")
     if not os.path.isdir(MYDIR):
         print(f"Folder {MYDIR} does not exist. Creating new....")
@@ -126,21 +220,25 @@ def sniff_website(trace_count, website, name, packet_count = 1500):
         print(f"Folder {MYDIR} does not exist. Creating new....")
         os.makedirs(MYDIR)
 
-    for i in range(1, trace_count + 1):
-        browser = webdriver.Chrome()
-        if website != 0:
-            browser.get(website)
-        capture = sniff(packet_count)
-        wrpcap(f"traces/{name}/{name}_trace{i}.pcap", capture)
-        browser.quit()
+    # number new traces after the existing ones so earlier traces are kept for add_traces
+    first = len(glob(f"traces/{name}/{name}_trace*.pcap*")) + 1
+    trace_ips = []
+    for i in range(first, first + trace_count):
+        pcap_path = f"traces/{name}/{name}_trace{i}.pcap{TRACE_SUFFIXES[TRACE_COMPRESSION]}"
+        with metrics.span("chrome_launch"):
+            browser = webdriver.Chrome()
+            if website != 0:
+                browser.get(website)
+        trace_ips.append(stream_capture(pcap_path, count = packet_count))
+        with metrics.span("chrome_quit"):
+            browser.quit()
+        metrics.count("traces_captured")
         try:
-            with open(f'csv_files/{name}/{name}_trace{i}.csv','w') as f:
-                shark_args = f"tshark -r traces/{name}/{name}_trace{i}.pcap \
-                      -Y -T fields -e frame.number -e ip.src -e ip.dst -e ipv6.src -e ipv6.dst".split()
-                shark_args.insert(4, "not (dns or mdns or arp or ssdp)")
-                subprocess.run(shark_args, stdout =f)
+            with metrics.span("write_summary"):
+                write_trace_summary(pcap_path, f"csv_files/{name}/{name}_trace{i}.npz")
         except Exception as e:
             print(f"Iteration in sniff_website: {i}\n error: {e}")
+    return trace_ips
 
 
 
@@ -157,7 +255,9 @@ Example usage:
     build_ip_profiles("google")
 Notes:
     If the folder does not exist in csv files it will throw an error.
+    Addresses are added to the existing profile in the profile store, the csv is rewritten from the store.
 '''
+@metrics.timed
 def build_ip_profiles(website):
     csv_profile_list = glob("csv_files/*")
     folder = ""
@@ -168,27 +268,18 @@ def build_ip_profiles(website):
     if not folder:
         print(f"Error in build ip profile: no csv file built for website {website}")
     else:
-        ip_sets = []
-        new_ips = []
-        write_type = "w"
-        write_path = f"./ip_profiles/{website}.csv"
-        if os.path.exists(write_path):
-            write_type = "a"
-            ip_sets = get_profile_ips(write_path)
-
+        trace_ips = {}
         csv_files = glob(f"{folder}/*")
         for file in csv_files:
-            trace_ips = get_trace_ips(file)
-            for key in trace_ips:
-                if key and key not in ip_sets:
-                    new_ips.append(key)
-                    ip_sets.append(key)
-                    
-        with open(write_path, write_type) as csv_writer:
-            writer_object = csv.writer(csv_writer)
-            for ip in new_ips:
-                writer_object.writerow([ip])
+            trace_ips.update(get_trace_ips(file) or {})
 
+        with open_profile_store() as store:
+            added = store.add_ips(website, list(trace_ips))
+        metrics.count("profile_ips_added", added)
+
+
+# prefix lengths (ipv4, ipv6) used when subtracting a profile, default is the full address
+FILTER_PREFIX_LENGTHS = {"background": (24, 64), "chrome": (24, 64)}
 
 '''
 Function: filter_ips
@@ -197,15 +288,20 @@ Subtracts ips that exist in filter_website from target_website.
 Parameters:
     target_website - string, name of target website ip profile
     filter_website - string, name of filter website ip profile
+    v4_prefix - int, number of leading bits compared for ipv4 addresses, default from FILTER_PREFIX_LENGTHS
+    v6_prefix - int, number of leading bits compared for ipv6 addresses, default from FILTER_PREFIX_LENGTHS
 Returns:
     profile built in /ip_profiles/{target_website}.csv
     function returns nothing
 Example usage:
     build_background_trace_profile("spotify", "google")
 Notes:
-    This overwrites the existing profile for target_website
+    This overwrites the existing profile for target_website (one transaction in the profile store)
+    background and chrome are compared on /24 (ipv4) and /64 (ipv6) prefixes, everything else on full addresses.
+    Rows of the filter profile may also be CIDR blocks (ex: 151.101.0.0/16), see prefix_trie.PrefixFilter
 '''
-def filter_ips(target_website, filter_website):
+@metrics.timed
+def filter_ips(target_website, filter_website, v4_prefix = None, v6_prefix = None):
     if not os.path.exists(f"ip_profiles/{target_website}.csv"):
         print(f"Error in function filter_ips: target website does not exist: ip_profiles/{target_website}.csv")
         return -1
@@ -213,49 +309,19 @@ def filter_ips(target_website, filter_website):
         print(f"Error in function filter_ips: filter website does not exist: ip_profiles/{filter_website}.csv")
         return -1
     
-    target_ips = get_profile_ips(f"ip_profiles/{target_website}.csv")
-    filter_ips = get_profile_ips(f"ip_profiles/{filter_website}.csv")
-
-    filtered_list = []
-    #if we are filtering against the background or chrome compare to 24 bit ips
-    if filter_website in ["background", "chrome"]:
-        #create list of 24 bit ip addresses
-        filter_ips_24 = []
-        for ip in filter_ips:
-            if ip == "":
-                continue
-            if ":" not in ip:
-                new_filter_ip = ip.split(".")
-                new_filter_ip_24 = new_filter_ip[0] + "." + new_filter_ip[1] + "." + new_filter_ip[2]
-            else:   #keep full ipv6 address
-                new_filter_ip_24 = ip
-            filter_ips_24.append(new_filter_ip_24)
-
-        #check the first 24 bits of target ips against the filter ips
-        for ip in target_ips:
-            if ip == "":
-                continue
-            elif ":" not in ip:
-                new_target_ip = ip.split(".")
-                new_target_ip_24 = new_target_ip[0] + "." + new_target_ip[1] + "." + new_target_ip[2]
-            else:   #keep full ipv6 address
-                new_target_ip_24 = ip
-            
-            if new_target_ip_24 not in filter_ips_24:
-                filtered_list.append(ip) #add the entire 32 bit ip
+    if not 0 <= (32 if v4_prefix is None else v4_prefix) <= 32 or not 0 <= (128 if v6_prefix is None else v6_prefix) <= 128:
+        print(f"Error in function filter_ips: prefix lengths must be 0-32 (ipv4) and 0-128 (ipv6), got {v4_prefix} and {v6_prefix}")
+        return -1
 
-    else:
-        for ip in target_ips:
-            if ip not in filter_ips:
-                filtered_list.append(ip)
-
-    with open(f"ip_profiles/{target_website}.csv", "r") as inp, open(f"ip_profiles/{target_website}_temp.csv", "w") as out:
-        writer = csv.writer(out)
-        for row in csv.reader(inp):
-            if row[0] in filtered_list:
-                writer.writerow(row)
-    os.remove(f"ip_profiles/{target_website}.csv")
-    os.rename(f"ip_profiles/{target_website}_temp.csv", f"ip_profiles/{target_website}.csv")
+    from prefix_trie import load_prefix_filter
+    default_v4, default_v6 = FILTER_PREFIX_LENGTHS.get(filter_website, (32, 128))
+    prefix_filter = load_prefix_filter(f"ip_profiles/{filter_website}.csv",
+                                       default_v4 if v4_prefix is None else v4_prefix,
+                                       default_v6 if v6_prefix is None else v6_prefix)
+
+    with open_profile_store() as store:
+        removed = store.filter_profile(target_website, prefix_filter)
+    metrics.count("ips_filtered_out", removed)
     return 0
 
 '''
@@ -270,32 +336,33 @@ Returns:
 Example usage:
     build_background_profile(30)
 Notes:
-
+    dns, mdns, arp and ssdp are filtered out of the capture in the kernel, see stream_capture
 '''
 
 def build_background_profile(time_limit):
-    print("Starting to build background profile")
-    # If folders don't exist, then create them.
-    MYDIR = (f"traces/background")
-    if not os.path.isdir(MYDIR):
-        print(f"Folder {MYDIR} does not exist. Creating new....")
-        os.makedirs(MYDIR)
-    MYDIR = (f"csv_files/background")
-    if not os.path.isdir(MYDIR):
-        print(f"Folder {MYDIR} does not exist. Creating new....")
-        os.makedirs(MYDIR)
-
-    capture = sniff(count=500000, timeout=time_limit)      
-    wrpcap(f"traces/background/background_trace1.pcap", capture)
-    try:
-        with open(f'csv_files/background/background_trace1.csv','w') as f:
-            subprocess.run(f"tshark -r traces/background/background_trace1.pcap \
-                -T fields -e frame.number -e ip.src -e ip.dst -e ipv6.src -e ipv6.dst".split(), stdout =f)
-    except Exception as e:
-        print(f"Background trace error: {e}")
+    with metrics.run("build_background_profile", time_limit = time_limit):
+        from trace_summary import write_trace_summary
+        print("Starting to build background profile")
+        # If folders don't exist, then create them.
+        MYDIR = (f"traces/background")
+        if not os.path.isdir(MYDIR):
+            print(f"Folder {MYDIR} does not exist. Creating new....")
+            os.makedirs(MYDIR)
+        MYDIR = (f"csv_files/background")
+        if not os.path.isdir(MYDIR):
+            print(f"Folder {MYDIR} does not exist. Creating new....")
+            os.makedirs(MYDIR)
+
+        pcap_path = f"traces/background/background_trace1.pcap{TRACE_SUFFIXES[TRACE_COMPRESSION]}"
+        background_ips = stream_capture(pcap_path, count=500000, timeout=time_limit)
+        print(f"Captured {len(background_ips)} unique ip addresses for the background")
+        try:
+            write_trace_summary(pcap_path, f"csv_files/background/background_trace1.npz")
+        except Exception as e:
+            print(f"Background trace error: {e}")
     
-    build_ip_profiles("background")
-    print("done building background profile")
+        build_ip_profiles("background")
+        print("done building background profile")
 
 
 
@@ -306,49 +373,169 @@ compares an uploaded trace to a built IP profile
 Parameters:
     file - a file uploaded by the user to be compared to a profile
     name - the name of the profile to be compared to
+    backend - str, "native" to parse the pcap in process (default) or "tshark"
+    prefilter - bool, drop addresses that are in no profile with the store's Bloom filter first, default False
+                (only faster for large traces of mostly unprofiled addresses)
+    cache - bool, reuse the addresses of a file with the same contents from trace_cache/, default True
+    start, end - float, seconds since the epoch, only compare the packets of this part of the trace, default all
 Returns:
-    two lists, one with matches for 32 bit IPs and one with matches for 24 bit IPs
+    list of [IP, frequency] pairs, the profile addresses (IPv4 and IPv6) found in the trace,
+    in the order they first appear in the trace
 Example usage:
     check_website_in_noisy_trace("noisy_trace", "spotify")
 Notes:
     returns (-1, -1) when it encounters an error
-    only written for IPV4 right now
+    dns, mdns, arp and ssdp packets are skipped, see pcap_parser.extract_trace_ips
 '''
-def check_website_in_noisy_trace(file, name):
+@metrics.timed
+def check_website_in_noisy_trace(file, name, backend = "native", prefilter = False, cache = True, start = None,
+                                 end = None):
     if not os.path.exists(f"ip_profiles/{name}.csv"):
         print(f"Error in function check_website_in_noisy_trace, file ip_profiles/{name} does not exist")
     else:
         try:
-            profile_ip_list = get_profile_ips(f"ip_profiles/{name}.csv", frequency = True)
-
-            with open(f'csv_files/compare_file.csv','w') as f:
-                subprocess.run(f"tshark -r {file} \
-                -T fields -e frame.number -e ip.src -e ip.dst -e ipv6.src -e ipv6.dst".split(), stdout =f)
-        
-            compare_ips = get_trace_ips(f"csv_files/compare_file.csv")
-
-            return_list = []
-
-            for ip in compare_ips:
-                if ip == "":
-                    continue
-
-                for profile_ip in profile_ip_list:
-                    if ip == profile_ip[0]:
-                        in_return_list = False
-                        for return_ip in return_list:
-                            if ip == return_ip[0]:
-                                in_return_list = True
-                        if not in_return_list:
-                            return_list.append(profile_ip)
-                        
-            
-            return return_list
+            with open_profile_store() as store:
+                if not store.is_scored(name):
+                    print(f"Error in function check_website_in_noisy_trace, profile {name} has no frequencies")
+                    return -1, -1
+
+                with metrics.span("extract_trace_ips"):
+                    if start is None and end is None:
+                        compare_ips = cached_trace_ips(file, backend) if cache else extract_trace_ips(file, backend)
+                    else:
+                        compare_ips = trace_time_index(file, backend, cache).window_ips(start, end)
+                metrics.count("trace_unique_ips", len(compare_ips))
+                with metrics.span("match"):
+                    return store.match(compare_ips, [name], prefilter)[name]
 
         except Exception as e:
             print(f"Error in check_website_in_noisy_trace error: {e}. Line {traceback.format_exc()}")
             return -1, -1
 
+
+# profiles in ip_profiles that are used for filtering and never reported on
+NON_WEBSITE_PROFILES = ["background", "chrome", "duplicate_ips", "all_websites"]
+
+'''
+Function: list_website_profiles
+Lists the names of all built website profiles
+
+Parameters:
+    none
+Returns:
+    list of profile names (ex: ["spotify", "open.spotify.com"]), background and chrome are left out
+'''
+def list_website_profiles():
+    names = []
+    for filename in sorted(os.listdir("ip_profiles")):
+        if filename.endswith(".csv") and filename[:-4] not in NON_WEBSITE_PROFILES:
+            names.append(filename[:-4])
+    return names
+
+
+'''
+Function: trace_time_index
+Builds the per-second time index of a trace (see time_index.py), any time window of the trace
+can then be counted without reading the file again.
+
+Parameters:
+    file - str, path to the trace
+    backend - str, "native" (default) or "tshark"
+    cache - bool, reuse the index of a file with the same contents from trace_cache/, default True
+Returns:
+    time_index.TimeIndex
+Notes:
+    errors from reading the trace are raised like extract_trace_ips does
+'''
+def trace_time_index(file, backend = "native", cache = True):
+    if cache:
+        return cached_time_index(file, backend)
+    index = TimeIndex()
+    extract_trace_ips(file, backend, time_index = index)
+    return index
+
+
+'''
+Function: activity_reports
+Builds the report of every profile: the report_to_user verdict followed by the intervals of the
+trace the profile was active in, used by check_profiles_in_noisy_trace and batch_analyze.
+
+Parameters:
+    index - time_index.TimeIndex of the trace
+    matches - dictionary of {name: [[IP, frequency], ...]} from ProfileStore.match
+    names - list of profile names to report on
+    window - float, seconds per window when placing the matched profiles in time, default 10
+    start, end - float, the part of the trace that was matched, default all of it
+Returns:
+    dictionary of {name: (matches, report)}
+'''
+def activity_reports(index, matches, names, window = 10, start = None, end = None):
+    results = {}
+    for name in names:
+        report = report_to_user(name, matches[name])
+        if matches[name]:
+            intervals = activity_intervals(index, matches[name], window, start = start, end = end)
+            report = f"{report}\n\n{format_intervals(name, intervals)}"
+        results[name] = (matches[name], report)
+    return results
+
+
+'''
+Function: check_profiles_in_noisy_trace
+compares an uploaded trace to many built IP profiles at once.
+The trace is only decoded once and matched against all profiles with one indexed query
+on the profile store (see profile_store.py).
+
+Parameters:
+    file - a file uploaded by the user to be compared to the profiles
+    names - list of profile names to compare against, default every website profile in ip_profiles
+    backend - str, "native" to parse the pcap in process (default) or "tshark"
+    prefilter - bool, drop addresses that are in no profile with the store's Bloom filter first, default False
+                (only faster for large traces of mostly unprofiled addresses)
+    cache - bool, reuse the addresses of a file with the same contents from trace_cache/, default True
+    start, end - float, seconds since the epoch, only compare the packets of this part of the trace, default all
+    window - float, seconds per window when placing the matched profiles in time, default 10
+Returns:
+    dictionary of {name: (matches, report)} where matches is the same [IP, frequency] list
+    check_website_in_noisy_trace returns and report is the report_to_user string followed by
+    the intervals of the trace the profile was active in
+Example usage:
+    results = check_profiles_in_noisy_trace("noisy_trace.pcap")
+    matches, report = results["spotify"]
+    check_profiles_in_noisy_trace("noisy_trace.pcap", start = 1700000000, end = 1700000600)
+Notes:
+    returns -1 when the trace can not be read
+'''
+@metrics.timed
+def check_profiles_in_noisy_trace(file, names = None, backend = "native", prefilter = False, cache = True,
+                                  start = None, end = None, window = 10):
+    names = list_website_profiles() if names is None else list(names)
+
+    with open_profile_store() as store:
+        for name in list(names):
+            if not store.has_profile(name):
+                print(f"Error in function check_profiles_in_noisy_trace, file ip_profiles/{name} does not exist")
+                names.remove(name)
+            elif not store.is_scored(name):
+                print(f"Error in function check_profiles_in_noisy_trace, profile {name} has no frequencies")
+                names.remove(name)
+
+        try:
+            with metrics.span("extract_trace_ips"):
+                index = trace_time_index(file, backend, cache)
+                compare_ips = index.window_ips(start, end)
+        except Exception as e:
+            print(f"Error in check_profiles_in_noisy_trace reading {file}: {e}")
+            return -1
+        metrics.count("trace_unique_ips", len(compare_ips))
+
+        with metrics.span("match"):
+            matches = store.match(compare_ips, names, prefilter)
+    metrics.count("profiles_matched", sum(1 for name in names if matches[name]))
+
+    with metrics.span("activity_intervals"):
+        return activity_reports(index, matches, names, window, start, end)
+
 ##################################################################################################
 # After this section its the usage of the above functions.
 ##################################################################################################
@@ -373,12 +560,13 @@ def build_chrome_profile(trace_count):
     if not os.path.exists(f"ip_profiles/background.csv"):
         print(f"Error in function build_chrome_profile: \n No background profile exists. Use build_background_profile first")
         return -1
-    print("Starting to build chrome profile")
-    sniff_website(trace_count, "https://www.google.com", "chrome", 1500)
-    build_ip_profiles("chrome")
-    if filter_ips("chrome", "background") != 0:
-        print("Failed in making chrome profile")
-    print("Done with chrome profile")
+    with metrics.run("build_chrome_profile", traces = trace_count):
+        print("Starting to build chrome profile")
+        sniff_website(trace_count, "https://www.google.com", "chrome", 1500)
+        build_ip_profiles("chrome")
+        if filter_ips("chrome", "background") != 0:
+            print("Failed in making chrome profile")
+        print("Done with chrome profile")
 
 '''
 Function: build_profile_without_noise
@@ -409,13 +597,14 @@ def build_profile_without_noise(trace_count, website, name):
         print(f"Error(s) in function build_chrome_profile: \n{err_msg}")
         return -1
 
-    print(f"Starting to build {name}")
-    sniff_website(trace_count, website, name)
-    build_frequency_ip_profile(name)
-    filter_ips(name,"background")
-    filter_ips(name,"chrome")
-    print(f"Done with building {name}")
-    check_duplicates(name)
+    with metrics.run("build_profile_without_noise", website = website, name = name, traces = trace_count):
+        print(f"Starting to build {name}")
+        sniff_website(trace_count, website, name)
+        build_frequency_ip_profile(name)
+        filter_ips(name,"background")
+        filter_ips(name,"chrome")
+        print(f"Done with building {name}")
+        check_duplicates(name)
     
     
 '''
@@ -435,7 +624,7 @@ Notes:
 
 '''
 def reset_folders():
-    MYDIRS = ["traces", "csv_files", "ip_profiles","match_graphs","bar_charts"]
+    MYDIRS = ["traces", "csv_files", "ip_profiles","match_graphs","bar_charts","chart_cache","trace_cache"]
     for dir in MYDIRS:
         try:
             rmtree(dir)
@@ -444,53 +633,82 @@ def reset_folders():
             print(f"Failed to reset {dir}. Reason: {e}")
 
 
+'''
+Function: add_traces
+Folds traces that are not part of a frequency profile yet into it.
+Only the new trace files are read, the counts of earlier traces are kept in the profile store
+
+Parameters:
+    website - str, the website we are profiling. This must be identical to the folder scanning. (ex: "google")
+    trace_files - list of file names in csv_files/{website} to add, default every file in the folder
+Returns:
+    number of traces that were added
+    profile rewritten in /ip_profiles/{website}.csv if any trace was added
+Example usage:
+    add_traces("google")
+Notes:
+    Rewriting the profile undoes filter_ips, so filters have to be applied again after adding traces
+    (build_profile_without_noise does this)
+'''
+@metrics.timed
+def add_traces(website, trace_files = None):
+    import numpy as np
+    from ip_array import IPArray
+    with open_profile_store() as store:
+        seen = set(store.counted_traces(website))
+    if trace_files is None:
+        trace_files = sorted(os.listdir(f"csv_files/{website}"))
+
+    trace_arrays = []           # unique ips of every new trace file
+    new_files = []
+    for file in trace_files:
+        if file in seen:
+            continue
+        trace_ips = get_trace_ips(f"csv_files/{website}/{file}")
+        if trace_ips is None:
+            continue
+        trace_arrays.append(IPArray.from_strings(list(trace_ips)).unique())
+        new_files.append(file)
+
+    if not new_files:
+        return 0
+
+    # frequency of occurances across the new files
+    unique_ips, (counts4, counts6) = IPArray.concat(trace_arrays).unique(return_counts = True)
+    counts = {ip: int(count) for ip, count in zip(unique_ips.to_strings(), np.concatenate([counts4, counts6]))}
+    with open_profile_store() as store:
+        store.add_trace_counts(website, new_files, counts)
+    metrics.count("traces_added", len(new_files))
+    metrics.count("profile_unique_ips", len(unique_ips))
+    return len(new_files)
+
+
 '''
 Function: build_frequency_ip_profile
 Builds a csv file including all unique ip addresses found in a filtered website trace as well as their frequency across traces
     
 Parameters:
     website - str, the website we are profiling. This must be identical to the folder scanning. (ex: "google")
+    rebuild - bool, forget the stored counts and recount every trace, default False
 Returns:
     profile built in /ip_profiles/{website}.csv
     function returns nothing
 Example usage:
     build_ip_profiles("google")
 Notes:
-    Currently built to delete old profile and rewrite it
+    Traces already counted in the profile store are not read again, see add_traces
 '''
-def build_frequency_ip_profile(website):
+@metrics.timed
+def build_frequency_ip_profile(website, rebuild = False):
     if website not in os.listdir("csv_files"):
         print(f"Error in build ip profile: no csv file trace(s) for website {website}")
         quit()
 
-    total_occurances = {}       # frequency of occurances across files
-    trace_files = os.listdir(f"csv_files/{website}")
-    PROFILE_PATH = (f"ip_profiles/{website}.csv")
-    trace_count = 0
-    for file in trace_files:
-        local_occurances = {}   # occurances within each file
-        trace_ips = get_trace_ips(f"csv_files/{website}/{file}")
-        for key in trace_ips: 
-            local_occurances[key] = 1
-
-        for key in local_occurances:
-            if key in total_occurances:
-                total_occurances[key] += 1
-            else:
-                total_occurances[key] = 1
-
-        trace_count += 1
-
-    total_occurances = dict(sorted(total_occurances.items(), key=lambda x: x[1], reverse=True))
-    for key in total_occurances:
-        total_occurances[key] = (f"{total_occurances[key]/trace_count:.2f}")
-
-    if os.path.exists(PROFILE_PATH):
-        os.remove(PROFILE_PATH)
-    with open(PROFILE_PATH, "w") as profile:
-        writer = csv.writer(profile)
-        for key in total_occurances:
-            writer.writerow([key, total_occurances[key]])
+    if rebuild:
+        with open_profile_store() as store:
+            store.reset_counts(website)
+    added = add_traces(website)
+    print(f"Added {added} new trace(s) to the {website} profile")
 
 
 '''
@@ -563,38 +781,19 @@ Returns:
 Example usage:
     make_individual_charts("open.spotify.com.csv", log)
 Notes:
+    The image is rendered by chart_render.py, an unchanged profile is copied from its cache
 '''
+@metrics.timed
 def make_individual_charts(profile, log):
-    if not os.path.exists("bar_charts"):
-        os.mkdir("bar_charts")
+    from chart_render import profile_chart, draw_chart, render_charts
     exclusions = {"background.csv":None, "chrome.csv":None, "google.csv":None} 
-    cols = ["ip_address", "frequency_percentage"]
-    graph_name = re.sub(r'.csv', '', profile)
     if profile in exclusions:
         log.warning(f"Cannot build profile {profile}")
     else:
-        df = pd.read_csv(f"ip_profiles/{profile}", names=cols, header=None)
-        df.sort_values(by=df.columns[1], inplace=True, ascending=False)
-        df = df.head(n=30)
-        fig = px.bar(df, x="ip_address", y="frequency_percentage",
-                    title=f"IP Address Frequency for {graph_name}",
-                    labels={
-                    "ip_address" : "IP Address",
-                    "frequency_percentage" : "Frequency of Traces IP Address was Present"}
-                    )
-        # fig.update_xaxes(categoryorder='category ascending')
-        fig.update_layout(xaxis = {'categoryorder' : 'total descending'})
-        fig.update_layout(
-            xaxis_tickangle=45,
-            title={
-                'text': f"IP Address Frequency for {graph_name}",
-                'y':0.9,
-                'x':0.5,
-                'xanchor': 'center',
-                'yanchor': 'top'
-            })
-        fig.show()
-        fig.write_image(f"bar_charts/{profile}fig.jpeg")
+        chart = profile_chart(profile)
+        render_charts([chart], log)
+        kind, graph_name, rows, _ = chart
+        draw_chart(kind, graph_name, rows).show()
 
 '''
 Function: make_noisy_match_graph
@@ -611,127 +810,54 @@ Returns:
 Example usage:
     make_noisy_match_graph(spotify_matches, "Spotify", log)
 Notes:
+    To draw the graphs of many profiles, pass all of them to chart_render.render_charts at once
+    so they render in parallel (see interface.generateReport)
 '''
+@metrics.timed
 def make_noisy_match_graph(matched_list, graph_name, log): 
-    if not os.path.exists("match_graphs"): 
-        log.info(f"Creating directory match_graphs in match_graphs/{graph_name}") 
-        os.mkdir("match_graphs") 
+    from chart_render import match_chart, render_charts
     try: 
-        df = pd.DataFrame(matched_list, columns=['ip_address', 'match_frequency']) 
-        df['match_frequency'] = df['match_frequency'].astype(float)
-        df.sort_values(by="match_frequency", inplace=True, ascending=False) 
-        df = df.head(n=20)
-        fig = px.bar(df, x="ip_address", y="match_frequency", 
-                     title = f"Frequency of IP Address Match for {graph_name}", 
-                     color = "match_frequency", 
-                     labels={ 
-                    "ip_address" : "IP Address", 
-                    "match_frequency" : "Address Match Frequency" })
-        # fig.update_xaxes(categoryorder='category ascending') 
-        fig.update_layout(xaxis = {'categoryorder' : 'total descending'})
-        fig.update_layout(xaxis_tickangle=45) 
-        fig.update_yaxes(rangemode="tozero") 
-        fig.write_image(f"match_graphs/{graph_name}fig.jpeg") 
-        log.info(f"Success in generating graph located in match_graphs/{graph_name}fig.jpeg")
+        chart = match_chart(matched_list, graph_name)
+        if render_charts([chart], log)[chart[3]] is None:
+            log.info(f"Success in generating graph located in {chart[3]}")
     except Exception as e:
         log.critical(f"Failed to generate graph {graph_name} with exception {e}")
 
 
-'''
-Function: update_duplicate_ips
-Checks a new profile for ip addresses found in other profiles
-    
-Parameters:
-    name - str, the website we are profiling. This must be identical to the folder scanning. (ex: "spotify.com")
-Returns:
-    updates ip_profiles/duplicate_ips.csv if a new dupliacte is found
-Example usage:
-    update_duplicate_ips("spotify.com")
-Notes:
-'''
-def update_duplicate_ips(name):
-    if not os.path.isfile('ip_profiles/all_websites.csv'):  #don't need to run if this is the first profile
-        return
-    
-    profile_ips = {}
-    all_website_ips = {}
-    duplicate_ips = {}
-
-    with open(f'ip_profiles/{name}.csv', 'r') as source_file:
-        reader = csv.reader(source_file)
-        for row in reader:
-            profile_ips[row[0]] = 0
-
-    with open(f'ip_profiles/all_websites.csv', 'r') as source_file:
-        reader = csv.reader(source_file)
-        for row in reader:
-            all_website_ips[row[0]] = 0
-
-    for ip in profile_ips:
-        if ip in all_website_ips:
-            duplicate_ips[ip] = 0
-
-    with open(f'ip_profiles/duplicate_ips.csv', 'a') as dest_file:
-        writer = csv.writer(dest_file)
-        for ip in duplicate_ips:
-            writer.writerow([ip])
-
-'''
-Function: filter_duplicates
-    Filters all profiles for addresses found in multiple profiles
-Parameters:
-    none
-Returns:
-    updates ip_profiles
-Notes:
-    currently used every time a new profile is build
-'''
-def filter_duplicates():
-    if not os.path.isfile('ip_profiles/duplicate_ips.csv'):  #don't need to run if this is the first profile
-        return
-    
-    profiles = []
-    for filename in os.listdir("ip_profiles"):
-        if filename.endswith(".csv"):
-            profiles.append(filename.replace(".csv",""))
-
-    for profile in profiles:
-        if profile not in ["duplicate_ips", "all_websites"]:
-            filter_ips(profile, "duplicate_ips")
-
-'''
-Function: update_all_website_addresses
-    adds new ip addresses to list of all addresses found
-Parameters:
-    name - str, the website we are profiling. This must be identical to the folder scanning. (ex: "spotify.com")
-Returns:
-    updates ip_profiles/all_websites.csv
-Notes:
-    currently used every time a new profile is built
-'''
-def update_all_website_addresses(name):
-    with open(f'ip_profiles/{name}.csv', 'r') as source_file:
-        reader = csv.reader(source_file)
-        with open('ip_profiles/all_websites.csv', 'a', newline='') as dest_file:
-            writer = csv.writer(dest_file)
-            for row in reader:
-                writer.writerow([row[0]])
-
 '''
 Function: check_duplicates
-    wrapper for all functions that check for duplicates on a new profile
+    removes ip addresses shared by more than one website profile from every profile that has them
 Parameters:
     name - str, the website we are profiling. This must be identical to the folder scanning. (ex: "spotify.com")
 Returns:
-    none
+    dictionary of {profile: number of addresses removed} for the profiles that changed
 Notes:
     currently used every time a new profile is built
-'''
-
+    The profile store keeps a count of website profiles per address (see ProfileStore.register_profile).
+    Only the new profile's addresses are counted and only the profiles sharing a newly duplicated
+    address are rewritten, instead of re-filtering every profile against a list of all addresses.
+    Website profiles built before the counts existed are registered the first time this runs.
+    duplicate_ips.csv/all_websites.csv of older versions are no longer written, a leftover
+    duplicate_ips list is still applied to the new profile.
+'''
+@metrics.timed
 def check_duplicates(name):
-    update_duplicate_ips(name)
-    update_all_website_addresses(name)
-    filter_duplicates()
+    removed = {}
+    with open_profile_store() as store:
+        registered = set(store.registered_profiles())
+        for profile in list_website_profiles():
+            if profile != name and profile not in registered:
+                for changed, count in store.register_profile(profile).items():
+                    removed[changed] = removed.get(changed, 0) + count
+        for changed, count in store.register_profile(name).items():
+            removed[changed] = removed.get(changed, 0) + count
+        if store.has_profile("duplicate_ips"):
+            count = store.remove_ips(name, store.profile_ips("duplicate_ips"))
+            if count:
+                removed[name] = removed.get(name, 0) + count
+    metrics.count("duplicate_ips_removed", sum(removed.values()))
+    metrics.count("profiles_refiltered", len(removed))
+    return removed
 
 def main():
     pass
@@ -39,15 +39,24 @@ import logging as log
 
 #importing trace functions
 from get_traces import *
+from chart_render import match_chart, render_charts
+import metrics
 
-log.basicConfig(filename='log.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
-log.getLogger().setLevel(log.INFO)
-log.info("-"*10)
-log.info("Starting Log file")
 current_path = os.path.dirname(os.path.abspath(__file__))
 PLACEHOLDER = None
 BACKGROUND_BUILT = False
-install_chromedriver()
+
+
+'''
+Starts log.log for a GUI session. Only called when interface.py is run: the chart render workers
+are spawned, import this file again as __mp_main__ and must not truncate the GUI's log
+'''
+def setup_logging():
+    log.basicConfig(filename='log.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
+    log.getLogger().setLevel(log.INFO)
+    log.info("-"*10)
+    log.info("Starting Log file")
+
 
 def test_function1():
     print("In test function 1!")
@@ -344,7 +353,7 @@ class UploadTracePage(tk.Frame):
         
 
     def UploadPcap(self, pkt=None) -> None:
-            filename = filedialog.askopenfilename(title="Choose a File...", filetypes=(('Pcap Files', '.pcap .pcapng' ),))
+            filename = filedialog.askopenfilename(title="Choose a File...", filetypes=(('Pcap Files', '.pcap .pcapng .gz .zst' ),))
             global PLACEHOLDER
             PLACEHOLDER = filename
             self.file_label.config( text=f"Chosen: {filename}")
@@ -362,25 +371,33 @@ class UploadTracePage(tk.Frame):
 
 
     def generateReport(self) -> None:
-        full_report = ''
-        for values in os.listdir(f"{current_path}/ip_profiles"):
-            if values[-3:] == "csv":
-                profile_name = values[:-4]
-                if profile_name != "background" and profile_name != "chrome":
-                    try:
-                        matches = check_website_in_noisy_trace(PLACEHOLDER, profile_name)
-                        report = report_to_user(profile_name, matches)  
-                        full_report = full_report + f"{report}\n here are the matched ip addresses from our messy trace in profile and their respective frequency. Format: [IP, frequency]:::: {matches}\n\n\n"        
-                        make_noisy_match_graph(matches, profile_name, log)
-                        self.generated_file_path.config(text="Report generated in full_report.txt\nGraphs generated in match_graphs directory")
-                        log.info("Report generated in full_report.txt")
-                    except Exception as e:
-                        log.critical(f"Failed to generate report on file: {PLACEHOLDER}, with profile {profile_name}\n Exception: {e}")
-                        self.generated_file_path.config(text="Failed to generate report please check log files")
-        with open('full_report.txt', 'w') as f:
-            f.write(full_report)
-        self.file_label.config(text="Generated Report")
-        log.info(f"Generated report with file: {PLACEHOLDER}")
+        with metrics.run("generate_report", trace = PLACEHOLDER) as report_run:
+            full_report = ''
+            results = check_profiles_in_noisy_trace(PLACEHOLDER)
+            if results == -1:
+                log.critical(f"Failed to read trace file: {PLACEHOLDER}")
+                self.generated_file_path.config(text="Failed to generate report please check log files")
+                results = {}
+            charts = []
+            for profile_name, (matches, report) in results.items():
+                try:
+                    full_report = full_report + f"{report}\n here are the matched ip addresses from our messy trace in profile and their respective frequency. Format: [IP, frequency]:::: {matches}\n\n\n"
+                    charts.append(match_chart(matches, profile_name))
+                except Exception as e:
+                    log.critical(f"Failed to generate report on file: {PLACEHOLDER}, with profile {profile_name}\n Exception: {e}")
+                    self.generated_file_path.config(text="Failed to generate report please check log files")
+            # every graph of the report renders in parallel, unchanged ones come from the cache
+            failed = [path for path, error in render_charts(charts, log).items() if error is not None]
+            if results and not failed:
+                self.generated_file_path.config(text="Report generated in full_report.txt\nGraphs generated in match_graphs directory")
+                log.info("Report generated in full_report.txt")
+            elif failed:
+                self.generated_file_path.config(text="Failed to generate report please check log files")
+            with open('full_report.txt', 'w') as f:
+                f.write(full_report)
+            self.file_label.config(text="Generated Report")
+            log.info(f"Generated report with file: {PLACEHOLDER}")
+        log.info(report_run.summary())
 
 
 
@@ -433,9 +450,9 @@ class BuiltProfilePage(tk.Frame):
     
     def on_show_frame(self, event):
         self.listbox.delete(0,tk.END)
-        for values in os.listdir(f"{current_path}/ip_profiles"):
-            if values[-3:] == "csv":
-                self.listbox.insert(tk.END, values[:-4])
+        with open_profile_store(f"{current_path}/ip_profiles") as store:
+            for name in store.profile_names():
+                self.listbox.insert(tk.END, name)
 
     def go(self, event):
         cs = self.listbox.curselection()
@@ -462,6 +479,8 @@ class WarningPage(tk.Frame):
         button.pack(anchor="s", side="left")
 
 if __name__ == "__main__":
+    setup_logging()
+    install_chromedriver()
     app = SampleApp()
     app.geometry("800x550")
     app.mainloop()
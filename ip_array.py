@@ -0,0 +1,95 @@
+'''
+Packed NumPy representation of IP address lists.
+
+IPv4 addresses are stored as uint32 and IPv6 addresses as two uint64 columns (high and low
+64 bits), so counting the distinct addresses of profiles and traces runs as sorted array operations
+instead of python string comparisons.
+'''
+
+import socket
+
+import numpy as np
+
+# view used to compare the two IPv6 columns as one value
+V6_ROW = np.dtype([("hi", "<u8"), ("lo", "<u8")])
+
+
+def _v6_rows(v6):
+    return np.ascontiguousarray(v6, dtype=np.uint64).view(V6_ROW).ravel()
+
+
+def _v6_from_rows(rows):
+    return rows.view(np.uint64).reshape(-1, 2)
+
+
+class IPArray:
+    '''
+    v4 - uint32 array of IPv4 addresses
+    v6 - (n, 2) uint64 array of IPv6 addresses
+    '''
+
+    def __init__(self, v4 = None, v6 = None):
+        self.v4 = np.zeros(0, dtype=np.uint32) if v4 is None else np.asarray(v4, dtype=np.uint32)
+        self.v6 = np.zeros((0, 2), dtype=np.uint64) if v6 is None else np.asarray(v6, dtype=np.uint64).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self.v4) + len(self.v6)
+
+    @classmethod
+    def from_packed(cls, packed_ips):
+        '''
+        Builds an IPArray from packed address bytes (4 or 16 bytes each), as produced by pcap_parser
+        '''
+        packed4 = [packed for packed in packed_ips if len(packed) == 4]
+        packed6 = [packed for packed in packed_ips if len(packed) == 16]
+        v4 = np.frombuffer(b"".join(packed4), dtype=">u4").astype(np.uint32)
+        v6 = np.frombuffer(b"".join(packed6), dtype=">u8").astype(np.uint64).reshape(-1, 2)
+        return cls(v4, v6)
+
+    @classmethod
+    def from_strings(cls, ips):
+        '''
+        Builds an IPArray from address strings. Entries that are not addresses ("" or
+        tshark's comma separated tunnel addresses) are skipped.
+        '''
+        packed = []
+        for ip in ips:
+            try:
+                if ":" in ip:
+                    packed.append(socket.inet_pton(socket.AF_INET6, ip))
+                else:
+                    packed.append(socket.inet_pton(socket.AF_INET, ip))
+            except (OSError, TypeError):
+                packed.append(b"")
+        return cls.from_packed(packed)
+
+    @classmethod
+    def concat(cls, arrays):
+        '''
+        Joins several IPArrays into one
+        '''
+        v4 = np.concatenate([a.v4 for a in arrays]) if arrays else None
+        v6 = np.concatenate([a.v6 for a in arrays]) if arrays else None
+        return cls(v4, v6)
+
+    def to_strings(self):
+        '''
+        Returns the addresses as strings, IPv4 addresses first
+        '''
+        raw4 = self.v4.astype(">u4").tobytes()
+        raw6 = self.v6.astype(">u8").tobytes()
+        ips = [socket.inet_ntop(socket.AF_INET, raw4[i:i + 4]) for i in range(0, len(raw4), 4)]
+        ips.extend(socket.inet_ntop(socket.AF_INET6, raw6[i:i + 16]) for i in range(0, len(raw6), 16))
+        return ips
+
+    def unique(self, return_counts = False):
+        '''
+        Returns the sorted unique addresses, and optionally how often each one appears
+        as (counts4, counts6)
+        '''
+        v4, counts4 = np.unique(self.v4, return_counts=True)
+        rows, counts6 = np.unique(_v6_rows(self.v6), return_counts=True)
+        unique = IPArray(v4, _v6_from_rows(rows))
+        if return_counts:
+            return unique, (counts4, counts6)
+        return unique
@@ -0,0 +1,153 @@
+'''
+Live detection of profiled websites on a network interface.
+
+Packets are sniffed with scapy's AsyncSniffer and checked against the profile store's Bloom
+prefilter (profile_store.py) as they arrive. Hits are kept in one counter per time bucket, and
+only the buckets inside the sliding window are kept, so each packet costs one filter lookup per
+address and memory is bounded by window size x number of profiled IPs (plus the filter's false
+positives). Every report matches the addresses of the window with one indexed store query.
+Verdicts use the same report_to_user wording as uploaded traces.
+
+Example usage (needs the same capture permissions as sniff):
+    python3 live_detect.py en0 60
+'''
+
+import sys
+import threading
+import time
+from collections import deque
+
+from scapy.all import AsyncSniffer, IP, IPv6, TCP, UDP
+
+from get_traces import list_website_profiles, report_to_user
+from pcap_parser import is_excluded
+from profile_store import open_profile_store
+
+
+class LiveDetector:
+    '''
+    Sliding window match counters for a set of profiles.
+
+    window - int, seconds of traffic the verdicts are based on
+    bucket - int, seconds per bucket, the window slides in steps of this size
+    names - list of profile names to watch, default every website profile
+    folder - str, the profile folder, default "ip_profiles"
+    '''
+
+    def __init__(self, window = 60, bucket = 1, names = None, folder = "ip_profiles"):
+        self.folder = folder
+        if names is None:
+            names = list_website_profiles()
+        with open_profile_store(folder) as store:
+            self.names = [name for name in names if store.has_profile(name) and store.is_scored(name)]
+            self.prefilter = store.prefilter()
+        self.window = window
+        self.bucket = bucket
+        self.buckets = deque()      # (bucket start, {ip: hits}) oldest first
+        self.window_hits = {}       # ip -> hits inside the window, only profiled ips
+        self.packets = 0
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        oldest = now - self.window
+        while self.buckets and self.buckets[0][0] + self.bucket <= oldest:
+            _, hits = self.buckets.popleft()
+            for ip, count in hits.items():
+                remaining = self.window_hits[ip] - count
+                if remaining:
+                    self.window_hits[ip] = remaining
+                else:
+                    del self.window_hits[ip]
+
+    def add(self, ip, timestamp):
+        '''
+        Records one sighting of ip at timestamp (seconds)
+        '''
+        if ip not in self.prefilter:
+            return
+        start = timestamp - timestamp % self.bucket
+        with self.lock:
+            if not self.buckets or self.buckets[-1][0] < start:
+                self.buckets.append((start, {}))
+                self._expire(timestamp)
+            hits = self.buckets[-1][1]
+            hits[ip] = hits.get(ip, 0) + 1
+            self.window_hits[ip] = self.window_hits.get(ip, 0) + 1
+
+    def handle_packet(self, pkt):
+        '''
+        AsyncSniffer callback
+        '''
+        self.packets += 1
+        l3 = pkt.getlayer(IP)
+        if l3 is None:
+            l3 = pkt.getlayer(IPv6)
+            if l3 is None:
+                return
+            proto = l3.nh
+        else:
+            proto = l3.proto
+        l4 = l3.payload
+        if isinstance(l4, (TCP, UDP)) and is_excluded(proto, l4.sport, l4.dport):
+            return
+        timestamp = float(pkt.time)
+        self.add(l3.src, timestamp)
+        self.add(l3.dst, timestamp)
+
+    def matches(self, now = None):
+        '''
+        Returns {profile: [[ip, frequency], ...]} for the profiled ips seen inside the window
+        '''
+        with self.lock:
+            self._expire(time.time() if now is None else now)
+            window_ips = list(self.window_hits)
+        with open_profile_store(self.folder) as store:
+            # picks up profiles rebuilt while the detector runs
+            self.prefilter = store.prefilter()
+            return store.match(window_ips, self.names)
+
+    def verdicts(self, now = None):
+        '''
+        Returns {profile: (matches, report)} like check_profiles_in_noisy_trace
+        '''
+        matches = self.matches(now)
+        return {name: (matches[name], report_to_user(name, matches[name])) for name in self.names}
+
+
+'''
+Function: run_live_detection
+Sniffs an interface and prints a report for every profile with matches at a fixed interval.
+
+Parameters:
+    iface - str, interface to sniff, None for scapy's default
+    window - int, seconds of traffic each report covers, default 60
+    interval - int, seconds between reports, default 10
+    duration - int, stop after this many seconds, None to run until interrupted
+    names - list of profile names to watch, default every website profile
+Returns:
+    the LiveDetector used
+Example usage:
+    run_live_detection("en0", window = 120)
+'''
+def run_live_detection(iface = None, window = 60, interval = 10, duration = None, names = None):
+    detector = LiveDetector(window = window, names = names)
+    sniffer = AsyncSniffer(iface = iface, prn = detector.handle_packet, store = False)
+    sniffer.start()
+    started = time.time()
+    try:
+        while duration is None or time.time() - started < duration:
+            time.sleep(interval)
+            print(f"--- {time.strftime('%H:%M:%S')} last {window}s, {detector.packets} packets sniffed ---")
+            for name, (matches, report) in detector.verdicts().items():
+                if matches:
+                    print(f"{report}\n matched ip addresses [IP, frequency]: {matches}\n")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sniffer.stop()
+    return detector
+
+
+if __name__ == "__main__":
+    run_live_detection(sys.argv[1] if len(sys.argv) > 1 else None,
+                       int(sys.argv[2]) if len(sys.argv) > 2 else 60)
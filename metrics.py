@@ -0,0 +1,227 @@
+'''
+Timing spans and counters for the profile building and report pipelines.
+
+A run (one profile build or one report) is opened with run(). Inside it, every stage is
+wrapped in span() and counters are added with count(). Spans nest, so a stage shows up as
+"build_profile_without_noise/sniff_website/capture". When the outermost run ends it is
+appended as one JSON line to metrics.jsonl and a summary table is printed.
+
+Outside a run, span(), timed() and count() do almost nothing, so library functions can always
+be instrumented.
+
+Example usage:
+    with metrics.run("build_profile", website = "spotify"):
+        with metrics.span("capture"):
+            ...
+            metrics.count("packets_captured", 1500)
+'''
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+METRICS_FILE = "metrics.jsonl"
+
+_local = threading.local()      # the run and span stack of the current thread
+
+
+class Run:
+    '''
+    Spans and counters collected for one run.
+
+    name - str, name of the run (ex: "build_profile_without_noise")
+    fields - dictionary of extra values saved with the run (ex: website name)
+    '''
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.started = time.time()
+        self.duration = None
+        self.spans = []         # [path, start offset, seconds, fields], in the order they finished
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            "run": self.name,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "seconds": round(self.duration, 6),
+            "fields": self.fields,
+            "spans": [{"span": path, "start": round(start, 6), "seconds": round(seconds, 6), **fields}
+                      for path, start, seconds, fields in self.spans],
+            "counters": self.counters,
+        }
+
+    def summary(self):
+        '''
+        Returns a text table with the total time of every span path and the counters
+        '''
+        totals = {}
+        for path, _, seconds, _ in self.spans:
+            calls, total = totals.get(path, (0, 0.0))
+            totals[path] = (calls + 1, total + seconds)
+        lines = [f"{self.name}: {self.duration:.2f}s"]
+        for path, (calls, total) in sorted(totals.items()):
+            share = total / self.duration * 100 if self.duration else 0
+            lines.append(f"    {path:<60} {calls:>5}x {total:10.3f}s {share:6.1f}%")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"    {name:<60} {value:>18,}" if isinstance(value, int) else f"    {name:<60} {value:18.2f}")
+        return "\n".join(lines)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+'''
+Function: current_run
+Returns the Run open in this thread, None outside a run
+'''
+def current_run():
+    stack = _stack()
+    return stack[0][0] if stack else None
+
+
+'''
+Function: run
+Opens a run. Nested inside another run it is recorded as a span of that run instead.
+
+Parameters:
+    name - str, name of the run
+    path - str, file the run is appended to, default metrics.jsonl
+    quiet - bool, don't print the summary, default False
+    fields - extra values saved with the run
+Returns:
+    context manager yielding the Run
+Example usage:
+    with metrics.run("report", trace = file):
+        ...
+'''
+@contextlib.contextmanager
+def run(name, path = METRICS_FILE, quiet = False, **fields):
+    if _stack():
+        with span(name, **fields):
+            yield current_run()
+        return
+
+    current = Run(name, fields)
+    stack = _stack()
+    stack.append((current, name, time.perf_counter()))
+    try:
+        yield current
+    finally:
+        stack.pop()
+        current.duration = time.time() - current.started
+        save_run(current, path)
+        if not quiet:
+            print(current.summary())
+
+
+'''
+Function: span
+Times a stage of the current run.
+
+Parameters:
+    name - str, name of the stage
+    fields - extra values saved with the span (ex: packet counts)
+Returns:
+    context manager yielding a dictionary, values put in it are saved with the span
+Example usage:
+    with metrics.span("filter_ips", filter = "background") as fields:
+        fields["removed"] = 12
+'''
+@contextlib.contextmanager
+def span(name, **fields):
+    stack = _stack()
+    if not stack:
+        yield fields
+        return
+    current, parent, _ = stack[-1]
+    path = f"{parent}/{name}"
+    started = time.perf_counter()
+    stack.append((current, path, started))
+    try:
+        yield fields
+    finally:
+        stack.pop()
+        seconds = time.perf_counter() - started
+        with current.lock:
+            current.spans.append([path, started - stack[0][2], seconds, fields])
+
+
+'''
+Function: timed
+Decorator that runs every call of a function in a span named after the function.
+
+Example usage:
+    @metrics.timed
+    def filter_ips(target_website, filter_website):
+        ...
+'''
+def timed(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _stack():
+            return function(*args, **kwargs)
+        with span(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+'''
+Function: count
+Adds value to a counter of the current run, does nothing outside a run.
+
+Parameters:
+    name - str, name of the counter (ex: "packets_captured")
+    value - int or float, default 1
+'''
+def count(name, value = 1):
+    current = current_run()
+    if current is not None:
+        current.count(name, value)
+
+
+'''
+Function: save_run
+Appends a finished run as one JSON line to path
+'''
+def save_run(current, path = METRICS_FILE):
+    try:
+        with open(path, "a") as f:
+            f.write(json.dumps(current.to_dict()) + "\n")
+    except OSError as e:
+        print(f"Error in function save_run: could not write {path}: {e}")
+
+
+'''
+Function: load_runs
+Reads the runs saved in a metrics file.
+
+Parameters:
+    path - str, default metrics.jsonl
+    name - str, only return runs with this name, default every run
+Returns:
+    list of run dictionaries, oldest first
+'''
+def load_runs(path = METRICS_FILE, name = None):
+    if not os.path.exists(path):
+        return []
+    runs = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if name is None or entry["run"] == name:
+                    runs.append(entry)
+    return runs
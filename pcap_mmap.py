@@ -0,0 +1,263 @@
+'''
+Memory-mapped reader for large classic pcap files.
+
+The file is mapped read-only and only the record headers are walked to find where every
+packet starts. Everything else (timestamps, lengths, link/network header fields) is gathered
+with vectorized NumPy indexing on the mapped bytes, so counting packets, slicing a time range
+or extracting IP addresses never builds a python object per packet.
+'''
+
+import mmap
+import struct
+from array import array
+
+import numpy as np
+
+from ip_array import IPArray
+from pcap_parser import (PCAP_MAGICS, PcapFormatError, iter_packets, parse_packet, is_excluded, EXCLUDED_TCP_PORTS,
+                         EXCLUDED_UDP_PORTS, LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6,
+                         LINKTYPE_NULL, LINKTYPE_LOOP, LINKTYPE_LINUX_SLL, LINKTYPE_LINUX_SLL2, ETHERTYPE_IPV4,
+                         ETHERTYPE_IPV6)
+
+PCAP_GLOBAL_HEADER_LEN = 24
+PCAP_RECORD_HEADER_LEN = 16
+
+# record index returned by MappedPcap.records
+RECORD_DTYPE = np.dtype([("offset", np.int64), ("ts", np.float64), ("caplen", np.uint32), ("wirelen", np.uint32)])
+
+# fixed link layer header length per link type, ethernet vlan tags are handled separately
+LINK_HEADER_LENGTHS = {
+    LINKTYPE_ETHERNET: 14,
+    LINKTYPE_RAW: 0,
+    LINKTYPE_IPV4: 0,
+    LINKTYPE_IPV6: 0,
+    LINKTYPE_NULL: 4,
+    LINKTYPE_LOOP: 4,
+    LINKTYPE_LINUX_SLL: 16,
+    LINKTYPE_LINUX_SLL2: 20,
+}
+
+
+class MappedPcap:
+    '''
+    A classic pcap file mapped into memory.
+
+    offsets - int64 array, file offset of the data of every packet
+    linktype - link type of the capture
+    Use as a context manager or call close() to unmap the file.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise PcapFormatError(f"{path} is empty")
+        magic = self._map[:4]
+        if magic not in PCAP_MAGICS:
+            self.close()
+            raise PcapFormatError(f"{path} is not an uncompressed classic pcap file")
+        self.endian, self.ts_div = PCAP_MAGICS[magic]
+        if len(self._map) < PCAP_GLOBAL_HEADER_LEN:
+            self.close()
+            raise PcapFormatError(f"{path} has a truncated pcap header")
+        self.linktype = struct.unpack_from(f"{self.endian}I", self._map, 20)[0] & 0x0FFFFFFF
+        self.buffer = np.frombuffer(self._map, dtype=np.uint8)
+        self.offsets = self._walk_records()
+
+    def _walk_records(self):
+        # the only per packet loop: follow incl_len from one record header to the next
+        offsets = array("q")
+        unpack_len = struct.Struct(f"{self.endian}I").unpack_from
+        data = self._map
+        size = len(data)
+        pos = PCAP_GLOBAL_HEADER_LEN
+        while pos + PCAP_RECORD_HEADER_LEN <= size:
+            incl_len = unpack_len(data, pos + 8)[0]
+            if pos + PCAP_RECORD_HEADER_LEN + incl_len > size:
+                break
+            offsets.append(pos + PCAP_RECORD_HEADER_LEN)
+            pos += PCAP_RECORD_HEADER_LEN + incl_len
+        return np.frombuffer(offsets, dtype=np.int64).copy()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.buffer = None
+        if getattr(self, "_map", None) is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass    # views handed out are still alive, the map is freed with them
+            self._map = None
+        self._file.close()
+
+    def _gather(self, positions, width):
+        '''
+        Reads a width byte big-endian unsigned field at every position
+        '''
+        raw = self.buffer[positions[:, None] + np.arange(width)]
+        value = np.zeros(len(positions), dtype=np.uint64)
+        for i in range(width):
+            value = (value << np.uint64(8)) | raw[:, i]
+        return value
+
+    def _header_field(self, rel_offset):
+        raw = self.buffer[(self.offsets - PCAP_RECORD_HEADER_LEN + rel_offset)[:, None] + np.arange(4)]
+        return np.ascontiguousarray(raw).view(f"{self.endian}u4").ravel().astype(np.uint32)
+
+    def caplens(self):
+        return self._header_field(8)
+
+    def wirelens(self):
+        return self._header_field(12)
+
+    def timestamps(self):
+        return self._header_field(0) + self._header_field(4) / self.ts_div
+
+    def records(self):
+        '''
+        Returns a RECORD_DTYPE structured array with one row per packet
+        '''
+        records = np.empty(len(self), dtype=RECORD_DTYPE)
+        records["offset"] = self.offsets
+        records["ts"] = self.timestamps()
+        records["caplen"] = self.caplens()
+        records["wirelen"] = self.wirelens()
+        return records
+
+    def packet(self, i):
+        '''
+        Returns a memoryview of the captured bytes of packet i (no copy)
+        '''
+        start = int(self.offsets[i])
+        caplen = struct.unpack_from(f"{self.endian}I", self._map, start - 8)[0]
+        return memoryview(self._map)[start:start + caplen]
+
+    def time_slice(self, start, end):
+        '''
+        Returns the indices of the packets captured in [start, end)
+        '''
+        ts = self.timestamps()
+        return np.nonzero((ts >= start) & (ts < end))[0]
+
+    def network_offsets(self):
+        '''
+        Returns (l3 offsets, ethertype) for every packet. ethertype is 0 for packets that are not IP.
+        '''
+        if self.linktype not in LINK_HEADER_LENGTHS:
+            raise PcapFormatError(f"unsupported link type {self.linktype}")
+        caplen = self.caplens().astype(np.int64)
+        offsets = self.offsets
+        ethertype = np.zeros(len(self), dtype=np.uint64)
+        l3 = offsets + LINK_HEADER_LENGTHS[self.linktype]
+        if self.linktype == LINKTYPE_ETHERNET:
+            ok = caplen >= 14
+            ethertype[ok] = self._gather(offsets[ok] + 12, 2)
+            for _ in range(2):      # up to two stacked vlan tags
+                tagged = ok & np.isin(ethertype, [0x8100, 0x88A8, 0x9100]) & (caplen >= (l3 - offsets) + 4)
+                ethertype[tagged] = self._gather(l3[tagged] + 2, 2)
+                l3[tagged] += 4
+        elif self.linktype == LINKTYPE_LINUX_SLL:
+            ok = caplen >= 16
+            ethertype[ok] = self._gather(offsets[ok] + 14, 2)
+        elif self.linktype == LINKTYPE_LINUX_SLL2:
+            ok = caplen >= 20
+            ethertype[ok] = self._gather(offsets[ok], 2)
+        else:
+            ok = caplen > (l3 - offsets)
+            version = np.zeros(len(self), dtype=np.uint64)
+            version[ok] = self.buffer[l3[ok]] >> 4
+            ethertype[version == 4] = ETHERTYPE_IPV4
+            ethertype[version == 6] = ETHERTYPE_IPV6
+        end = offsets + caplen
+        ethertype[(ethertype == ETHERTYPE_IPV4) & (l3 + 20 > end)] = 0
+        ethertype[(ethertype == ETHERTYPE_IPV6) & (l3 + 40 > end)] = 0
+        return l3, ethertype
+
+    def ip_addresses(self, exclude_noise = True):
+        '''
+        Returns an IPArray with the source and destination address of every IP packet,
+        dns, mdns and ssdp packets are left out unless exclude_noise is False
+        '''
+        l3, ethertype = self.network_offsets()
+        end = self.offsets + self.caplens().astype(np.int64)
+
+        v4 = np.nonzero(ethertype == ETHERTYPE_IPV4)[0]
+        v6 = np.nonzero(ethertype == ETHERTYPE_IPV6)[0]
+        if exclude_noise:
+            v4 = v4[~self._noise_v4(l3[v4], end[v4])]
+            v6 = v6[~self._noise_v6(v6, l3[v6], end[v6])]
+
+        base4, base6 = l3[v4], l3[v6]
+        src4 = self._gather(base4 + 12, 4).astype(np.uint32)
+        dst4 = self._gather(base4 + 16, 4).astype(np.uint32)
+        src6 = np.stack([self._gather(base6 + 8, 8), self._gather(base6 + 16, 8)], axis=1)
+        dst6 = np.stack([self._gather(base6 + 24, 8), self._gather(base6 + 32, 8)], axis=1)
+        return IPArray(np.concatenate([src4, dst4]), np.concatenate([src6, dst6]))
+
+    def _excluded_ports(self, proto, l4, end):
+        has_ports = ((proto == 6) | (proto == 17)) & (l4 + 4 <= end)
+        sport = np.zeros(len(l4), dtype=np.uint64)
+        dport = np.zeros(len(l4), dtype=np.uint64)
+        sport[has_ports] = self._gather(l4[has_ports], 2)
+        dport[has_ports] = self._gather(l4[has_ports] + 2, 2)
+        udp_ports = np.array(sorted(EXCLUDED_UDP_PORTS), dtype=np.uint64)
+        tcp_ports = np.array(sorted(EXCLUDED_TCP_PORTS), dtype=np.uint64)
+        udp = has_ports & (proto == 17) & (np.isin(sport, udp_ports) | np.isin(dport, udp_ports))
+        tcp = has_ports & (proto == 6) & (np.isin(sport, tcp_ports) | np.isin(dport, tcp_ports))
+        return udp | tcp
+
+    def _noise_v4(self, l3, end):
+        ihl = (self.buffer[l3].astype(np.int64) & 0x0F) * 4
+        proto = self.buffer[l3 + 9].astype(np.uint64)
+        fragment_offset = self._gather(l3 + 6, 2) & np.uint64(0x1FFF)
+        proto[fragment_offset != 0] = 0     # only the first fragment has ports
+        return self._excluded_ports(proto, l3 + ihl, end)
+
+    def _noise_v6(self, rows, l3, end):
+        proto = self.buffer[l3 + 6].astype(np.uint64)
+        excluded = self._excluded_ports(proto, l3 + 40, end)
+        # packets with extension headers are rare, decode those one at a time
+        for i in np.nonzero(np.isin(proto, [0, 43, 44, 51, 60]))[0]:
+            decoded = parse_packet(self.linktype, bytes(self.packet(rows[i])))
+            excluded[i] = decoded is not None and is_excluded(decoded[2], decoded[3], decoded[4])
+        return excluded
+
+    def count_ips(self, exclude_noise = True):
+        '''
+        Counts every source and destination address, same result as pcap_parser.count_trace_ips
+        '''
+        unique_ips, (counts4, counts6) = self.ip_addresses(exclude_noise).unique(return_counts = True)
+        counts = np.concatenate([counts4, counts6])
+        return {ip: int(count) for ip, count in zip(unique_ips.to_strings(), counts)}
+
+
+'''
+Function: count_packets
+Counts the packets of a trace. Classic pcap files are counted by walking their record headers in
+place, pcapng and compressed files are streamed with pcap_parser.iter_packets.
+
+Parameters:
+    filename - str, path to the pcap or pcapng file, optionally gzip or zstd compressed
+Returns:
+    int, number of complete packets
+Example usage:
+    count_packets("traces/test1.pcap")
+'''
+def count_packets(filename):
+    with open(filename, "rb") as f:
+        magic = f.read(4)
+    if magic not in PCAP_MAGICS:
+        return sum(1 for _ in iter_packets(filename))
+    with MappedPcap(filename) as pcap:
+        return len(pcap)
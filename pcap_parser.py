@@ -0,0 +1,653 @@
+'''
+In-process pcap/pcapng reader used to pull IP addresses out of a trace without tshark.
+
+Only the record headers and the L2/L3/L4 headers of each packet are looked at.
+Addresses are counted as packed bytes and only converted to strings once per unique
+address at the end, so no per-packet text is produced.
+
+Supported link types: Ethernet (with 802.1Q/802.1ad tags), BSD loopback/null,
+raw IPv4/IPv6, Linux cooked capture (SLL and SLL2).
+tshark is kept as a fallback backend for anything this reader does not understand.
+PcapFileWriter writes classic pcap files, optionally cut to the packet headers.
+Traces can be stored gzip or zstd compressed, they are decompressed in chunks while being read.
+'''
+
+import gzip
+import io
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import zlib
+from collections import Counter
+
+
+class PcapFormatError(Exception):
+    pass
+
+
+# pcap magic numbers -> (byte order, timestamp divisor)
+PCAP_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e9),
+}
+PCAPNG_SHB = b"\x0a\x0d\x0d\x0a"
+
+# link types
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+VLAN_ETHERTYPES = (0x8100, 0x88A8, 0x9100)
+
+# equivalent of the tshark display filter "not (dns or mdns or arp or ssdp)"
+# arp never reaches the L3 parser, so only the port based protocols are listed here
+EXCLUDED_TCP_PORTS = frozenset([53, 5353])
+EXCLUDED_UDP_PORTS = frozenset([53, 5353, 1900])
+
+# IPv6 extension headers we walk through to find the transport header
+IPV6_EXTENSION_HEADERS = frozenset([0, 43, 44, 51, 60])
+
+
+# compressed trace files are recognised by their first bytes, not their name
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+TRACE_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+READ_BUFFER = 1 << 20       # bytes decompressed per chunk
+
+
+def _decompress_errors():
+    # what a cut or corrupt compressed stream raises part way through, zstd only if it was imported
+    errors = (EOFError, gzip.BadGzipFile, zlib.error)
+    zstandard = sys.modules.get("zstandard")
+    return errors + (zstandard.ZstdError,) if zstandard is not None else errors
+
+
+class _Read1Stream(io.RawIOBase):
+    '''
+    Raw stream over the read1 of a decompressing file. BufferedReader fills its buffer with one
+    readinto, GzipFile.readinto insists on a full buffer and raises EOFError for a cut stream
+    without returning the packets before the cut, read1 returns what is there.
+    f - file object with read1
+    closes - file objects closed with this stream (GzipFile leaves its fileobj open)
+    '''
+
+    def __init__(self, f, closes = ()):
+        self.f = f
+        self.closes = [f, *closes]
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.f.read1(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            for f in self.closes:
+                f.close()
+        super().close()
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise PcapFormatError("zstd compressed traces need the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+'''
+Function: open_trace
+Opens a trace file for binary reading, decompressing gzip and zstd files as they are read.
+
+Parameters:
+    filename - str, path to a .pcap or .pcapng file, optionally compressed (ex: trace1.pcap.gz)
+Returns:
+    a readable binary file object
+Notes:
+    Compressed files are inflated READ_BUFFER bytes at a time, never as a whole
+'''
+def open_trace(filename):
+    f = open(filename, "rb")
+    magic = f.peek(4)[:4]
+    if magic[:2] == GZIP_MAGIC:
+        return io.BufferedReader(_Read1Stream(gzip.GzipFile(fileobj=f, mode="rb"), [f]), READ_BUFFER)
+    if magic == ZSTD_MAGIC:
+        try:
+            zstandard = _import_zstandard()
+        except PcapFormatError:
+            f.close()
+            raise
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, read_size=READ_BUFFER), READ_BUFFER)
+    return f
+
+
+'''
+Function: open_trace_output
+Opens a trace file for binary writing, compressed as it is written.
+
+Parameters:
+    path - str, file to write (overwritten)
+    compression - str, None (default), "gzip" or "zstd"
+Returns:
+    a writable binary file object
+'''
+def open_trace_output(path, compression = None):
+    if compression is None:
+        return open(path, "wb")
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    if compression == "zstd":
+        zstandard = _import_zstandard()
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"))
+    raise ValueError(f"unknown trace compression {compression}")
+
+
+'''
+Function: compress_trace
+Rewrites a trace compressed, streaming it through in chunks.
+
+Parameters:
+    path - str, path to the trace
+    compression - str, "gzip" (default) or "zstd"
+Returns:
+    str, path of the compressed file (path + .gz or .zst), the original is removed
+Example usage:
+    compress_trace("traces/google/google_trace1.pcap")
+'''
+def compress_trace(path, compression = "gzip"):
+    target = path + TRACE_SUFFIXES[compression]
+    temp_path = f"{target}.{os.getpid()}.tmp"
+    with open_trace(path) as src, open_trace_output(temp_path, compression) as dst:
+        shutil.copyfileobj(src, dst, READ_BUFFER)
+    os.replace(temp_path, target)
+    os.remove(path)
+    return target
+
+
+'''
+Function: iter_pcap_records
+Streams the packets of a classic pcap file.
+
+Parameters:
+    f - binary file object positioned after the 4 byte magic number
+    magic - bytes, the magic number that was read
+Returns:
+    generator of (linktype, timestamp, data, original length) tuples
+'''
+def iter_pcap_records(f, magic):
+    endian, ts_div = PCAP_MAGICS[magic]
+    header = f.read(20)
+    if len(header) < 20:
+        raise PcapFormatError("truncated pcap global header")
+    linktype = struct.unpack(f"{endian}I", header[16:20])[0] & 0x0FFFFFFF
+    record = struct.Struct(f"{endian}IIII")
+    read = f.read
+    while True:
+        rec_header = read(16)
+        if len(rec_header) < 16:
+            return
+        ts_sec, ts_frac, incl_len, orig_len = record.unpack(rec_header)
+        data = read(incl_len)
+        if len(data) < incl_len:
+            return
+        yield linktype, ts_sec + ts_frac / ts_div, data, orig_len
+
+
+# pcapng block types
+PCAPNG_IDB = 1          # interface description
+PCAPNG_PB = 2           # packet block, obsolete but still written by old tools
+PCAPNG_SPB = 3          # simple packet
+PCAPNG_EPB = 6          # enhanced packet
+
+# fixed fields of each decoded block type, the body also ends with the 4 byte block length
+PCAPNG_HEADER_SIZES = {PCAPNG_IDB: 8, PCAPNG_PB: 20, PCAPNG_SPB: 4, PCAPNG_EPB: 20}
+
+# interface description options
+IF_TSRESOL = 9
+IF_TSOFFSET = 14
+
+
+'''
+Function: parse_interface_block
+Reads the link type, snap length and timestamp settings of a pcapng Interface Description Block.
+
+Parameters:
+    body - bytes, the block after its type and length fields (including the trailing length)
+    endian - str, "<" or ">", byte order of the section
+Returns:
+    tuple (linktype, snaplen, timestamp units per second, timestamp offset in seconds)
+Notes:
+    if_tsresol defaults to microseconds, a value with the high bit set is a power of two
+'''
+def parse_interface_block(body, endian):
+    linktype, _, snaplen = struct.unpack(f"{endian}HHI", body[:8])
+    units, offset = 1e6, 0
+    pos, end = 8, len(body) - 4
+    while pos + 4 <= end:
+        code, length = struct.unpack(f"{endian}HH", body[pos:pos + 4])
+        value = body[pos + 4:pos + 4 + length]
+        if code == 0:       # opt_endofopt
+            break
+        if code == IF_TSRESOL and len(value) >= 1:
+            units = 2 ** (value[0] & 0x7F) if value[0] & 0x80 else 10 ** value[0]
+        elif code == IF_TSOFFSET and len(value) >= 8:
+            offset = struct.unpack(f"{endian}q", value[:8])[0]
+        pos += 4 + length + (-length % 4)
+    return linktype, snaplen, units, offset
+
+
+'''
+Function: iter_pcapng_blocks
+Streams the packets of a pcapng file one block at a time.
+
+Parameters:
+    f - binary file object positioned after the 4 byte block type of the first section header
+Returns:
+    generator of (linktype, timestamp, data, original length) tuples
+Notes:
+    Every Section Header Block starts a new section with its own byte order and interfaces.
+    Enhanced, obsolete and Simple Packet blocks are decoded with the link type, timestamp resolution
+    and offset of their interface, every other block type is skipped.
+    Simple Packet blocks carry no timestamp, they are reported at 0.0.
+    Only one block is held in memory at a time.
+    A block too short for its fixed fields raises PcapFormatError.
+'''
+def iter_pcapng_blocks(f):
+    read = f.read
+    block_type = PCAPNG_SHB
+    endian = "<"
+    interfaces = []
+    while True:
+        raw_len = read(4)
+        if len(raw_len) < 4:
+            return
+        if block_type == PCAPNG_SHB:
+            bom = read(4)
+            if bom == b"\x4d\x3c\x2b\x1a":
+                endian = "<"
+            elif bom == b"\x1a\x2b\x3c\x4d":
+                endian = ">"
+            else:
+                raise PcapFormatError("bad pcapng byte order magic")
+            block_len = struct.unpack(f"{endian}I", raw_len)[0]
+            if block_len < 28:
+                raise PcapFormatError(f"bad pcapng section header length {block_len}")
+            if len(read(block_len - 12)) < block_len - 12:
+                return
+            interfaces = []
+        else:
+            btype = struct.unpack(f"{endian}I", block_type)[0]
+            block_len = struct.unpack(f"{endian}I", raw_len)[0]
+            if block_len < 12:
+                raise PcapFormatError(f"bad pcapng block length {block_len}")
+            body = read(block_len - 8)
+            if len(body) < block_len - 8:
+                return
+            if len(body) < PCAPNG_HEADER_SIZES.get(btype, 0) + 4:
+                raise PcapFormatError(f"pcapng block of type {btype} is too short ({block_len} bytes)")
+            if btype == PCAPNG_EPB:
+                if_id, ts_high, ts_low, cap_len, orig_len = struct.unpack(f"{endian}IIIII", body[:20])
+                if if_id >= len(interfaces):
+                    raise PcapFormatError(f"packet for undeclared pcapng interface {if_id}")
+                linktype, _, units, offset = interfaces[if_id]
+                yield linktype, offset + ((ts_high << 32) | ts_low) / units, body[20:20 + cap_len], orig_len
+            elif btype == PCAPNG_IDB:
+                interfaces.append(parse_interface_block(body, endian))
+            elif btype == PCAPNG_SPB:
+                if not interfaces:
+                    raise PcapFormatError("simple packet block before any pcapng interface")
+                orig_len = struct.unpack(f"{endian}I", body[:4])[0]
+                linktype, snaplen = interfaces[0][:2]
+                cap_len = min(orig_len, snaplen) if snaplen else orig_len
+                yield linktype, 0.0, body[4:4 + cap_len], orig_len
+            elif btype == PCAPNG_PB:
+                if_id, _, ts_high, ts_low, cap_len, orig_len = struct.unpack(f"{endian}HHIIII", body[:20])
+                if if_id >= len(interfaces):
+                    raise PcapFormatError(f"packet for undeclared pcapng interface {if_id}")
+                linktype, _, units, offset = interfaces[if_id]
+                yield linktype, offset + ((ts_high << 32) | ts_low) / units, body[20:20 + cap_len], orig_len
+        block_type = read(4)
+        if len(block_type) < 4:
+            return
+
+
+'''
+Function: iter_packets
+Streams every packet of a pcap or pcapng file.
+
+Parameters:
+    filename - str, path to the trace
+Returns:
+    generator of (linktype, timestamp, data, original length) tuples
+Example usage:
+    for linktype, ts, data, length in iter_packets("traces/test1.pcap"): ...
+Notes:
+    raises PcapFormatError if the file is neither pcap nor pcapng
+    a compressed trace that is cut short (killed capture, file still being written) is read up to
+    the break like a truncated record, one that can't be decompressed at all raises PcapFormatError
+'''
+def iter_packets(filename):
+    with open_trace(filename) as f:
+        try:
+            magic = f.read(4)
+        except _decompress_errors() as e:
+            raise PcapFormatError(f"{filename} could not be decompressed: {e}")
+        if magic in PCAP_MAGICS:
+            packets = iter_pcap_records(f, magic)
+        elif magic == PCAPNG_SHB:
+            packets = iter_pcapng_blocks(f)
+        else:
+            raise PcapFormatError(f"{filename} is not a pcap or pcapng file")
+        try:
+            yield from packets
+        except _decompress_errors():
+            return
+
+
+class PcapFileWriter:
+    '''
+    Writes a classic pcap file (little endian, microsecond timestamps) one packet at a time.
+
+    path - str, file to write (overwritten)
+    linktype - int, link type of every packet, default Ethernet
+    snaplen - int, packets are cut to this many bytes, the record header keeps their original length
+    compression - str, None (default), "gzip" or "zstd", see open_trace_output
+    '''
+
+    RECORD = struct.Struct("<IIII")
+
+    def __init__(self, path, linktype = LINKTYPE_ETHERNET, snaplen = 65535, compression = None):
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.f = open_trace_output(path, compression)
+        self.f.write(struct.pack("<4sHHiIII", b"\xd4\xc3\xb2\xa1", 2, 4, 0, 0, snaplen, linktype))
+
+    def write(self, data, timestamp, orig_len = None):
+        sec = int(timestamp)
+        usec = min(int(round((timestamp - sec) * 1e6)), 999999)
+        caplen = min(len(data), self.snaplen)
+        self.f.write(self.RECORD.pack(sec, usec, caplen, len(data) if orig_len is None else orig_len))
+        self.f.write(data[:caplen])
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+'''
+Function: parse_packet
+Decodes the network and transport headers of one captured frame.
+
+Parameters:
+    linktype - int, link type of the interface the frame was captured on
+    data - bytes, the captured frame
+Returns:
+    (src, dst, proto, sport, dport) with src and dst as packed address bytes,
+    sport and dport are None when there is no (readable) tcp/udp header.
+    None if the frame does not carry IPv4 or IPv6.
+'''
+def parse_packet(linktype, data):
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None
+        ethertype = (data[12] << 8) | data[13]
+        offset = 14
+        while ethertype in VLAN_ETHERTYPES and len(data) >= offset + 4:
+            ethertype = (data[offset + 2] << 8) | data[offset + 3]
+            offset += 4
+    elif linktype == LINKTYPE_RAW or linktype == LINKTYPE_IPV4 or linktype == LINKTYPE_IPV6:
+        if not data:
+            return None
+        version = data[0] >> 4
+        ethertype = ETHERTYPE_IPV4 if version == 4 else ETHERTYPE_IPV6 if version == 6 else 0
+        offset = 0
+    elif linktype == LINKTYPE_NULL or linktype == LINKTYPE_LOOP:
+        if len(data) < 5:
+            return None
+        version = data[4] >> 4
+        ethertype = ETHERTYPE_IPV4 if version == 4 else ETHERTYPE_IPV6 if version == 6 else 0
+        offset = 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None
+        ethertype = (data[14] << 8) | data[15]
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if len(data) < 20:
+            return None
+        ethertype = (data[0] << 8) | data[1]
+        offset = 20
+    else:
+        raise PcapFormatError(f"unsupported link type {linktype}")
+
+    if ethertype == ETHERTYPE_IPV4:
+        if len(data) < offset + 20:
+            return None
+        ihl = (data[offset] & 0x0F) * 4
+        proto = data[offset + 9]
+        src = data[offset + 12:offset + 16]
+        dst = data[offset + 16:offset + 20]
+        fragment_offset = ((data[offset + 6] & 0x1F) << 8) | data[offset + 7]
+        l4 = offset + ihl if fragment_offset == 0 else -1
+    elif ethertype == ETHERTYPE_IPV6:
+        if len(data) < offset + 40:
+            return None
+        proto = data[offset + 6]
+        src = data[offset + 8:offset + 24]
+        dst = data[offset + 24:offset + 40]
+        l4 = offset + 40
+        while proto in IPV6_EXTENSION_HEADERS and len(data) >= l4 + 8:
+            if proto == 44:     # fragment header, only the first fragment has ports
+                if ((data[l4 + 2] << 8) | data[l4 + 3]) & 0xFFF8:
+                    proto, l4 = data[l4], -1
+                    break
+                proto, l4 = data[l4], l4 + 8
+            elif proto == 51:   # authentication header
+                proto, l4 = data[l4], l4 + (data[l4 + 1] + 2) * 4
+            else:
+                proto, l4 = data[l4], l4 + (data[l4 + 1] + 1) * 8
+    else:
+        return None
+
+    sport = dport = None
+    if (proto == 6 or proto == 17) and l4 >= 0 and len(data) >= l4 + 4:
+        sport = (data[l4] << 8) | data[l4 + 1]
+        dport = (data[l4 + 2] << 8) | data[l4 + 3]
+    return src, dst, proto, sport, dport
+
+
+'''
+Function: is_excluded
+Checks whether a decoded packet belongs to a protocol we drop from traces (dns, mdns, ssdp).
+
+Parameters:
+    proto - int, IP protocol number
+    sport - int or None, source port
+    dport - int or None, destination port
+Returns:
+    True if the packet should be skipped
+'''
+def is_excluded(proto, sport, dport):
+    if sport is None:
+        return False
+    if proto == 17:
+        return sport in EXCLUDED_UDP_PORTS or dport in EXCLUDED_UDP_PORTS
+    if proto == 6:
+        return sport in EXCLUDED_TCP_PORTS or dport in EXCLUDED_TCP_PORTS
+    return False
+
+
+'''
+Function: ip_to_str
+Converts a packed IPv4 or IPv6 address into the string format tshark prints.
+'''
+def ip_to_str(packed):
+    if len(packed) == 4:
+        return socket.inet_ntop(socket.AF_INET, packed)
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+'''
+Function: iter_decoded
+Streams the decoded IP packets of a trace, the one decode and noise exclusion step shared by
+count_trace_ips, the time index and flow_table.
+
+Parameters:
+    filename - str, path to the trace
+    exclude_noise - bool, drop dns, mdns, arp and ssdp packets like the tshark -Y filter does, default True
+Returns:
+    generator of ((src, dst, proto, sport, dport), timestamp, original length) tuples, addresses packed
+Notes:
+    packets that are not IPv4/IPv6 are skipped
+'''
+def iter_decoded(filename, exclude_noise = True):
+    for linktype, ts, data, length in iter_packets(filename):
+        decoded = parse_packet(linktype, data)
+        if decoded is None:
+            continue
+        if exclude_noise and is_excluded(decoded[2], decoded[3], decoded[4]):
+            continue
+        yield decoded, ts, length
+
+
+'''
+Function: count_trace_ips
+Reads a pcap/pcapng file and counts how often every IP address shows up as a source or destination.
+
+Parameters:
+    filename - str, path to the trace
+    exclude_noise - bool, drop dns, mdns, arp and ssdp packets like the tshark -Y filter does, default True
+    flows - flow_table.FlowTable to fill with the 5-tuple flows of the trace in the same pass, default None
+    time_index - time_index.TimeIndex to fill with per-second hits of every address in the same pass, default None
+Returns:
+    dictionary of {ip: count}, same format as get_traces.get_trace_ips
+Example usage:
+    count_trace_ips("traces/test1.pcap")
+    count_trace_ips("traces/test1.pcap", flows = FlowTable())
+    count_trace_ips("traces/test1.pcap", time_index = TimeIndex())
+Notes:
+    raises PcapFormatError for files or link types it cannot decode
+'''
+def count_trace_ips(filename, exclude_noise = True, flows = None, time_index = None):
+    packets = iter_decoded(filename, exclude_noise)
+    if flows is not None:
+        from flow_table import iter_flows
+        packets = iter_flows(flows, packets)
+
+    if time_index is not None:
+        # the index holds every packet of every address, so the counts are read back from it
+        hits, untimed, width = time_index.hits, time_index.untimed, time_index.width
+        untimed_before = time_index.untimed_before
+        for (src, dst, _, _, _), ts, length in packets:
+            # TimeIndex.add inlined, this runs once per packet
+            if ts < untimed_before:
+                for ip in (src, dst):
+                    hits.setdefault(ip, {})
+                    untimed[ip] = untimed.get(ip, 0) + 1
+                continue
+            bucket = int(ts // width)
+            buckets = hits.get(src)
+            if buckets is None:
+                buckets = hits[src] = {}
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+            buckets = hits.get(dst)
+            if buckets is None:
+                buckets = hits[dst] = {}
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+        return time_index.finish().ip_counts()
+
+    counts = Counter()
+    for (src, dst, _, _, _), ts, length in packets:
+        counts[src] += 1
+        counts[dst] += 1
+    return {ip_to_str(ip): count for ip, count in counts.items()}
+
+
+'''
+Function: tshark_trace_ips
+Fallback backend: counts the IP addresses of a trace by piping tshark output instead of writing a csv.
+
+Parameters:
+    filename - str, path to the trace
+    exclude_noise - bool, apply the "not (dns or mdns or arp or ssdp)" display filter, default True
+    time_index - time_index.TimeIndex to fill from the frame times, default None
+Returns:
+    dictionary of {ip: count}
+'''
+def tshark_trace_ips(filename, exclude_noise = True, time_index = None):
+    shark_args = f"tshark -r {filename} -T fields -e ip.src -e ip.dst -e ipv6.src -e ipv6.dst".split()
+    if time_index is not None:
+        shark_args[5:5] = ["-e", "frame.time_epoch"]
+    if exclude_noise:
+        shark_args[3:3] = ["-Y", "not (dns or mdns or arp or ssdp)"]
+    output = subprocess.run(shark_args, stdout=subprocess.PIPE, text=True).stdout
+    if time_index is not None:
+        for line in output.splitlines():
+            ts, *ips = line.split("\t")
+            for ip in ips:
+                if ip:
+                    time_index.add(ip, float(ts))
+        return time_index.finish().ip_counts()
+    counts = Counter()
+    for line in output.splitlines():
+        for ip in line.split("\t"):
+            if ip:
+                counts[ip] += 1
+    return dict(counts)
+
+
+'''
+Function: extract_trace_ips
+Counts the IP addresses in a trace with the chosen backend.
+
+Parameters:
+    filename - str, path to the trace
+    backend - str, "native" (default) or "tshark"
+    exclude_noise - bool, drop dns, mdns, arp and ssdp packets, default True
+    flows - flow_table.FlowTable filled in the same pass, native backend only, default None
+    time_index - time_index.TimeIndex filled in the same pass, default None
+Returns:
+    dictionary of {ip: count}
+Example usage:
+    extract_trace_ips("traces/test1.pcap")
+Notes:
+    The native backend falls back to tshark when it cannot decode the file and tshark is installed,
+    flows stays empty in that case
+'''
+def extract_trace_ips(filename, backend = "native", exclude_noise = True, flows = None, time_index = None):
+    if backend == "tshark":
+        return tshark_trace_ips(filename, exclude_noise, time_index)
+    if backend != "native":
+        raise ValueError(f"unknown trace backend {backend}")
+    try:
+        return count_trace_ips(filename, exclude_noise, flows, time_index)
+    except PcapFormatError as e:
+        if shutil.which("tshark") is None:
+            raise
+        print(f"Native parser could not read {os.path.basename(filename)} ({e}), falling back to tshark")
+        if flows is not None:
+            flows.flows.clear()
+        if time_index is not None:
+            time_index.hits.clear()
+            time_index.untimed.clear()
+        return tshark_trace_ips(filename, exclude_noise, time_index)
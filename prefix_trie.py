@@ -0,0 +1,158 @@
+'''
+Prefix trie for longest-prefix matching of IPv4 and IPv6 addresses.
+
+The trie walks one address byte per level (a 256-way radix tree). Prefixes that do not end
+on a byte boundary are expanded into every byte value they cover on their last level, so a
+lookup costs at most 4 (IPv4) or 16 (IPv6) dictionary steps regardless of how many prefixes
+are stored.
+'''
+
+import csv
+import os
+import socket
+
+
+class PrefixTrie:
+    '''
+    A trie of address prefixes of one address family.
+    Every node is [children, prefix_length] where prefix_length is the longest prefix ending there.
+    '''
+
+    def __init__(self):
+        self.root = [{}, None]
+        self.count = 0
+
+    def insert(self, packed, prefix_length):
+        '''
+        Adds the first prefix_length bits of the packed address
+        '''
+        full, rem = divmod(prefix_length, 8)
+        node = self.root
+        for byte in packed[:full]:
+            node = node[0].setdefault(byte, [{}, None])
+        if rem == 0:
+            if node[1] is None or node[1] < prefix_length:
+                node[1] = prefix_length
+        else:
+            base = packed[full] & ((0xFF << (8 - rem)) & 0xFF)
+            for byte in range(base, base + (1 << (8 - rem))):
+                child = node[0].setdefault(byte, [{}, None])
+                if child[1] is None or child[1] < prefix_length:
+                    child[1] = prefix_length
+        self.count += 1
+
+    def longest_prefix(self, packed):
+        '''
+        Returns the length of the longest stored prefix covering the packed address, or None
+        '''
+        node = self.root
+        best = node[1]
+        for byte in packed:
+            node = node[0].get(byte)
+            if node is None:
+                break
+            if node[1] is not None:
+                best = node[1]
+        return best
+
+    def __contains__(self, packed):
+        return self.longest_prefix(packed) is not None
+
+    def __len__(self):
+        return self.count
+
+
+class PrefixFilter:
+    '''
+    One PrefixTrie per address family, built from address strings.
+    Entries may be plain addresses, which use the default prefix length of their family,
+    or CIDR blocks such as "151.101.0.0/16" or "2606:4700::/32".
+    '''
+
+    def __init__(self, ips = (), v4_prefix = 32, v6_prefix = 128):
+        self.v4 = PrefixTrie()
+        self.v6 = PrefixTrie()
+        self.v4_prefix = v4_prefix
+        self.v6_prefix = v6_prefix
+        for ip in ips:
+            self.add(ip)
+
+    def add(self, ip):
+        '''
+        Adds an address or CIDR block, returns False if it could not be parsed or the prefix length
+        is outside 0-32 (IPv4) / 0-128 (IPv6)
+        '''
+        address, _, length = ip.partition("/")
+        packed = pack_ip(address)
+        if packed is None or (length and not length.isdigit()):
+            return False
+        if len(packed) == 4:
+            trie, prefix_length = self.v4, int(length) if length else self.v4_prefix
+        else:
+            trie, prefix_length = self.v6, int(length) if length else self.v6_prefix
+        if not 0 <= prefix_length <= len(packed) * 8:
+            return False
+        trie.insert(packed, prefix_length)
+        return True
+
+    def contains(self, ip):
+        '''
+        True if the address string falls in one of the stored prefixes
+        '''
+        packed = pack_ip(ip)
+        if packed is None:
+            return False
+        if len(packed) == 4:
+            return self.v4.longest_prefix(packed) is not None
+        return self.v6.longest_prefix(packed) is not None
+
+    def __contains__(self, ip):
+        return self.contains(ip)
+
+
+'''
+Function: pack_ip
+Converts an IPv4 or IPv6 string into packed bytes.
+
+Parameters:
+    ip - str, the address
+Returns:
+    4 or 16 bytes, or None if ip is not an address
+'''
+def pack_ip(ip):
+    try:
+        if ":" in ip:
+            return socket.inet_pton(socket.AF_INET6, ip)
+        return socket.inet_pton(socket.AF_INET, ip)
+    except (OSError, TypeError):
+        return None
+
+
+# (path, mtime, v4_prefix, v6_prefix) -> PrefixFilter
+_filters = {}
+
+'''
+Function: load_prefix_filter
+Builds the PrefixFilter of a profile csv once and reuses it until the file changes.
+
+Parameters:
+    path - str, path to the profile csv (addresses in the first column)
+    v4_prefix - int, prefix length used for plain IPv4 addresses
+    v6_prefix - int, prefix length used for plain IPv6 addresses
+Returns:
+    PrefixFilter
+Example usage:
+    background = load_prefix_filter("ip_profiles/background.csv", 24, 64)
+    "151.101.1.7" in background
+'''
+def load_prefix_filter(path, v4_prefix = 32, v6_prefix = 128):
+    key = (path, os.path.getmtime(path), v4_prefix, v6_prefix)
+    prefix_filter = _filters.get(key)
+    if prefix_filter is None:
+        with open(path, newline='') as f:
+            ips = [row[0] for row in csv.reader(f) if row]
+        prefix_filter = PrefixFilter(ips, v4_prefix, v6_prefix)
+        for old_key in [k for k in _filters if k[0] == path and k[2:] == key[2:]]:
+            del _filters[old_key]
+        _filters[key] = prefix_filter
+    return prefix_filter
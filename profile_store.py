@@ -0,0 +1,509 @@
+'''
+SQLite store for the IP profiles.
+
+Tables:
+    profiles        one row per profile (name, number of traces counted, csv mirror mtime)
+    ips             every address once
+    profile_ips     the addresses of a profile and their frequency (NULL for profiles built
+                    without frequencies such as background and chrome), filter_ips deletes from here
+    trace_counts    raw per profile, per address count of traces the address showed up in
+    traces          trace files already counted into a profile
+    website_ips     addresses each website profile was registered with by check_duplicates
+    ip_counts       address -> number of website profiles registered with it, kept up to date by
+                    triggers on website_ips, an address with a count of 2 or more is a duplicate
+    store_state     one row with a random id of the database and a counter that triggers on
+                    profile_ips bump whenever an address is added to or removed from a profile
+
+A Bloom filter over the addresses of all profiles ({folder}/prefilter.bloom, see bloom_filter.py)
+lets match() skip trace addresses that are in no profile. It is saved with the store_state id and
+counter and rebuilt the first time it is used after a profile changed. It is off by default: an
+indexed lookup costs about as much as a filter probe, so it only pays off for large traces of
+mostly unprofiled addresses (match(..., prefilter = True)). Live detection uses it to screen packets.
+
+Every change runs in one transaction. ip_profiles/{name}.csv is kept as a mirror of each profile
+for the charts and older tools: the store rewrites it after every change, and a csv that was
+changed outside the store (or copied in) is imported again the next time the store is opened.
+
+Example usage:
+    with open_profile_store() as store:
+        matches = store.match(trace_ips, ["spotify"])
+'''
+
+import contextlib
+import csv
+import os
+import sqlite3
+
+from bloom_filter import BloomFilter
+
+STORE_FILE = "profiles.db"
+PREFILTER_FILE = "prefilter.bloom"
+PREFILTER_ERROR_RATE = 0.01
+
+_prefilters = {}        # prefilter path -> BloomFilter already loaded in this process
+
+# CROSS JOIN fixes the join order: SQLite would otherwise start from profile_ips (it has no
+# statistics about the small temp table) and scan every profile row. Starting from the trace
+# addresses, each costs one lookup in ips and one range of profile_ips_by_ip, however many
+# profiles there are
+MATCH_QUERY = """SELECT profiles.name, q.ip, profile_ips.frequency FROM temp.query_ips AS q
+                 CROSS JOIN ips ON ips.ip = q.ip
+                 CROSS JOIN profile_ips ON profile_ips.ip_id = ips.id
+                 CROSS JOIN profiles ON profiles.id = profile_ips.profile_id
+                 ORDER BY q.rowid, profiles.name"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    trace_count INTEGER NOT NULL DEFAULT 0,
+    csv_mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS ips (
+    id INTEGER PRIMARY KEY,
+    ip TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS profile_ips (
+    profile_id INTEGER NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    ip_id INTEGER NOT NULL REFERENCES ips(id),
+    frequency TEXT,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (profile_id, ip_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS profile_ips_by_ip ON profile_ips(ip_id, profile_id);
+CREATE TABLE IF NOT EXISTS trace_counts (
+    profile_id INTEGER NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    ip_id INTEGER NOT NULL REFERENCES ips(id),
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (profile_id, ip_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS traces (
+    profile_id INTEGER NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    file TEXT NOT NULL,
+    PRIMARY KEY (profile_id, file)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS website_ips (
+    profile_id INTEGER NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    ip_id INTEGER NOT NULL REFERENCES ips(id),
+    PRIMARY KEY (profile_id, ip_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS website_ips_by_ip ON website_ips(ip_id);
+CREATE TABLE IF NOT EXISTS ip_counts (
+    ip_id INTEGER PRIMARY KEY REFERENCES ips(id),
+    profiles INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS website_ips_added AFTER INSERT ON website_ips BEGIN
+    INSERT INTO ip_counts (ip_id, profiles) VALUES (new.ip_id, 1)
+    ON CONFLICT (ip_id) DO UPDATE SET profiles = profiles + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS website_ips_removed AFTER DELETE ON website_ips BEGIN
+    UPDATE ip_counts SET profiles = profiles - 1 WHERE ip_id = old.ip_id;
+    DELETE FROM ip_counts WHERE ip_id = old.ip_id AND profiles <= 0;
+END;
+CREATE TABLE IF NOT EXISTS store_state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    instance BLOB NOT NULL,
+    generation INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO store_state (id, instance, generation) VALUES (0, randomblob(8), 0);
+CREATE TRIGGER IF NOT EXISTS profile_ips_added AFTER INSERT ON profile_ips BEGIN
+    UPDATE store_state SET generation = generation + 1 WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS profile_ips_removed AFTER DELETE ON profile_ips BEGIN
+    UPDATE store_state SET generation = generation + 1 WHERE id = 0;
+END;
+"""
+
+
+class ProfileStore:
+    '''
+    A connection to the profile store of a folder. Use open_profile_store().
+
+    folder - str, the profile folder, the database is {folder}/profiles.db
+    '''
+
+    def __init__(self, folder = "ip_profiles"):
+        self.folder = folder
+        self.db = sqlite3.connect(os.path.join(folder, STORE_FILE), timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''
+        Runs the block in one write transaction, rolled back if it raises
+        '''
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    ##############################################################################################
+    # profiles
+    ##############################################################################################
+
+    def _profile_id(self, name, create = False):
+        row = self.db.execute("SELECT id FROM profiles WHERE name = ?", (name,)).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        return self.db.execute("INSERT INTO profiles (name) VALUES (?)", (name,)).lastrowid
+
+    def _ip_ids(self, ips):
+        '''
+        Returns {ip: id} for a list of addresses, adding the ones not in the ips table yet
+        '''
+        self.db.executemany("INSERT OR IGNORE INTO ips (ip) VALUES (?)", ((ip,) for ip in ips))
+        ids = {}
+        for start in range(0, len(ips), 900):
+            chunk = ips[start:start + 900]
+            query = f"SELECT ip, id FROM ips WHERE ip IN ({','.join('?' * len(chunk))})"
+            ids.update(self.db.execute(query, chunk))
+        return ids
+
+    def profile_names(self):
+        return [row[0] for row in self.db.execute("SELECT name FROM profiles ORDER BY name")]
+
+    def has_profile(self, name):
+        return self._profile_id(name) is not None
+
+    def is_scored(self, name):
+        '''
+        True if every address of the profile has a frequency
+        '''
+        row = self.db.execute("""SELECT count(*), count(frequency) FROM profile_ips
+                                 JOIN profiles ON profiles.id = profile_id WHERE name = ?""", (name,)).fetchone()
+        return row[0] == row[1]
+
+    def profile_ips(self, name, frequency = False):
+        '''
+        Returns the addresses of a profile in csv order, as [ip, frequency] pairs if frequency is True
+        '''
+        rows = self.db.execute("""SELECT ip, frequency FROM profile_ips
+                                  JOIN profiles ON profiles.id = profile_id JOIN ips ON ips.id = ip_id
+                                  WHERE name = ? ORDER BY position""", (name,))
+        if frequency:
+            return [[ip, freq] for ip, freq in rows]
+        return [ip for ip, _ in rows]
+
+    def replace_profile(self, name, rows):
+        '''
+        Sets the addresses of a profile. rows is a list of [ip] or [ip, frequency]
+        '''
+        with self.transaction():
+            self._replace_rows(self._profile_id(name, create = True), rows)
+            self._export_csv(name)
+
+    def _replace_rows(self, profile_id, rows):
+        seen = {}
+        for row in rows:
+            if row and row[0] and row[0] not in seen:
+                seen[row[0]] = row[1] if len(row) > 1 else None
+        ids = self._ip_ids(list(seen))
+        self.db.execute("DELETE FROM profile_ips WHERE profile_id = ?", (profile_id,))
+        self.db.executemany("INSERT INTO profile_ips (profile_id, ip_id, frequency, position) VALUES (?, ?, ?, ?)",
+                            ((profile_id, ids[ip], freq, i) for i, (ip, freq) in enumerate(seen.items())))
+
+    def add_ips(self, name, ips):
+        '''
+        Adds addresses without a frequency to a profile (used for background and chrome).
+        Returns the number of addresses that were new to the profile
+        '''
+        with self.transaction():
+            profile_id = self._profile_id(name, create = True)
+            ids = self._ip_ids(list(dict.fromkeys(ip for ip in ips if ip)))
+            start = self.db.execute("SELECT coalesce(max(position) + 1, 0) FROM profile_ips WHERE profile_id = ?",
+                                    (profile_id,)).fetchone()[0]
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO profile_ips (profile_id, ip_id, frequency, position) VALUES (?, ?, NULL, ?)",
+                                ((profile_id, ip_id, start + i) for i, ip_id in enumerate(ids.values())))
+            added = self.db.total_changes - before
+            self._export_csv(name)
+        return added
+
+    def delete_profile(self, name):
+        with self.transaction():
+            self.db.execute("DELETE FROM profiles WHERE name = ?", (name,))
+
+    ##############################################################################################
+    # frequency profiles built from trace counts
+    ##############################################################################################
+
+    def counted_traces(self, name):
+        return [row[0] for row in self.db.execute(
+            "SELECT file FROM traces JOIN profiles ON profiles.id = profile_id WHERE name = ?", (name,))]
+
+    def trace_count(self, name):
+        row = self.db.execute("SELECT trace_count FROM profiles WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def reset_counts(self, name):
+        with self.transaction():
+            profile_id = self._profile_id(name)
+            if profile_id is not None:
+                self.db.execute("DELETE FROM trace_counts WHERE profile_id = ?", (profile_id,))
+                self.db.execute("DELETE FROM traces WHERE profile_id = ?", (profile_id,))
+                self.db.execute("UPDATE profiles SET trace_count = 0 WHERE id = ?", (profile_id,))
+
+    def add_trace_counts(self, name, trace_files, counts):
+        '''
+        Adds the counts of new trace files and rewrites the profile from all counts, most frequent first.
+
+        trace_files - list of trace file names that were counted
+        counts - {ip: number of the new traces the ip showed up in}
+        '''
+        with self.transaction():
+            profile_id = self._profile_id(name, create = True)
+            self._add_counts(profile_id, trace_files, counts)
+            self._rewrite_from_counts(profile_id)
+            self._export_csv(name)
+
+    def _add_counts(self, profile_id, trace_files, counts):
+        ids = self._ip_ids(list(counts))
+        self.db.executemany("""INSERT INTO trace_counts (profile_id, ip_id, hits) VALUES (?, ?, ?)
+                               ON CONFLICT (profile_id, ip_id) DO UPDATE SET hits = hits + excluded.hits""",
+                            ((profile_id, ids[ip], hits) for ip, hits in counts.items()))
+        self.db.executemany("INSERT OR IGNORE INTO traces (profile_id, file) VALUES (?, ?)",
+                            ((profile_id, file) for file in trace_files))
+        self.db.execute("UPDATE profiles SET trace_count = trace_count + ? WHERE id = ?", (len(trace_files), profile_id))
+
+    def _rewrite_from_counts(self, profile_id):
+        trace_count = self.db.execute("SELECT trace_count FROM profiles WHERE id = ?", (profile_id,)).fetchone()[0]
+        self.db.execute("DELETE FROM profile_ips WHERE profile_id = ?", (profile_id,))
+        if trace_count:
+            self.db.execute("""INSERT INTO profile_ips (profile_id, ip_id, frequency, position)
+                               SELECT profile_id, ip_id, printf('%.2f', hits * 1.0 / ?),
+                                      row_number() OVER (ORDER BY hits DESC, ip_id)
+                               FROM trace_counts WHERE profile_id = ?""", (trace_count, profile_id))
+
+    def rewrite_from_counts(self, name):
+        '''
+        Rewrites a profile from its stored counts (undoes filters)
+        '''
+        with self.transaction():
+            profile_id = self._profile_id(name)
+            if profile_id is not None:
+                self._rewrite_from_counts(profile_id)
+                self._export_csv(name)
+
+    ##############################################################################################
+    # batch queries
+    ##############################################################################################
+
+    def _load_temp_ips(self, ips):
+        # call inside a transaction, the connection would otherwise commit once per address
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS query_ips (ip TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM temp.query_ips")
+        self.db.executemany("INSERT OR IGNORE INTO temp.query_ips (ip) VALUES (?)", ((ip,) for ip in ips))
+
+    def prefilter(self):
+        '''
+        Returns the Bloom filter over the addresses of every profile, rebuilt if a profile changed
+        since it was saved
+        '''
+        path = os.path.join(self.folder, PREFILTER_FILE)
+        self.db.execute("BEGIN")
+        try:
+            instance, generation = self.db.execute("SELECT instance, generation FROM store_state").fetchone()
+            tag = instance + generation.to_bytes(8, "big")
+            bloom = _prefilters.get(path)
+            if bloom is None or bloom.tag != tag:
+                bloom = BloomFilter.load(path)
+            if bloom is None or bloom.tag != tag:
+                ips = [row[0] for row in self.db.execute(
+                    "SELECT ip FROM ips WHERE id IN (SELECT ip_id FROM profile_ips)")]
+                bloom = BloomFilter.from_items(ips, PREFILTER_ERROR_RATE, tag = tag)
+                bloom.save(path)
+        finally:
+            self.db.execute("COMMIT")
+        _prefilters[path] = bloom
+        return bloom
+
+    def match(self, trace_ips, names = None, prefilter = False):
+        '''
+        Returns {profile: [[ip, frequency], ...]} for the trace ips found in each profile,
+        in the order of trace_ips.
+        With prefilter, addresses the Bloom filter rejects are dropped before the store is queried
+        '''
+        names = self.profile_names() if names is None else list(names)
+        matches = {name: [] for name in names}
+        if prefilter:
+            trace_ips = self.prefilter().filter(trace_ips)
+        self.db.execute("BEGIN")
+        try:
+            self._load_temp_ips(trace_ips)
+            for name, ip, frequency in self.db.execute(MATCH_QUERY):
+                if name in matches:
+                    matches[name].append([ip, frequency])
+        finally:
+            self.db.execute("COMMIT")
+        return matches
+
+    def remove_ips(self, name, ips):
+        '''
+        Deletes addresses from a profile in one transaction, returns how many were removed
+        '''
+        with self.transaction():
+            profile_id = self._profile_id(name)
+            if profile_id is None:
+                return 0
+            self._load_temp_ips(ips)
+            removed = self.db.execute("""DELETE FROM profile_ips WHERE profile_id = ? AND ip_id IN
+                                         (SELECT ips.id FROM temp.query_ips AS q JOIN ips ON ips.ip = q.ip)""",
+                                      (profile_id,)).rowcount
+            if removed:
+                self._export_csv(name)
+        return removed
+
+    def filter_profile(self, target, prefix_filter):
+        '''
+        Removes every address of target that prefix_filter contains (see prefix_trie.PrefixFilter),
+        returns how many were removed
+        '''
+        return self.remove_ips(target, [ip for ip in self.profile_ips(target) if ip in prefix_filter])
+
+    def shared_ips(self, name, others = None):
+        '''
+        Returns the addresses of a profile that are also in at least one other profile.
+        others restricts the comparison to the given profiles, default every other profile
+        '''
+        query = """SELECT DISTINCT ips.ip FROM profile_ips AS mine
+                   JOIN profiles AS p ON p.id = mine.profile_id
+                   JOIN profile_ips AS theirs ON theirs.ip_id = mine.ip_id AND theirs.profile_id != mine.profile_id
+                   JOIN profiles AS o ON o.id = theirs.profile_id
+                   JOIN ips ON ips.id = mine.ip_id
+                   WHERE p.name = ?"""
+        if others is None:
+            return [row[0] for row in self.db.execute(query, (name,))]
+        others = list(others)
+        query += f" AND o.name IN ({','.join('?' * len(others))})"
+        return [row[0] for row in self.db.execute(query, [name] + others)] if others else []
+
+    ##############################################################################################
+    # cross profile duplicates
+    ##############################################################################################
+
+    def registered_profiles(self):
+        return [row[0] for row in self.db.execute(
+            "SELECT DISTINCT name FROM website_ips JOIN profiles ON profiles.id = profile_id ORDER BY name")]
+
+    def duplicate_ips(self):
+        '''
+        Returns every address registered by two or more website profiles
+        '''
+        return [row[0] for row in self.db.execute(
+            "SELECT ip FROM ip_counts JOIN ips ON ips.id = ip_id WHERE profiles >= 2 ORDER BY ip")]
+
+    def register_profile(self, name):
+        '''
+        Adds the addresses of a website profile to the cross profile counts and removes duplicates.
+        Only addresses new to the profile are counted and only the profiles sharing one of the newly
+        duplicated addresses are changed, so the cost follows the size of this profile and not the
+        number of profiles.
+        Returns {profile: number of addresses removed} for every profile that changed
+        '''
+        with self.transaction():
+            profile_id = self._profile_id(name)
+            if profile_id is None:
+                return {}
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS new_ips (ip_id INTEGER PRIMARY KEY)")
+            self.db.execute("DELETE FROM temp.new_ips")
+            self.db.execute("""INSERT INTO temp.new_ips (ip_id)
+                               SELECT ip_id FROM profile_ips WHERE profile_id = ?
+                               EXCEPT SELECT ip_id FROM website_ips WHERE profile_id = ?""", (profile_id, profile_id))
+            self.db.execute("INSERT INTO website_ips (profile_id, ip_id) SELECT ?, ip_id FROM temp.new_ips", (profile_id,))
+
+            removed = {}
+            # every address of this profile that another profile has too
+            count = self.db.execute("""DELETE FROM profile_ips WHERE profile_id = ? AND ip_id IN
+                                       (SELECT ip_id FROM ip_counts WHERE profiles >= 2)""", (profile_id,)).rowcount
+            if count:
+                removed[name] = count
+            # addresses that only became duplicates with this profile are still in the profile they came from
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS shared_now (ip_id INTEGER PRIMARY KEY)")
+            self.db.execute("DELETE FROM temp.shared_now")
+            self.db.execute("""INSERT INTO temp.shared_now (ip_id) SELECT n.ip_id FROM temp.new_ips AS n
+                               JOIN ip_counts ON ip_counts.ip_id = n.ip_id WHERE ip_counts.profiles = 2""")
+            others = self.db.execute("""SELECT DISTINCT profiles.id, profiles.name FROM temp.shared_now AS s
+                                        JOIN website_ips ON website_ips.ip_id = s.ip_id
+                                        JOIN profiles ON profiles.id = website_ips.profile_id
+                                        WHERE profiles.id != ?""", (profile_id,)).fetchall()
+            for other_id, other in others:
+                count = self.db.execute("""DELETE FROM profile_ips WHERE profile_id = ? AND ip_id IN
+                                           (SELECT ip_id FROM temp.shared_now)""", (other_id,)).rowcount
+                if count:
+                    removed[other] = count
+            for changed in removed:
+                self._export_csv(changed)
+        return removed
+
+    ##############################################################################################
+    # csv mirror
+    ##############################################################################################
+
+    def _export_csv(self, name):
+        path = os.path.join(self.folder, f"{name}.csv")
+        temp_path = os.path.join(self.folder, f"{name}_temp.csv")
+        with open(temp_path, "w", newline='') as f:
+            writer = csv.writer(f)
+            for ip, frequency in self.profile_ips(name, frequency = True):
+                writer.writerow([ip] if frequency is None else [ip, frequency])
+        os.replace(temp_path, path)
+        self.db.execute("UPDATE profiles SET csv_mtime = ? WHERE name = ?", (os.stat(path).st_mtime_ns, name))
+
+    def sync(self):
+        '''
+        Imports profile csv files that were added or changed outside the store and drops
+        profiles whose csv was deleted
+        '''
+        csv_mtimes = {}
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".csv") and not entry.name.endswith("_temp.csv"):
+                csv_mtimes[entry.name[:-4]] = entry.stat().st_mtime_ns
+        stored = dict(self.db.execute("SELECT name, csv_mtime FROM profiles"))
+        changed = [name for name, mtime in csv_mtimes.items() if stored.get(name, -1) != mtime]
+        deleted = [name for name in stored if name not in csv_mtimes]
+        if not changed and not deleted:
+            return
+        with self.transaction():
+            for name in deleted:
+                self.db.execute("DELETE FROM profiles WHERE name = ?", (name,))
+            for name in changed:
+                profile_id = self._profile_id(name, create = True)
+                with open(os.path.join(self.folder, f"{name}.csv"), newline='') as f:
+                    self._replace_rows(profile_id, list(csv.reader(f)))
+                self.db.execute("UPDATE profiles SET csv_mtime = ? WHERE id = ?", (csv_mtimes[name], profile_id))
+
+
+'''
+Function: open_profile_store
+Opens the profile store of a folder and brings it up to date with the csv files in it.
+
+Parameters:
+    folder - str, the profile folder, default "ip_profiles"
+Returns:
+    context manager yielding a ProfileStore, the connection is closed at the end of the block
+Example usage:
+    with open_profile_store() as store:
+        store.profile_ips("spotify", frequency = True)
+Notes:
+    Connections are cheap and not shared between threads, open one per operation
+'''
+@contextlib.contextmanager
+def open_profile_store(folder = "ip_profiles"):
+    os.makedirs(folder, exist_ok=True)
+    store = ProfileStore(folder)
+    try:
+        store.sync()
+        yield store
+    finally:
+        store.close()
@@ -14,7 +14,9 @@ from selenium.webdriver.common.action_chains import ActionChains
 from scapy.all import *
 from scapy.utils import RawPcapReader
 from glob import glob
-from get_traces import get_trace_ips, get_profile_ips
+from get_traces import get_trace_ips, get_profile_ips, stream_capture, TRACE_COMPRESSION
+from pcap_parser import TRACE_SUFFIXES
+from pcap_mmap import count_packets
 import chromedriver_autoinstaller
 import random
 import subprocess
@@ -74,15 +76,15 @@ def get_noisy_trace_spotify(i, possible_websites, n):
         browser.execute_script("window.open('');")
         j +=1
         browser.switch_to.window(browser.window_handles[j])
-    capture = sniff(count=3000)
 
-    
     name = f"traces/noisy_traces/without_spotify/noisy_non_spotify{i}.pcap"
     csv_name = f"csv_files/noisy_traces/without_spotify/noisy_non_spotify{i}.csv"
     if flip:
         name = f"traces/noisy_traces/with_spotify/noisy_spotify{i}.pcap"
         csv_name = f"csv_files/noisy_traces/with_spotify/noisy_spotify{i}.csv"
-    wrpcap(name, capture)
+    name += TRACE_SUFFIXES[TRACE_COMPRESSION]     # tshark reads compressed pcaps as well
+    # dns/mdns/arp/ssdp are filtered in the kernel (see get_traces.stream_capture)
+    stream_capture(name, count=3000)
     try:
         with open(csv_name,'w') as f:
             subprocess.run(f"tshark -r {name} -T fields\
@@ -116,10 +118,10 @@ def sniff_google_search(num_traces):
         browser.quit()
         
         #record capture results
-        wrpcap(f"traces/{folder_id}/trace{i}.pcap", capture)
+        wrpcap(f"traces/{folder_id}/trace{i}.pcap.gz", capture, gz=True)
         try:
             with open(f'csv_files/{folder_id}/trace{i}.csv','w') as f:
-                subprocess.run(f"tshark -r traces/{folder_id}/trace{i}.pcap \
+                subprocess.run(f"tshark -r traces/{folder_id}/trace{i}.pcap.gz \
                 -T fields -e frame.number -e ip.src -e ip.dst \
                 -E header=y -E separator=/t".split(), stdout =f)
         except Exception as e:
@@ -166,10 +168,10 @@ def sniff_spotify_song_play(num_traces):
         browser.quit()
 
         #record capture results
-        wrpcap(f"traces/{folder_id}/trace{i}.pcap", capture)
+        wrpcap(f"traces/{folder_id}/trace{i}.pcap.gz", capture, gz=True)
         try:
             with open(f'csv_files/{folder_id}/trace{i}.csv','w') as f:
-                subprocess.run(f"tshark -r traces/{folder_id}/trace{i}.pcap \
+                subprocess.run(f"tshark -r traces/{folder_id}/trace{i}.pcap.gz \
                 -T fields -e frame.number -e ip.src -e ip.dst \
                 -E header=y -E separator=/t".split(), stdout =f)
         except Exception as e:
@@ -276,10 +278,8 @@ def analyze(filename):
         print('"{}" does not exist'.format(filename), file=sys.stderr)
         sys.exit(-1)
     
-    #Open pcap file and count packets
-    count = 0
-    for (pkt_data, pkt_metadata,) in RawPcapReader(filename):
-        count += 1
+    #Count packets from the record headers (pcap) or the packet blocks (pcapng)
+    count = count_packets(filename)
 
     print('{} contains {} packets'.format(filename, count))
 
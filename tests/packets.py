@@ -0,0 +1,60 @@
+'''
+Builders for the synthetic frames and capture files used by the parser tests.
+'''
+
+import socket
+import struct
+
+
+def ipv4(src, dst, proto = 6, payload = b""):
+    header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(payload), 0, 0, 64, proto, 0,
+                         socket.inet_aton(src), socket.inet_aton(dst))
+    return header + payload
+
+
+def ipv6(src, dst, next_header = 6, payload = b""):
+    header = struct.pack("!IHBB16s16s", 6 << 28, len(payload), next_header, 64,
+                         socket.inet_pton(socket.AF_INET6, src), socket.inet_pton(socket.AF_INET6, dst))
+    return header + payload
+
+
+def tcp(sport, dport):
+    return struct.pack("!HHIIBBHHH", sport, dport, 0, 0, 0x50, 0, 0, 0, 0)
+
+
+def udp(sport, dport):
+    return struct.pack("!HHHH", sport, dport, 8, 0)
+
+
+def ethernet(ip_packet, vlans = ()):
+    # vlans - list of tag ethertypes (0x8100, 0x88A8) from the outermost in
+    ethertype = 0x86DD if ip_packet[0] >> 4 == 6 else 0x0800
+    frame = b"\x02" * 6 + b"\x04" * 6
+    for i, tag in enumerate(vlans):
+        frame += struct.pack("!HH", tag, 100 + i)
+    return frame + struct.pack("!H", ethertype) + ip_packet
+
+
+def pcapng_block(block_type, body):
+    body += b"\0" * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack("<II", block_type, length) + body + struct.pack("<I", length)
+
+
+def pcapng_section():
+    return pcapng_block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1))
+
+
+def pcapng_interface(linktype, tsresol = None, tsoffset = None, snaplen = 0):
+    options = b""
+    if tsresol is not None:
+        options += struct.pack("<HH", 9, 1) + bytes([tsresol]) + b"\0\0\0"
+    if tsoffset is not None:
+        options += struct.pack("<HHq", 14, 8, tsoffset)
+    if options:
+        options += struct.pack("<HH", 0, 0)
+    return pcapng_block(1, struct.pack("<HHI", linktype, 0, snaplen) + options)
+
+
+def pcapng_packet(interface, ticks, data):
+    return pcapng_block(6, struct.pack("<IIIII", interface, ticks >> 32, ticks & 0xFFFFFFFF, len(data), len(data)) + data)
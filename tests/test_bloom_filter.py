@@ -0,0 +1,42 @@
+from bloom_filter import BloomFilter
+
+
+def addresses(count, prefix = "10"):
+    return [f"{prefix}.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(count)]
+
+
+def test_no_false_negatives_and_few_false_positives():
+    items = addresses(5000)
+    bloom = BloomFilter.from_items(items, error_rate = 0.01)
+    assert bloom.filter(items) == items
+    others = addresses(20000, prefix = "172")
+    assert len(bloom.filter(others)) < len(others) * 0.03
+
+
+def test_filter_keeps_the_order():
+    bloom = BloomFilter.from_items(["10.0.0.3", "10.0.0.1", "10.0.0.2"])
+    assert bloom.filter(["10.0.0.2", "192.168.1.1", "10.0.0.1", "10.0.0.3"]) == ["10.0.0.2", "10.0.0.1", "10.0.0.3"]
+    assert "10.0.0.1" in bloom
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "prefilter.bloom")
+    items = addresses(1000)
+    bloom = BloomFilter.from_items(items, tag = b"store-1")
+    bloom.save(path)
+    loaded = BloomFilter.load(path)
+    assert (loaded.bits, loaded.hashes, loaded.tag) == (bloom.bits, bloom.hashes, b"store-1".ljust(16, b"\0"))
+    assert loaded.data == bloom.data
+    probe = items + addresses(1000, prefix = "172")
+    assert loaded.filter(probe) == bloom.filter(probe)
+    assert [p.name for p in tmp_path.iterdir()] == ["prefilter.bloom"]
+
+
+def test_load_rejects_missing_and_foreign_files(tmp_path):
+    assert BloomFilter.load(str(tmp_path / "missing.bloom")) is None
+    path = tmp_path / "other.bloom"
+    path.write_bytes(b"not a bloom filter at all, just some bytes")
+    assert BloomFilter.load(str(path)) is None
+    BloomFilter.from_items(addresses(10)).save(str(path))
+    path.write_bytes(path.read_bytes()[:-1])
+    assert BloomFilter.load(str(path)) is None
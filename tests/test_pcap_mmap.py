@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from packets import ethernet, ipv4, ipv6, tcp, udp
+from pcap_mmap import MappedPcap, count_packets
+from pcap_parser import LINKTYPE_RAW, PcapFileWriter, PcapFormatError, count_trace_ips, iter_packets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_TRACES = [os.path.join(ROOT, "traces", "test1.pcap"), os.path.join(ROOT, "traces", "google", "google_trace1.pcap")]
+
+
+@pytest.mark.parametrize("trace", BUNDLED_TRACES)
+@pytest.mark.parametrize("exclude_noise", [True, False])
+def test_mapped_counts_match_the_parser(trace, exclude_noise):
+    with MappedPcap(trace) as pcap:
+        assert pcap.count_ips(exclude_noise) == count_trace_ips(trace, exclude_noise)
+
+
+@pytest.mark.parametrize("trace", BUNDLED_TRACES)
+def test_mapped_records_match_the_parser(trace):
+    packets = list(iter_packets(trace))
+    with MappedPcap(trace) as pcap:
+        assert len(pcap) == count_packets(trace) == len(packets)
+        assert list(pcap.timestamps()) == [ts for _, ts, _, _ in packets]
+        assert list(pcap.wirelens()) == [length for _, _, _, length in packets]
+        assert pcap.packet(7) == packets[7][2]
+
+
+def frames():
+    later_fragment = bytes([17, 0, 0, 8 << 3]) + b"\0" * 4
+    options = bytes([17, 0]) + b"\0" * 6
+    return [
+        ethernet(ipv4("10.0.0.1", "10.0.0.2", 6, tcp(443, 50000))),
+        ethernet(ipv4("10.0.0.1", "10.0.0.3", 17, udp(50000, 443)), vlans = [0x8100]),
+        ethernet(ipv4("10.0.0.1", "10.0.0.53", 17, udp(50000, 53)), vlans = [0x88A8, 0x8100]),
+        ethernet(ipv6("2001:db8::1", "2001:db8::2", 6, tcp(443, 50000))),
+        ethernet(ipv6("2001:db8::1", "2001:db8::53", 0, options + udp(40000, 5353))),
+        ethernet(ipv6("2001:db8::1", "2001:db8::3", 44, later_fragment + udp(40000, 53))),
+        ethernet(ipv4("10.0.0.4", "239.255.255.250", 17, udp(40000, 1900))),
+        b"\x02" * 12 + b"\x08\x06" + b"\0" * 28,
+    ]
+
+
+@pytest.mark.parametrize("exclude_noise", [True, False])
+def test_vlan_and_ipv6_extension_headers_match_the_parser(tmp_path, exclude_noise):
+    path = str(tmp_path / "mixed.pcap")
+    with PcapFileWriter(path) as writer:
+        for i, frame in enumerate(frames()):
+            writer.write(frame, 1700000000 + i)
+    expected = count_trace_ips(path, exclude_noise)
+    with MappedPcap(path) as pcap:
+        assert pcap.count_ips(exclude_noise) == expected
+    assert ("2001:db8::53" in expected) is not exclude_noise
+    # a later fragment has no ports, so it is kept even though it belongs to a dns packet
+    assert "2001:db8::3" in expected
+
+
+def test_raw_ip_link_type(tmp_path):
+    path = str(tmp_path / "raw.pcap")
+    with PcapFileWriter(path, LINKTYPE_RAW) as writer:
+        writer.write(ipv4("10.0.0.1", "10.0.0.2", 6, tcp(443, 50000)), 1700000000)
+        writer.write(ipv6("2001:db8::1", "2001:db8::2", 17, udp(53, 40000)), 1700000001)
+    with MappedPcap(path) as pcap:
+        assert pcap.count_ips() == count_trace_ips(path) == {"10.0.0.1": 1, "10.0.0.2": 1}
+
+
+def test_rejects_files_it_cannot_map(tmp_path):
+    empty = tmp_path / "empty.pcap"
+    empty.write_bytes(b"")
+    with pytest.raises(PcapFormatError):
+        MappedPcap(str(empty))
+    pcapng = tmp_path / "trace.pcapng"
+    pcapng.write_bytes(b"\x0a\x0d\x0d\x0a" + b"\0" * 24)
+    with pytest.raises(PcapFormatError):
+        MappedPcap(str(pcapng))
@@ -0,0 +1,119 @@
+import gzip
+import os
+import shutil
+import socket
+
+import pytest
+
+from packets import (ethernet, ipv4, ipv6, pcapng_interface, pcapng_packet, pcapng_section, tcp, udp)
+from pcap_parser import (LINKTYPE_ETHERNET, LINKTYPE_RAW, PcapFileWriter, PcapFormatError, compress_trace,
+                         count_trace_ips, iter_packets, parse_packet)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_TRACES = [os.path.join(ROOT, "traces", "test1.pcap"), os.path.join(ROOT, "traces", "google", "google_trace1.pcap")]
+
+
+def packed(ip):
+    return socket.inet_pton(socket.AF_INET6 if ":" in ip else socket.AF_INET, ip)
+
+
+@pytest.mark.parametrize("trace", BUNDLED_TRACES)
+def test_bundled_trace_counts(trace):
+    packets = list(iter_packets(trace))
+    assert len(packets) == 500
+    assert all(linktype == LINKTYPE_ETHERNET for linktype, _, _, _ in packets)
+    counts = count_trace_ips(trace)
+    everything = count_trace_ips(trace, exclude_noise = False)
+    assert counts and all(everything[ip] >= n for ip, n in counts.items())
+    assert sum(everything.values()) > sum(counts.values())
+    for ip in counts:
+        packed(ip)
+
+
+def test_writer_round_trip(tmp_path):
+    path = str(tmp_path / "out.pcap")
+    frames = [ethernet(ipv4("10.0.0.1", "10.0.0.2", 6, tcp(443, 50000))),
+              ethernet(ipv6("2001:db8::1", "2001:db8::2", 17, udp(5000, 443)))]
+    with PcapFileWriter(path, snaplen = 60) as writer:
+        writer.write(frames[0], 1700000000.25)
+        writer.write(frames[1], 1700000001.5)
+    packets = list(iter_packets(path))
+    assert [ts for _, ts, _, _ in packets] == [1700000000.25, 1700000001.5]
+    assert [data for _, _, data, _ in packets] == [frames[0], frames[1][:60]]
+    assert [length for _, _, _, length in packets] == [len(frames[0]), len(frames[1])]
+    assert count_trace_ips(path) == {"10.0.0.1": 1, "10.0.0.2": 1, "2001:db8::1": 1, "2001:db8::2": 1}
+
+
+def test_vlan_tags():
+    frame = ethernet(ipv4("10.0.0.1", "10.0.0.2", 17, udp(1234, 443)), vlans = [0x88A8, 0x8100])
+    assert parse_packet(LINKTYPE_ETHERNET, frame) == (packed("10.0.0.1"), packed("10.0.0.2"), 17, 1234, 443)
+
+
+def test_ipv6_extension_headers():
+    # hop-by-hop and destination options (8 bytes each) before a dns query
+    options = bytes([60, 0]) + b"\0" * 6 + bytes([17, 0]) + b"\0" * 6
+    frame = ethernet(ipv6("2001:db8::1", "2001:db8::53", 0, options + udp(40000, 53)))
+    assert parse_packet(LINKTYPE_ETHERNET, frame) == (packed("2001:db8::1"), packed("2001:db8::53"), 17, 40000, 53)
+
+
+def test_ipv6_later_fragment_has_no_ports():
+    fragment = bytes([6, 0, 0, 8 << 3]) + b"\0" * 4
+    frame = ethernet(ipv6("2001:db8::1", "2001:db8::2", 44, fragment + tcp(53, 53)))
+    assert parse_packet(LINKTYPE_ETHERNET, frame) == (packed("2001:db8::1"), packed("2001:db8::2"), 6, None, None)
+
+
+def test_pcapng_interface_timestamp_settings(tmp_path):
+    path = tmp_path / "two_interfaces.pcapng"
+    first = ethernet(ipv4("10.0.0.1", "10.0.0.2", 6, tcp(443, 50000)))
+    second = ipv4("10.0.0.3", "10.0.0.4", 6, tcp(443, 50001))
+    path.write_bytes(pcapng_section()
+                     + pcapng_interface(LINKTYPE_ETHERNET, tsresol = 9, tsoffset = 1700000000)
+                     + pcapng_interface(LINKTYPE_RAW, tsresol = 0x80 | 10)
+                     + pcapng_packet(0, 1_500_000_000, first)
+                     + pcapng_packet(1, 1700000002 * 1024 + 256, second))
+    packets = list(iter_packets(str(path)))
+    assert [(linktype, ts) for linktype, ts, _, _ in packets] == [(LINKTYPE_ETHERNET, 1700000001.5),
+                                                                  (LINKTYPE_RAW, 1700000002.25)]
+    assert count_trace_ips(str(path)) == {"10.0.0.1": 1, "10.0.0.2": 1, "10.0.0.3": 1, "10.0.0.4": 1}
+
+
+def test_pcapng_packet_for_undeclared_interface(tmp_path):
+    path = tmp_path / "bad.pcapng"
+    path.write_bytes(pcapng_section() + pcapng_interface(LINKTYPE_ETHERNET)
+                     + pcapng_packet(1, 0, ethernet(ipv4("10.0.0.1", "10.0.0.2"))))
+    with pytest.raises(PcapFormatError):
+        list(iter_packets(str(path)))
+
+
+def test_gzip_trace_reads_like_the_original(tmp_path):
+    path = str(tmp_path / "test1.pcap")
+    shutil.copy(BUNDLED_TRACES[0], path)
+    expected = count_trace_ips(path)
+    compressed = compress_trace(path)
+    assert compressed == path + ".gz" and not os.path.exists(path)
+    assert count_trace_ips(compressed) == expected
+
+
+def test_truncated_gzip_trace_reads_up_to_the_cut(tmp_path):
+    with open(BUNDLED_TRACES[0], "rb") as f:
+        data = gzip.compress(f.read())
+    path = tmp_path / "cut.pcap.gz"
+    path.write_bytes(data[:len(data) // 2])
+    packets = list(iter_packets(str(path)))
+    assert 0 < len(packets) < 500
+    original = list(iter_packets(BUNDLED_TRACES[0]))[:len(packets)]
+    assert packets == original
+
+
+def test_corrupt_gzip_trace(tmp_path):
+    path = tmp_path / "corrupt.pcap.gz"
+    path.write_bytes(b"\x1f\x8b" + b"\xff" * 64)
+    with pytest.raises(PcapFormatError):
+        count_trace_ips(str(path))
+
+
+def test_not_a_trace(tmp_path):
+    path = tmp_path / "notes.pcap"
+    path.write_bytes(b"hello world, not a capture")
+    with pytest.raises(PcapFormatError):
+        count_trace_ips(str(path))
@@ -0,0 +1,63 @@
+import os
+
+from prefix_trie import PrefixFilter, PrefixTrie, load_prefix_filter, pack_ip
+
+
+def test_zero_length_prefix_covers_its_family_only():
+    prefix_filter = PrefixFilter(["0.0.0.0/0"])
+    assert "1.2.3.4" in prefix_filter and "255.255.255.255" in prefix_filter
+    assert "2001:db8::1" not in prefix_filter
+    prefix_filter.add("::/0")
+    assert "2001:db8::1" in prefix_filter
+
+
+def test_prefix_longer_than_the_address_is_rejected():
+    prefix_filter = PrefixFilter()
+    assert prefix_filter.add("10.0.0.1/33") is False
+    assert prefix_filter.add("2001:db8::1/129") is False
+    assert prefix_filter.add("10.0.0.1/-1") is False
+    assert prefix_filter.add("10.0.0.1/x") is False
+    assert prefix_filter.add("not an address") is False
+    assert len(prefix_filter.v4) == len(prefix_filter.v6) == 0
+    assert "10.0.0.1" not in prefix_filter
+
+
+def test_full_length_prefixes():
+    prefix_filter = PrefixFilter(["10.0.0.1/32", "2001:db8::1/128"])
+    assert "10.0.0.1" in prefix_filter and "10.0.0.2" not in prefix_filter
+    assert "2001:db8::1" in prefix_filter and "2001:db8::2" not in prefix_filter
+
+
+def test_prefixes_off_byte_boundaries():
+    prefix_filter = PrefixFilter(["151.101.16.0/20", "2606:4700::/31"])
+    assert "151.101.31.255" in prefix_filter
+    assert "151.101.32.0" not in prefix_filter and "151.101.15.255" not in prefix_filter
+    assert "2606:4701:ffff::1" in prefix_filter and "2606:4702::1" not in prefix_filter
+
+
+def test_default_prefix_lengths_for_plain_addresses():
+    prefix_filter = PrefixFilter(["10.1.2.3", "2001:db8:1:2::5"], v4_prefix = 24, v6_prefix = 64)
+    assert "10.1.2.200" in prefix_filter and "10.1.3.1" not in prefix_filter
+    assert "2001:db8:1:2:ffff::1" in prefix_filter and "2001:db8:1:3::1" not in prefix_filter
+
+
+def test_longest_prefix_wins():
+    trie = PrefixTrie()
+    trie.insert(pack_ip("10.0.0.0"), 8)
+    trie.insert(pack_ip("10.1.0.0"), 16)
+    trie.insert(pack_ip("10.1.2.0"), 23)
+    assert trie.longest_prefix(pack_ip("10.1.3.4")) == 23
+    assert trie.longest_prefix(pack_ip("10.1.4.4")) == 16
+    assert trie.longest_prefix(pack_ip("10.2.0.1")) == 8
+    assert trie.longest_prefix(pack_ip("11.0.0.1")) is None
+
+
+def test_load_prefix_filter_reloads_a_changed_file(tmp_path):
+    path = tmp_path / "background.csv"
+    path.write_text("10.0.0.1\n")
+    assert "10.0.0.1" in load_prefix_filter(str(path))
+    path.write_text("10.0.0.2\n")
+    stat = path.stat()
+    os.utime(path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    reloaded = load_prefix_filter(str(path))
+    assert "10.0.0.2" in reloaded and "10.0.0.1" not in reloaded
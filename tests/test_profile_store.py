@@ -0,0 +1,127 @@
+import os
+import shutil
+
+import pytest
+
+from bloom_filter import BloomFilter
+from profile_store import MATCH_QUERY, PREFILTER_FILE, _prefilters, open_profile_store
+
+
+def write_profile(folder, name, rows):
+    with open(folder / f"{name}.csv", "w") as f:
+        for row in rows:
+            f.write(",".join(row) + "\n")
+
+
+@pytest.fixture
+def profiles(tmp_path):
+    folder = tmp_path / "ip_profiles"
+    folder.mkdir()
+    for site in range(20):
+        write_profile(folder, f"site{site}", [[f"10.0.{site}.{i}", "0.5"] for i in range(200)] + [["1.1.1.1", "1.0"]])
+    write_profile(folder, "background", [["8.8.8.8"]])
+    return str(folder)
+
+
+def test_match_returns_profile_rows_in_trace_order(profiles):
+    with open_profile_store(profiles) as store:
+        matches = store.match(["10.0.3.7", "9.9.9.9", "1.1.1.1", "10.0.3.1"], ["site3", "site4"])
+    assert matches["site3"] == [["10.0.3.7", "0.5"], ["1.1.1.1", "1.0"], ["10.0.3.1", "0.5"]]
+    assert matches["site4"] == [["1.1.1.1", "1.0"]]
+
+
+def test_match_with_prefilter_is_the_same(profiles):
+    trace_ips = [f"10.0.{site}.{i}" for site in range(0, 30, 3) for i in range(0, 250, 7)]
+    with open_profile_store(profiles) as store:
+        assert store.match(trace_ips, prefilter = True) == store.match(trace_ips)
+
+
+def test_match_query_starts_from_the_trace_addresses(profiles):
+    with open_profile_store(profiles) as store:
+        store.db.execute("BEGIN")
+        store._load_temp_ips(["10.0.3.7", "1.1.1.1"])
+        plan = [row[3] for row in store.db.execute("EXPLAIN QUERY PLAN " + MATCH_QUERY)]
+        store.db.execute("COMMIT")
+    scans = [step for step in plan if step.startswith("SCAN")]
+    assert scans == ["SCAN q"], plan
+    assert any(step.startswith("SEARCH profile_ips USING INDEX profile_ips_by_ip") for step in plan), plan
+    assert any(step.startswith("SEARCH ips") for step in plan), plan
+
+
+def match_steps(folder, trace_ips):
+    # SQLite virtual machine steps spent in one match, a proxy for rows read
+    steps = [0]
+
+    def count():
+        steps[0] += 1
+        return 0
+
+    with open_profile_store(folder) as store:
+        store.match(trace_ips, ["site1", "site2"])
+        store.db.set_progress_handler(count, 1)
+        store.match(trace_ips, ["site1", "site2"])
+    return steps[0]
+
+
+def test_match_work_does_not_grow_with_the_number_of_profiles(tmp_path):
+    # one lookup per trace address regardless of how many profiles exist (was profile_index.py)
+    steps = {}
+    for count in (5, 50):
+        folder = tmp_path / f"profiles{count}"
+        folder.mkdir()
+        for site in range(count):
+            write_profile(folder, f"site{site}", [[f"10.{site}.{i // 250}.{i % 250}", "0.5"] for i in range(500)])
+        steps[count] = match_steps(str(folder), ["10.1.0.1", "10.2.1.3", "172.16.0.1"])
+    assert steps[50] < steps[5] * 2, steps
+
+
+def test_register_profile_removes_duplicates_from_both_profiles(tmp_path):
+    folder = tmp_path / "ip_profiles"
+    folder.mkdir()
+    write_profile(folder, "a", [["10.0.0.1", "1.0"], ["10.0.0.2", "0.5"], ["10.0.0.3", "0.5"]])
+    write_profile(folder, "b", [["10.0.0.3", "1.0"], ["10.0.0.4", "1.0"]])
+    write_profile(folder, "c", [["10.0.0.4", "0.5"], ["10.0.0.5", "0.5"]])
+    with open_profile_store(str(folder)) as store:
+        assert store.register_profile("a") == {}
+        assert store.register_profile("b") == {"a": 1, "b": 1}
+        assert store.register_profile("c") == {"b": 1, "c": 1}
+        assert store.register_profile("a") == {}
+        assert store.register_profile("missing") == {}
+        assert store.duplicate_ips() == ["10.0.0.3", "10.0.0.4"]
+        assert store.registered_profiles() == ["a", "b", "c"]
+        assert store.profile_ips("a") == ["10.0.0.1", "10.0.0.2"]
+        assert store.profile_ips("b") == []
+        assert store.profile_ips("c", frequency = True) == [["10.0.0.5", "0.5"]]
+    assert (folder / "a.csv").read_text().split() == ["10.0.0.1,1.0", "10.0.0.2,0.5"]
+
+
+def test_prefilter_is_rebuilt_when_a_profile_changes(profiles):
+    with open_profile_store(profiles) as store:
+        bloom = store.prefilter()
+        assert "10.0.3.7" in bloom
+        store.replace_profile("site3", [["10.0.3.7", "0.5"], ["192.168.7.7", "1.0"]])
+        rebuilt = store.prefilter()
+    assert rebuilt.tag != bloom.tag
+    assert "192.168.7.7" in rebuilt
+
+
+def test_saved_prefilter_is_reused_only_for_its_own_store(profiles, tmp_path):
+    with open_profile_store(profiles) as store:
+        bloom = store.prefilter()
+    path = os.path.join(profiles, PREFILTER_FILE)
+    _prefilters.clear()
+    with open_profile_store(profiles) as store:
+        assert store.prefilter().tag == bloom.tag
+    assert BloomFilter.load(path).tag == bloom.tag
+
+    # a filter copied in from another store has the wrong tag and is rebuilt
+    other = tmp_path / "other_profiles"
+    other.mkdir()
+    write_profile(other, "site", [["172.16.0.1", "1.0"]])
+    shutil.copy(path, other / PREFILTER_FILE)
+    _prefilters.clear()
+    with open_profile_store(str(other)) as store:
+        rebuilt = store.prefilter()
+    assert rebuilt.tag != bloom.tag
+    assert "172.16.0.1" in rebuilt
+    assert BloomFilter.load(str(other / PREFILTER_FILE)).tag == rebuilt.tag
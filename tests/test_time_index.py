@@ -0,0 +1,64 @@
+import os
+
+from packets import ethernet, ipv4, tcp
+from pcap_parser import PcapFileWriter, count_trace_ips
+from time_index import TimeIndex, activity_intervals, activity_timeline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACE = os.path.join(ROOT, "traces", "test1.pcap")
+
+
+def write_trace(path, packets):
+    # packets - list of (timestamp, src, dst)
+    with PcapFileWriter(path) as writer:
+        for timestamp, src, dst in packets:
+            writer.write(ethernet(ipv4(src, dst, 6, tcp(443, 50000))), timestamp)
+    return path
+
+
+def test_index_counts_match_the_parser():
+    index = TimeIndex()
+    assert count_trace_ips(TRACE, time_index = index) == count_trace_ips(TRACE)
+    assert index.ip_counts() == count_trace_ips(TRACE)
+    start, end = index.span()
+    assert index.window_ips(start, end) == index.ip_counts()
+    assert index.window_ips(end, None) == {}
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = TimeIndex(2.0)
+    count_trace_ips(TRACE, time_index = index)
+    path = str(tmp_path / "index.json")
+    index.save(path)
+    loaded = TimeIndex.load(path)
+    assert (loaded.width, loaded.hits, loaded.untimed) == (index.width, index.hits, index.untimed)
+    assert loaded.span() == index.span()
+
+
+def test_untimed_packets_are_counted_but_not_placed(tmp_path):
+    trace = write_trace(str(tmp_path / "clock.pcap"), [(0.0, "10.0.0.1", "10.0.0.2"),
+                                                       (1700000000.5, "10.0.0.1", "10.0.0.3"),
+                                                       (1700000005.5, "10.0.0.1", "10.0.0.3")])
+    index = TimeIndex()
+    counts = count_trace_ips(trace, time_index = index)
+    assert counts == {"10.0.0.1": 3, "10.0.0.2": 1, "10.0.0.3": 2}
+    assert index.untimed == {"10.0.0.1": 1, "10.0.0.2": 1}
+    assert index.span() == (1700000000.0, 1700000006.0)
+    assert index.window_ips(1700000000, 1700000001) == {"10.0.0.1": 1, "10.0.0.3": 1}
+
+    path = str(tmp_path / "clock.json")
+    index.save(path)
+    loaded = TimeIndex.load(path)
+    assert loaded.ip_counts() == counts and loaded.span() == index.span()
+
+
+def test_activity_intervals(tmp_path):
+    packets = [(1700000000.0 + second, "10.0.0.1", "10.0.0.9") for second in range(0, 30)]
+    packets += [(1700000100.0 + second, "10.0.0.2", "10.0.0.9") for second in range(0, 10)]
+    index = TimeIndex()
+    count_trace_ips(write_trace(str(tmp_path / "active.pcap"), packets), time_index = index)
+    matches = [["10.0.0.1", "0.9"], ["10.0.0.2", "0.2"]]
+    timeline = activity_timeline(index, matches, window = 10)
+    assert [confidence for _, _, confidence, _ in timeline] == [0.9, 0.9, 0.9, 0.2]
+    assert activity_intervals(index, matches, window = 10) == [(1700000000.0, 1700000030.0, 0.9, 1)]
+    assert activity_intervals(index, matches, window = 10, start = 1700000050) == []
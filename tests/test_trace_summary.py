@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+from packets import ethernet, ipv4, ipv6, tcp, udp
+from pcap_parser import PcapFileWriter, count_trace_ips
+from trace_summary import (SUMMARY_COLUMNS, load_trace_summary, save_trace_summary, summarize_trace,
+                           summary_trace_ips, write_trace_summary)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_TRACES = [os.path.join(ROOT, "traces", "test1.pcap"), os.path.join(ROOT, "traces", "google", "google_trace1.pcap")]
+
+
+@pytest.mark.parametrize("trace", BUNDLED_TRACES)
+@pytest.mark.parametrize("exclude_noise", [True, False])
+def test_summary_counts_match_the_parser(trace, exclude_noise):
+    summary = summarize_trace(trace, exclude_noise)
+    assert summary_trace_ips(summary) == count_trace_ips(trace, exclude_noise)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    trace = str(tmp_path / "mixed.pcap")
+    with PcapFileWriter(trace) as writer:
+        writer.write(ethernet(ipv4("10.0.0.1", "10.0.0.2", 6, tcp(443, 50000))), 1700000000.5)
+        writer.write(ethernet(ipv6("2001:db8::1", "2001:db8::2", 17, udp(5000, 443))), 1700000001.0)
+        writer.write(ethernet(ipv4("10.0.0.1", "10.0.0.53", 17, udp(40000, 53))), 1700000002.0)
+        writer.write(ethernet(ipv4("10.0.0.2", "10.0.0.1", 1)), 1700000003.0)
+    path = str(tmp_path / "mixed.npz")
+    summary = write_trace_summary(trace, path)
+    assert list(summary["family"]) == [4, 6, 4]
+    assert list(summary["sport"]) == [443, 5000, 0]
+
+    loaded = load_trace_summary(path)
+    assert sorted(loaded) == sorted(SUMMARY_COLUMNS)
+    for column in SUMMARY_COLUMNS:
+        assert loaded[column].dtype == summary[column].dtype
+        np.testing.assert_array_equal(loaded[column], summary[column])
+    assert isinstance(loaded["ts"], np.memmap)
+    assert summary_trace_ips(loaded) == count_trace_ips(trace)
+
+
+def test_empty_and_compressed_summaries(tmp_path):
+    trace = str(tmp_path / "empty.pcap")
+    PcapFileWriter(trace).close()
+    path = str(tmp_path / "empty.npz")
+    save_trace_summary(summarize_trace(trace), path)
+    loaded = load_trace_summary(path)
+    assert all(len(loaded[column]) == 0 for column in SUMMARY_COLUMNS)
+    assert summary_trace_ips(loaded) == {}
+
+    summary = summarize_trace(BUNDLED_TRACES[0])
+    path = str(tmp_path / "compressed.npz")
+    np.savez_compressed(path, **summary)
+    assert summary_trace_ips(load_trace_summary(path)) == summary_trace_ips(summary)
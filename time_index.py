@@ -0,0 +1,207 @@
+'''
+Per-address time-bucket index of a trace, used to find when a profiled website was active.
+
+The index is filled in the same pass that counts a trace's addresses (pcap_parser.count_trace_ips).
+For every address it keeps the number of packets seen in each bucket of `width` seconds. That is
+enough to count the addresses of any time window, so a window can be matched against the
+profiles again without reading the pcap (the index is cached with the trace, see trace_cache.py).
+
+Confidence over time: for each report window, every profile address seen in the window counts
+as evidence with the weight of its profile frequency (the share of profiling traces it showed up
+in), combined as 1 - prod(1 - frequency). One address seen in every profiling trace gives 1.0,
+a few rarely seen addresses give a low score. Windows at or above a threshold are merged into
+activity intervals.
+
+Packets without a usable timestamp (pcapng Simple Packet Blocks are read at 0.0, zeroed or unset
+capture clocks) are counted but put in no bucket, they can't be placed in time and would stretch
+the trace back to 1970.
+
+Example usage:
+    index = TimeIndex()
+    trace_ips = count_trace_ips("traces/test1.pcap", time_index = index)
+    index.window_ips(start, start + 60)
+    activity_intervals(index, matches["spotify"])
+'''
+
+import json
+import time
+
+from pcap_parser import ip_to_str
+
+# timestamps before 2000-01-01 come from a missing or unset clock, not a real capture
+UNTIMED_BEFORE = 946684800
+
+
+class TimeIndex:
+    '''
+    width - float, seconds per bucket, default 1
+    hits - {ip: {bucket number: packets}}, bucket number is int(timestamp // width)
+    untimed - {ip: packets} without a usable timestamp, every one of these ips is also in hits
+    '''
+
+    untimed_before = UNTIMED_BEFORE
+
+    def __init__(self, width = 1.0, hits = None, untimed = None):
+        self.width = width
+        self.hits = {} if hits is None else hits
+        self.untimed = {} if untimed is None else untimed
+
+    def add(self, ip, timestamp):
+        buckets = self.hits.get(ip)
+        if buckets is None:
+            buckets = self.hits[ip] = {}
+        if timestamp < self.untimed_before:
+            self.untimed[ip] = self.untimed.get(ip, 0) + 1
+            return
+        bucket = int(timestamp // self.width)
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    def finish(self):
+        '''
+        Converts the packed addresses used while filling the index to strings, called by count_trace_ips
+        '''
+        self.hits = {ip if isinstance(ip, str) else ip_to_str(ip): buckets for ip, buckets in self.hits.items()}
+        self.untimed = {ip if isinstance(ip, str) else ip_to_str(ip): n for ip, n in self.untimed.items()}
+        return self
+
+    def span(self):
+        '''
+        Returns (start, end) of the trace in seconds since the epoch, (None, None) if no packet had a timestamp
+        '''
+        buckets = [bucket for per_ip in self.hits.values() for bucket in per_ip]
+        if not buckets:
+            return None, None
+        return min(buckets) * self.width, (max(buckets) + 1) * self.width
+
+    def ip_counts(self):
+        '''
+        Returns {ip: packets} for the whole trace, same as count_trace_ips
+        '''
+        untimed = self.untimed
+        return {ip: sum(buckets.values()) + untimed.get(ip, 0) for ip, buckets in self.hits.items()}
+
+    def window_ips(self, start = None, end = None):
+        '''
+        Returns {ip: packets} for the buckets that start in [start, end), None means no limit
+        packets without a timestamp are only counted when there is no limit at all
+        '''
+        if start is None and end is None:
+            return self.ip_counts()
+        first = float("-inf") if start is None else start / self.width
+        last = float("inf") if end is None else end / self.width
+        counts = {}
+        for ip, buckets in self.hits.items():
+            total = sum(n for bucket, n in buckets.items() if first <= bucket < last)
+            if total:
+                counts[ip] = total
+        return counts
+
+    def to_dict(self):
+        return {"width": self.width, "untimed": self.untimed,
+                "hits": {ip: [[bucket, n] for bucket, n in buckets.items()] for ip, buckets in self.hits.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        hits = {ip: {bucket: n for bucket, n in buckets} for ip, buckets in data["hits"].items()}
+        return cls(data["width"], hits, data["untimed"])
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+'''
+Function: activity_timeline
+Scores how likely a profile is active in every window of a trace.
+
+Parameters:
+    index - TimeIndex of the trace
+    matches - list of [ip, frequency] pairs, the profile addresses found in the trace
+    window - float, seconds per window, rounded to whole buckets, default 10
+    start, end - float, only score this part of the trace, default all of it
+Returns:
+    list of (window start, window end, confidence, number of profile addresses seen), in time order,
+    one per window with at least one profile address (every other window has confidence 0)
+'''
+def activity_timeline(index, matches, window = 10, start = None, end = None):
+    trace_start, trace_end = index.span()
+    if trace_start is None:
+        return []
+    start = trace_start if start is None else max(start, trace_start)
+    end = trace_end if end is None else min(end, trace_end)
+    per_window = max(1, round(window / index.width))
+    first_bucket = int(start // index.width)
+
+    evidence = {}       # window number -> {ip: frequency}
+    for ip, frequency in matches:
+        for bucket in index.hits.get(ip, ()):
+            if start <= bucket * index.width < end:
+                evidence.setdefault((bucket - first_bucket) // per_window, {})[ip] = float(frequency)
+
+    timeline = []
+    for number in sorted(evidence):
+        window_start = (first_bucket + number * per_window) * index.width
+        seen = evidence[number]
+        absent = 1.0
+        for frequency in seen.values():
+            absent *= 1.0 - min(frequency, 1.0)
+        window_end = min(window_start + per_window * index.width, end)
+        timeline.append((window_start, window_end, round(1.0 - absent, 4), len(seen)))
+    return timeline
+
+
+'''
+Function: activity_intervals
+Finds the time intervals a profile was active in a trace.
+
+Parameters:
+    index - TimeIndex of the trace
+    matches - list of [ip, frequency] pairs, the profile addresses found in the trace
+    window - float, seconds per scored window, default 10
+    threshold - float, minimum window confidence, default 0.5
+    gap - float, active windows at most this many seconds apart are merged, default one window
+    start, end - float, only look at this part of the trace, default all of it
+Returns:
+    list of (start, end, peak confidence, profile addresses seen) tuples, in time order
+Example usage:
+    activity_intervals(index, matches["spotify"], window = 30)
+'''
+def activity_intervals(index, matches, window = 10, threshold = 0.5, gap = None, start = None, end = None):
+    gap = window if gap is None else gap
+    intervals = []
+    for window_start, window_end, confidence, seen in activity_timeline(index, matches, window, start, end):
+        if confidence < threshold:
+            continue
+        if intervals and window_start - intervals[-1][1] <= gap:
+            interval_start, _, peak, most = intervals[-1]
+            intervals[-1] = (interval_start, window_end, max(peak, confidence), max(most, seen))
+        else:
+            intervals.append((window_start, window_end, confidence, seen))
+    return intervals
+
+
+'''
+Function: format_intervals
+Describes activity intervals for the report.
+
+Parameters:
+    website_name - str
+    intervals - list returned by activity_intervals
+Returns:
+    str, one line per interval with local clock times
+'''
+def format_intervals(website_name, intervals):
+    if not intervals:
+        return f"No time window of the trace had enough matches to place {website_name} in time"
+    lines = [f"{website_name} was active during:"]
+    for start, end, peak, seen in intervals:
+        day = time.strftime("%Y-%m-%d", time.localtime(start))
+        lines.append(f"    {day} {time.strftime('%H:%M:%S', time.localtime(start))} - "
+                     f"{time.strftime('%H:%M:%S', time.localtime(end))} ({end - start:.0f}s), "
+                     f"peak confidence {peak:.2f}, up to {seen} profile address(es) per window")
+    return "\n".join(lines)
@@ -0,0 +1,189 @@
+'''
+On-disk cache of the IP counts extracted from uploaded traces.
+
+Reports are often run again on the same upload after profiles were added or rebuilt. The
+{ip: count} dictionary of a trace is saved under trace_cache/ keyed by a hash of the file's
+contents, so running a report on a file that was seen before (under any name) skips decoding.
+
+The per-second time index of a trace (time_index.py) is cached the same way in its own entry,
+so a report on one time window of a trace that was seen before doesn't decode it either.
+
+Entries are written to a temporary file and moved into place with os.replace, so threads and
+processes sharing the cache never read a partial entry. A hit refreshes the entry's mtime and the
+oldest entries are removed once the cache is larger than MAX_CACHE_BYTES.
+
+Example usage:
+    compare_ips = cached_trace_ips("uploads/noisy.pcap")
+    index = cached_time_index("uploads/noisy.pcap")
+'''
+
+import json
+import os
+import threading
+from hashlib import blake2b
+
+import metrics
+from pcap_parser import extract_trace_ips
+from time_index import TimeIndex
+
+CACHE_DIR = "trace_cache"
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+# bumped when the saved TimeIndex format changes, older time index entries are then decoded again
+TIME_INDEX_VERSION = 2
+
+_digests = {}                   # (path, size, mtime) -> digest, so a file is hashed once per process
+_digests_lock = threading.Lock()
+
+
+'''
+Function: trace_digest
+Returns the blake2b hex digest of a file's contents
+'''
+def trace_digest(filename):
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is None:
+        hasher = blake2b(digest_size=20)
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        with _digests_lock:
+            _digests[key] = digest
+    return digest
+
+
+def _entry_path(cache_dir, digest, backend, exclude_noise, width = None):
+    index = "" if width is None else f"-t{width:g}v{TIME_INDEX_VERSION}"
+    return os.path.join(cache_dir, f"{digest}-{backend}{'' if exclude_noise else '-all'}{index}.json")
+
+
+def _load_entry(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return data
+
+
+def _save_entry(path, data, cache_dir, max_bytes):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+        evict(cache_dir, max_bytes)
+    except OSError as e:
+        print(f"Error: could not write trace cache entry {path}: {e}")
+
+
+'''
+Function: evict
+Removes the least recently used entries until the cache is at most max_bytes.
+
+Parameters:
+    cache_dir - str, default trace_cache
+    max_bytes - int, default MAX_CACHE_BYTES
+    suffix - str, extension of the cache entries, default ".json" (chart_render keeps ".jpeg" images)
+Returns:
+    number of entries removed
+Notes:
+    files with .tmp. in their name are entries still being written and are left alone
+'''
+def evict(cache_dir = CACHE_DIR, max_bytes = MAX_CACHE_BYTES, suffix = ".json"):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(suffix) and ".tmp." not in entry.name:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:       # removed by another thread
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return removed
+
+
+'''
+Function: cached_trace_ips
+Counts the IP addresses of a trace like pcap_parser.extract_trace_ips, reusing the result of
+an earlier run on a file with the same contents.
+
+Parameters:
+    filename - str, path to the trace
+    backend - str, "native" (default) or "tshark"
+    exclude_noise - bool, drop dns, mdns, arp and ssdp packets, default True
+    cache_dir - str, default trace_cache
+    max_bytes - int, size the cache is trimmed to after a new entry, default MAX_CACHE_BYTES
+Returns:
+    dictionary of {ip: count}
+Example usage:
+    cached_trace_ips("traces/test1.pcap")
+Notes:
+    errors from reading the trace are raised like extract_trace_ips does, nothing is cached for them
+'''
+def cached_trace_ips(filename, backend = "native", exclude_noise = True, cache_dir = CACHE_DIR,
+                     max_bytes = MAX_CACHE_BYTES):
+    path = _entry_path(cache_dir, trace_digest(filename), backend, exclude_noise)
+    ips = _load_entry(path)
+    if ips is not None:
+        metrics.count("trace_cache_hits")
+        return ips
+
+    metrics.count("trace_cache_misses")
+    ips = extract_trace_ips(filename, backend, exclude_noise)
+    _save_entry(path, ips, cache_dir, max_bytes)
+    return ips
+
+
+'''
+Function: cached_time_index
+Builds the time index of a trace like extract_trace_ips(..., time_index = TimeIndex(width)), reusing
+the index of an earlier run on a file with the same contents.
+
+Parameters:
+    filename - str, path to the trace
+    backend - str, "native" (default) or "tshark"
+    exclude_noise - bool, drop dns, mdns, arp and ssdp packets, default True
+    width - float, seconds per bucket, default 1
+    cache_dir - str, default trace_cache
+    max_bytes - int, size the cache is trimmed to after a new entry, default MAX_CACHE_BYTES
+Returns:
+    time_index.TimeIndex
+Example usage:
+    cached_time_index("traces/test1.pcap").window_ips(start, end)
+Notes:
+    a miss also saves the {ip: count} entry used by cached_trace_ips, it comes out of the same pass
+'''
+def cached_time_index(filename, backend = "native", exclude_noise = True, width = 1.0, cache_dir = CACHE_DIR,
+                      max_bytes = MAX_CACHE_BYTES):
+    digest = trace_digest(filename)
+    path = _entry_path(cache_dir, digest, backend, exclude_noise, width)
+    data = _load_entry(path)
+    if data is not None:
+        metrics.count("trace_cache_hits")
+        return TimeIndex.from_dict(data)
+
+    metrics.count("trace_cache_misses")
+    index = TimeIndex(width)
+    ips = extract_trace_ips(filename, backend, exclude_noise, time_index = index)
+    _save_entry(path, index.to_dict(), cache_dir, max_bytes)
+    _save_entry(_entry_path(cache_dir, digest, backend, exclude_noise), ips, cache_dir, max_bytes)
+    return index
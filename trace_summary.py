@@ -0,0 +1,165 @@
+'''
+Binary columnar trace summaries.
+
+A summary holds one row per IP packet of a trace as typed NumPy columns:
+    ts      float64, capture timestamp
+    family  uint8, 4 or 6
+    proto   uint8, IP protocol number
+    length  uint32, original packet length
+    sport, dport  uint16, tcp/udp ports (0 when there is none)
+    src4, dst4    uint32, addresses of the IPv4 rows, in row order
+    src6, dst6    (n, 2) uint64, addresses of the IPv6 rows, in row order
+It is written once per trace as an uncompressed .npz and memory mapped when loaded,
+so profile builds never parse text.
+'''
+
+import struct
+import zipfile
+from array import array
+
+import numpy as np
+
+from ip_array import IPArray
+from pcap_parser import iter_packets, parse_packet, is_excluded
+
+SUMMARY_COLUMNS = ["ts", "family", "proto", "length", "sport", "dport", "src4", "dst4", "src6", "dst6"]
+
+
+'''
+Function: summarize_trace
+Reads a pcap/pcapng file once and builds its columnar summary.
+
+Parameters:
+    filename - str, path to the trace
+    exclude_noise - bool, leave out dns, mdns, arp and ssdp packets, default True
+Returns:
+    dictionary of {column: numpy array}, see SUMMARY_COLUMNS
+Example usage:
+    summary = summarize_trace("traces/google/google_trace1.pcap")
+'''
+def summarize_trace(filename, exclude_noise = True):
+    ts, family, proto, length = array("d"), array("B"), array("B"), array("I")
+    sport, dport = array("H"), array("H")
+    v4_addresses, v6_addresses = bytearray(), bytearray()
+    for linktype, timestamp, data, orig_len in iter_packets(filename):
+        decoded = parse_packet(linktype, data)
+        if decoded is None:
+            continue
+        src, dst, ip_proto, src_port, dst_port = decoded
+        if exclude_noise and is_excluded(ip_proto, src_port, dst_port):
+            continue
+        ts.append(timestamp)
+        proto.append(ip_proto)
+        length.append(orig_len)
+        sport.append(src_port or 0)
+        dport.append(dst_port or 0)
+        if len(src) == 4:
+            family.append(4)
+            v4_addresses += src + dst
+        else:
+            family.append(6)
+            v6_addresses += src + dst
+
+    v4 = np.frombuffer(bytes(v4_addresses), dtype=">u4").astype(np.uint32).reshape(-1, 2)
+    v6 = np.frombuffer(bytes(v6_addresses), dtype=">u8").astype(np.uint64).reshape(-1, 2, 2)
+    return {
+        "ts": np.frombuffer(ts, dtype=np.float64).copy(),
+        "family": np.frombuffer(family, dtype=np.uint8).copy(),
+        "proto": np.frombuffer(proto, dtype=np.uint8).copy(),
+        "length": np.frombuffer(length, dtype=np.uint32).copy(),
+        "sport": np.frombuffer(sport, dtype=np.uint16).copy(),
+        "dport": np.frombuffer(dport, dtype=np.uint16).copy(),
+        "src4": np.ascontiguousarray(v4[:, 0]),
+        "dst4": np.ascontiguousarray(v4[:, 1]),
+        "src6": np.ascontiguousarray(v6[:, 0]),
+        "dst6": np.ascontiguousarray(v6[:, 1]),
+    }
+
+
+'''
+Function: save_trace_summary
+Writes a summary as an uncompressed .npz so it can be memory mapped by load_trace_summary.
+'''
+def save_trace_summary(summary, path):
+    np.savez(path, **summary)
+
+
+'''
+Function: load_trace_summary
+Loads a summary written by save_trace_summary without copying the columns.
+
+Parameters:
+    path - str, path to the .npz file
+Returns:
+    dictionary of {column: numpy array}, the arrays are read only memory maps of the file
+Notes:
+    Compressed members (np.savez_compressed) can't be mapped and are read into memory instead
+'''
+def load_trace_summary(path):
+    summary = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    summary[name] = np.lib.format.read_array(member)
+                continue
+            # skip the local file header to find where the .npy data starts
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_len, extra_len = struct.unpack("<HH", local_header[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if int(np.prod(shape)) == 0:
+                summary[name] = np.zeros(shape, dtype=dtype)
+            else:
+                summary[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                          order="F" if fortran_order else "C")
+    return summary
+
+
+'''
+Function: summary_ip_array
+Returns every source and destination address of a summary as one IPArray.
+'''
+def summary_ip_array(summary):
+    return IPArray(np.concatenate([summary["src4"], summary["dst4"]]),
+                   np.concatenate([summary["src6"], summary["dst6"]]))
+
+
+'''
+Function: summary_trace_ips
+Counts how often every IP address shows up in a summary.
+
+Parameters:
+    summary - dictionary returned by summarize_trace or load_trace_summary
+Returns:
+    dictionary of {ip: count}, same format as get_traces.get_trace_ips
+'''
+def summary_trace_ips(summary):
+    unique_ips, (counts4, counts6) = summary_ip_array(summary).unique(return_counts = True)
+    counts = np.concatenate([counts4, counts6])
+    return {ip: int(count) for ip, count in zip(unique_ips.to_strings(), counts)}
+
+
+'''
+Function: write_trace_summary
+Summarizes a pcap and saves the summary next to the other trace files.
+
+Parameters:
+    pcap_path - str, path to the pcap
+    summary_path - str, path of the .npz to write
+    exclude_noise - bool, leave out dns, mdns, arp and ssdp packets, default True
+Returns:
+    the summary dictionary
+Example usage:
+    write_trace_summary("traces/google/google_trace1.pcap", "csv_files/google/google_trace1.npz")
+'''
+def write_trace_summary(pcap_path, summary_path, exclude_noise = True):
+    summary = summarize_trace(pcap_path, exclude_noise)
+    save_trace_summary(summary, summary_path)
+    return summary